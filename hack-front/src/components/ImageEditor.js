@@ -325,6 +325,8 @@ const ImageEditor = ({ imageUrl = 'http://94.154.128.76:9000/user-data/1/8e57a48
         
         // Extract points (all values after the class index)
         const points = parts.slice(1).map(parseFloat);
+        // Odd count: the last value is the detection confidence, not a coordinate
+        if (points.length % 2 === 1) points.pop();
         
         return {
           class: className,
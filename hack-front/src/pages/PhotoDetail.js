@@ -66,6 +66,8 @@ const PhotoDetail = () => {
         
         // Extract points (all values after the class index)
         const points = parts.slice(1).map(parseFloat);
+        // Odd count: the last value is the detection confidence, not a coordinate
+        if (points.length % 2 === 1) points.pop();
         
         return {
           class: className,
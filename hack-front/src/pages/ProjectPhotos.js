@@ -126,6 +126,23 @@ function ProjectPhotos() {
     }
   }, [fetchPhotos]);
   
+  // Live status updates instead of polling
+  useEffect(() => {
+    const source = new EventSource(`${PROXY_URL}/api/projects/${projectId}/events`);
+
+    source.addEventListener('file', (e) => {
+      const update = JSON.parse(e.data);
+      setPhotos(prev => prev.map(photo => photo.id === update.file_id
+        ? { ...photo, status: update.status, defect_count: update.defect_count, defects: update.defects }
+        : photo));
+    });
+    source.addEventListener('project', (e) => {
+      setProject(prev => ({ ...prev, ...JSON.parse(e.data) }));
+    });
+
+    return () => source.close();
+  }, [PROXY_URL, projectId]);
+
   // Handle changes to sort or filter - create a separate effect
   useEffect(() => {
     // Skip the initial render
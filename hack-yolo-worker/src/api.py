@@ -49,3 +49,9 @@ async def recognize_image(request: RecognizeRequest):
     
     logger.info(f"Recognition request accepted and added to queue: {payload}")
     return {}
+
+
+@app.get("/model", status_code=200)
+async def model_version():
+    """Версия загруженной модели (SHA-256 весов)"""
+    return {"model_version": WORKER.yolo_service.model_version}
@@ -7,6 +7,8 @@ class Config:
     def __init__(self):
         self.YOLO_MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 20))
         self.REPORT_URL = str(os.environ.get('REPORT_URL', 'http://0.0.0.0:5000'))
+        # Нижний порог уверенности при распознавании. Итоговый порог задается в проекте на сервере
+        self.YOLO_CAPTURE_CONF = float(os.environ.get('YOLO_CAPTURE_CONF', 0.05))
 
         self._validate_config()
 
@@ -52,6 +52,7 @@ class Worker():
                 "project_id": data['project_id'],
                 "file_id": data['image_id'],
                 "label": response,
+                "model_version": self.yolo_service.model_version,
             }
 
             with httpx.Client() as client:
@@ -1,13 +1,26 @@
 from ultralytics import YOLO
 import cv2
+import hashlib
 import numpy as np
 from typing import Union, List
 
+from config import CONFIG
+
 
 class YOLOv11SegPredictor:
     def __init__(self, model_path: str):
         self.model = YOLO(model_path)
         self.device = "cuda"
+        self.model_version = self.weights_hash(model_path)
+
+    @staticmethod
+    def weights_hash(model_path: str) -> str:
+        """SHA-256 файла весов - версия модели, которой получена разметка"""
+        digest = hashlib.sha256()
+        with open(model_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
 
     def predict(self, image: Union[str, np.ndarray, bytes]) -> str:
         if isinstance(image, str):
@@ -22,7 +35,8 @@ class YOLOv11SegPredictor:
         else:
             img = image
 
-        result = self.model(img)[0]
+        # Порог низкий: сервер хранит уверенность и отсекает по порогу проекта сам
+        result = self.model(img, conf=CONFIG.YOLO_CAPTURE_CONF)[0]
 
         names = self.model.names
 
@@ -30,8 +44,10 @@ class YOLOv11SegPredictor:
         if result.masks and result.masks.xyn:
             for i, polygon in enumerate(result.masks.xyn):
                 cls_id = int(result.boxes.cls[i])
+                conf = float(result.boxes.conf[i])
                 flat_coords = " ".join(f"{x:.6f} {y:.6f}" for x, y in polygon)
-                line = f"{cls_id} {flat_coords}"
+                # Уверенность последним числом строки, как в save_conf ultralytics
+                line = f"{cls_id} {flat_coords} {conf:.4f}"
                 lines.append(line)
 
         return "\n".join(lines)
\ No newline at end of file
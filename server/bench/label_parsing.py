@@ -0,0 +1,75 @@
+"""
+Микробенчмарк разбора YOLO-разметки (service/yolo_label.py): подсчет классов и вердикт при приеме результата -
+прежними двумя проходами по строкам и через parse_label, отдельно - материализация координат и ответ из кеша.
+
+Запуск из каталога server: PYTHONPATH=src uv run python bench/label_parsing.py
+"""
+import random
+import time
+from collections import defaultdict
+from typing import Callable
+
+from service.yolo_label import REFERENCE_CLASSES, parse_label
+
+# (объектов, вершин у каждого)
+SIZES = [(10, 50), (2000, 20), (50, 2000), (5, 20000)]
+# Сколько секунд гонять каждую функцию
+DURATION = 1.0
+
+
+def make_label(objects: int, vertices: int) -> str:
+    return "".join(f"{random.randint(0, 12)} " + " ".join(f"{random.random():.6f}" for _ in range(2 * vertices)) + "\n"
+                   for _ in range(objects))
+
+
+def old_ingest(text: str):
+    """Подсчет классов и вердикт до parse_label: два прохода split по строкам"""
+    counts = defaultdict(int)
+    for line in text.split("\n"):
+        parts = line.strip().split()
+        if parts:
+            counts[int(parts[0])] += 1
+    reference = {str(class_id) for class_id in REFERENCE_CLASSES}
+    verdict = False
+    for line in text.split("\n"):
+        parts = line.strip().split()
+        if parts and parts[0] not in reference:
+            verdict = True
+    return counts, verdict
+
+
+def new_ingest(text: str):
+    label = parse_label.__wrapped__(text)  # Без lru_cache: каждый вызов разбирает текст заново
+    return label.class_counts(), label.has_defects()
+
+
+def new_coords(text: str):
+    return parse_label.__wrapped__(text).coords
+
+
+def cached(text: str):
+    label = parse_label(text)
+    return label.class_counts(), label.has_defects(), label.coords
+
+
+def measure(fn: Callable[[str], object], text: str) -> float:
+    """Среднее время вызова, мс"""
+    fn(text)
+    start = time.perf_counter()
+    calls = 0
+    while time.perf_counter() - start < DURATION:
+        fn(text)
+        calls += 1
+    return (time.perf_counter() - start) / calls * 1000
+
+
+def main():
+    random.seed(1)
+    for objects, vertices in SIZES:
+        text = make_label(objects, vertices)
+        timings = "  ".join(f"{fn.__name__} {measure(fn, text):7.3f}ms" for fn in (old_ingest, new_ingest, new_coords, cached))
+        print(f"{objects:5} objects x {vertices:5} vertices ({len(text) // 1024:5} KB): {timings}")
+
+
+if __name__ == "__main__":
+    main()
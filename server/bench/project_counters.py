@@ -0,0 +1,61 @@
+"""
+Бенчмарк счетчиков файлов проекта (триггеры project_files, миграция 008): N загрузок и N смен статуса
+отдельными транзакциями, как их делает приложение, и N файлов одним INSERT. В конце сверяет счетчики проекта
+с COUNT(*) и удаляет свои проекты.
+
+Прежние построчные триггеры пересчитывали весь проект на каждую строку - для сравнения запустить
+на базе, мигрированной до 007 включительно (yoyo apply --revision 007__project_defect_stats), и на текущей.
+Гонять на отдельной базе, не на рабочей.
+
+Запуск из каталога server с config.yml: PYTHONPATH=src uv run python bench/project_counters.py [N]
+"""
+import asyncio
+import sys
+import time
+
+import asyncpg
+
+from utils.config import CONFIG
+
+FILES = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+INSERT_FILE = """
+    INSERT INTO project_files(project_id, filename, s3_path, s3_url, s3_icon_path, s3_icon_url, s3_txt_path, s3_txt_url)
+    VALUES ($1, $2, 'p', 'u', 'i', 'iu', '', '') RETURNING id
+"""
+
+
+async def main():
+    db = CONFIG.db
+    conn = await asyncpg.connect(user=db.username, password=db.password, host=db.host, port=db.port, database=db.database)
+    try:
+        project_id = await conn.fetchval("INSERT INTO projects(name) VALUES ('bench-counters') RETURNING id")
+        bulk_project_id = await conn.fetchval("INSERT INTO projects(name) VALUES ('bench-counters-bulk') RETURNING id")
+
+        start = time.perf_counter()
+        ids = [await conn.fetchval(INSERT_FILE, project_id, f"f{i}") for i in range(FILES)]
+        inserted = time.perf_counter()
+        for file_id in ids:
+            await conn.execute("UPDATE project_files SET status = 'success' WHERE id = $1", file_id)
+        updated = time.perf_counter()
+        await conn.execute("""
+            INSERT INTO project_files(project_id, filename, s3_path, s3_url, s3_icon_path, s3_icon_url, s3_txt_path, s3_txt_url)
+            SELECT $1, 'f' || i, 'p', 'u', 'i', 'iu', '', '' FROM generate_series(1, $2) i
+        """, bulk_project_id, FILES)
+        bulk = time.perf_counter()
+
+        print(f"{FILES} files: insert per row {inserted - start:.2f}s, status update per row {updated - inserted:.2f}s, "
+              f"single INSERT {bulk - updated:.2f}s")
+        for row in await conn.fetch("""
+            SELECT p.id, p.count_of_files, p.success_files, p.status_files, COUNT(f.id) AS actual
+            FROM projects p LEFT JOIN project_files f ON f.project_id = p.id
+            WHERE p.id = ANY($1) GROUP BY p.id ORDER BY p.id
+        """, [project_id, bulk_project_id]):
+            print(dict(row))
+    finally:
+        await conn.execute("DELETE FROM projects WHERE name LIKE 'bench-counters%'")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Бенчмарк приема результатов распознавания (YoloResultService.analysis_yolo_txt -> ProjectFile.save_recognition):
+результатов в секунду по одному и по CONCURRENCY параллельно в один проект, затем повторный параллельный прием
+по тем же файлам (статусы не меняются). S3 заменен заглушкой с задержкой PUT, пересчет отчетов выключен.
+В конце сверяет счетчики задачи и проекта со статистикой дефектов и удаляет свой проект.
+Гонять на отдельной базе, не на рабочей.
+
+Запуск из каталога server с config.yml: PYTHONPATH=src uv run python bench/recognition_ingest.py [N] [задержка PUT, с]
+"""
+import asyncio
+import random
+import sys
+import time
+
+from sqlalchemy import text
+
+import service.panda_service as panda_service
+from dao.base import session_factory
+from utils.config import CONFIG
+
+FILES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+S3_LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+CONCURRENCY = 16
+
+
+class DelayedS3:
+    def url(self, filename: str) -> str:
+        return f"http://s3/bench/{filename}"
+
+    def write_bytes(self, filename: str, content: bytes, content_type: str) -> str:
+        time.sleep(S3_LATENCY)
+        return self.url(filename)
+
+
+def make_label() -> str:
+    return "".join(f"{random.randint(0, 12)} 0.5 0.5 0.6 0.5 0.6 0.6 {random.random():.3f}\n"
+                   for _ in range(random.randint(1, 8)))
+
+
+async def query(sql: str, **params):
+    async with session_factory.async_sessionmaker() as session:
+        result = await session.execute(text(sql), params)
+        await session.commit()
+        return result
+
+
+async def ingest(file_ids: list[int], labels: dict[int, str], concurrency: int) -> float:
+    """Результатов в секунду"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(file_id: int):
+        async with semaphore:
+            await panda_service.YoloResultService().analysis_yolo_txt(file_id, labels[file_id])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(file_id) for file_id in file_ids))
+    return len(file_ids) / (time.perf_counter() - start)
+
+
+async def main():
+    CONFIG.report.pregenerate = False
+    panda_service.get_s3 = DelayedS3
+    random.seed(1)
+
+    project_id = (await query("INSERT INTO projects(name) VALUES ('bench-ingest') RETURNING id")).scalar()
+    try:
+        job_id = (await query("INSERT INTO project_jobs(project_id, type, status, total) "
+                              "VALUES (:project_id, 'recognition', 'running', :total) RETURNING id",
+                              project_id=project_id, total=FILES)).scalar()
+        file_ids = (await query("""
+            INSERT INTO project_files(project_id, filename, s3_path, s3_url, s3_icon_path, s3_icon_url, s3_txt_path,
+                                      s3_txt_url, job_id)
+            SELECT :project_id, 'f' || i, 'bench/f' || i || '.jpg', 'u', 'i', 'iu', '', '', :job_id
+            FROM generate_series(1, :files) i
+            RETURNING id
+        """, project_id=project_id, job_id=job_id, files=FILES)).scalars().all()
+        labels = {file_id: make_label() for file_id in file_ids}
+        half = len(file_ids) // 2
+
+        print(f"sequential:        {await ingest(file_ids[:half], labels, 1):6.1f} results/s")
+        print(f"{CONCURRENCY} concurrent:     {await ingest(file_ids[half:], labels, CONCURRENCY):6.1f} results/s")
+        print(f"{CONCURRENCY} concurrent, again: {await ingest(file_ids, labels, CONCURRENCY):6.1f} results/s")
+
+        job = (await query("SELECT done, status FROM project_jobs WHERE id = :id", id=job_id)).first()
+        project = (await query("SELECT count_of_files, error_files, success_files, processing_files FROM projects "
+                               "WHERE id = :id", id=project_id)).first()
+        stats = (await query("SELECT SUM(count) FROM project_defect_stats WHERE project_id = :id", id=project_id)).scalar()
+        files = (await query("SELECT SUM(defect_count) FROM project_files WHERE project_id = :id", id=project_id)).scalar()
+        print(f"job {tuple(job)}, project counters {tuple(project)}, defect stats {stats}, file defects {files}")
+    finally:
+        await query("DELETE FROM projects WHERE id = :id", id=project_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
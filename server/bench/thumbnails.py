@@ -0,0 +1,62 @@
+"""
+Бенчмарк превью загружаемых изображений (service/image_service.py): прежняя иконка полным декодированием,
+прежний вариант иконки и превью двумя декодированиями и make_thumbnails - одно декодирование в draft-режиме
+на все размеры. Один процесс, снимки 4000x3000 JPEG в оттенках серого и RGB.
+
+Запуск из каталога server с config.yml: PYTHONPATH=src uv run python bench/thumbnails.py
+"""
+import os
+import tempfile
+import time
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+from service.image_service import PREVIEW, make_thumbnails
+
+WIDTH, HEIGHT = 4000, 3000
+REPEATS = 10
+
+
+def old_icon(temp_dir: str, filename: str):
+    """Иконка до make_thumbnails: полное декодирование, центральный квадрат, thumbnail 100x100"""
+    with Image.open(os.path.join(temp_dir, filename)) as img:
+        if img.mode in ('RGBA', 'P'):
+            img = img.convert('RGB')
+        width, height = img.size
+        side = min(width, height)
+        img = img.crop(((width - side) / 2, (height - side) / 2, (width + side) / 2, (height + side) / 2))
+        img.thumbnail((100, 100))
+        img.save(os.path.join(temp_dir, "icon_" + filename))
+
+
+def old_icon_and_preview(temp_dir: str, filename: str):
+    """Те же иконка и превью, но каждое своим декодированием"""
+    old_icon(temp_dir, filename)
+    with Image.open(os.path.join(temp_dir, filename)) as img:
+        img.thumbnail((PREVIEW.size, PREVIEW.size))
+        img.save(os.path.join(temp_dir, "preview_old.webp"), PREVIEW.format, quality=PREVIEW.quality, method=2)
+
+
+def measure(fn: Callable[[str, str], object], temp_dir: str, filename: str) -> float:
+    """Среднее время вызова, мс"""
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn(temp_dir, filename)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+
+def main():
+    pixels = (np.random.default_rng(1).random((HEIGHT, WIDTH)) * 255).astype(np.uint8)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Image.fromarray(pixels).save(os.path.join(temp_dir, "grey.jpg"), quality=92)
+        Image.fromarray(pixels).convert("RGB").save(os.path.join(temp_dir, "rgb.jpg"), quality=92)
+        for filename in ("grey.jpg", "rgb.jpg"):
+            timings = "  ".join(f"{fn.__name__} {measure(fn, temp_dir, filename):6.0f}ms"
+                                for fn in (old_icon, old_icon_and_preview, make_thumbnails))
+            print(f"{filename:9} {timings}")
+
+
+if __name__ == "__main__":
+    main()
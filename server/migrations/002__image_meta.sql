@@ -0,0 +1,6 @@
+-- Метаданные изображения и WebP-превью для галереи
+ALTER TABLE project_files ADD COLUMN s3_preview_path VARCHAR DEFAULT NULL;
+ALTER TABLE project_files ADD COLUMN s3_preview_url VARCHAR DEFAULT NULL;
+ALTER TABLE project_files ADD COLUMN width INTEGER DEFAULT NULL;
+ALTER TABLE project_files ADD COLUMN height INTEGER DEFAULT NULL;
+ALTER TABLE project_files ADD COLUMN image_format VARCHAR(16) DEFAULT NULL;
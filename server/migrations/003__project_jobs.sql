@@ -0,0 +1,23 @@
+-- Фоновые задачи по проекту (пакетная обработка, выгрузки и т.п.)
+CREATE TYPE job_status_type AS ENUM ('queued', 'running', 'done', 'failed');
+
+CREATE TABLE project_jobs (
+    id SERIAL PRIMARY KEY,
+    project_id INTEGER REFERENCES projects(id) ON DELETE SET NULL,
+    type VARCHAR(32) NOT NULL,
+    status job_status_type NOT NULL DEFAULT 'queued',
+    total INTEGER NOT NULL DEFAULT 0,
+    dispatched INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error VARCHAR DEFAULT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP DEFAULT NULL
+);
+
+CREATE INDEX idx_project_jobs_project_id ON project_jobs(project_id);
+
+-- Задача, в рамках которой файл отправлен на распознавание
+ALTER TABLE project_files ADD COLUMN job_id INTEGER REFERENCES project_jobs(id) ON DELETE SET NULL;
+CREATE INDEX idx_project_files_job_id ON project_files(job_id);
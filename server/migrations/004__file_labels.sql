@@ -0,0 +1,7 @@
+-- Разметка YOLO в БД (сжатая zlib), S3 остается копией для выгрузки
+CREATE TABLE file_labels (
+    file_id INTEGER PRIMARY KEY REFERENCES project_files(id) ON DELETE CASCADE,
+    label BYTEA NOT NULL,
+    label_hash VARCHAR(64) NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,2 @@
+-- Версия разметки, по которой построен закешированный отчет .pdf
+ALTER TABLE project_files ADD COLUMN report_label_hash VARCHAR(64) DEFAULT NULL;
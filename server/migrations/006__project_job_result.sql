@@ -0,0 +1,2 @@
+-- Ссылка на результат задачи (например, отчет по проекту в S3)
+ALTER TABLE project_jobs ADD COLUMN result_url VARCHAR DEFAULT NULL;
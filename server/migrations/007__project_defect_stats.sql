@@ -0,0 +1,89 @@
+-- Статистика дефектов по проекту и классу, поддерживается инкрементально триггерами на file_defects
+ALTER TABLE file_defects ADD COLUMN project_id INTEGER;
+UPDATE file_defects d SET project_id = f.project_id FROM project_files f WHERE f.id = d.file_id;
+ALTER TABLE file_defects ALTER COLUMN project_id SET NOT NULL;
+CREATE INDEX idx_file_defects_file_id ON file_defects(file_id);
+
+-- project_id дефекта берем из файла, если его не передали явно
+CREATE OR REPLACE FUNCTION file_defects_set_project_id()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.project_id IS NULL THEN
+        SELECT project_id INTO NEW.project_id FROM project_files WHERE id = NEW.file_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER file_defects_project_id
+BEFORE INSERT ON file_defects
+FOR EACH ROW EXECUTE FUNCTION file_defects_set_project_id();
+
+CREATE TABLE project_defect_stats (
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    class_id INTEGER NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,  -- количество дефектов класса
+    files INTEGER NOT NULL DEFAULT 0, -- количество файлов, где класс встречается
+    PRIMARY KEY (project_id, class_id)
+);
+
+INSERT INTO project_defect_stats (project_id, class_id, count, files)
+SELECT project_id, class_id, SUM(count), COUNT(*)
+FROM file_defects
+GROUP BY project_id, class_id;
+
+-- Триггеры уровня оператора: дельта считается один раз на пачку строк через transition tables
+CREATE OR REPLACE FUNCTION project_defect_stats_add()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO project_defect_stats (project_id, class_id, count, files)
+    SELECT project_id, class_id, SUM(COALESCE(count, 0)), COUNT(*)
+    FROM new_defects
+    GROUP BY project_id, class_id
+    ON CONFLICT (project_id, class_id) DO UPDATE
+    SET count = project_defect_stats.count + EXCLUDED.count,
+        files = project_defect_stats.files + EXCLUDED.files;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION project_defect_stats_remove()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Только UPDATE: при каскадном удалении проекта строки статистики уже удалены
+    UPDATE project_defect_stats s
+    SET count = s.count - d.count,
+        files = s.files - d.files
+    FROM (
+        SELECT project_id, class_id, SUM(COALESCE(count, 0)) AS count, COUNT(*) AS files
+        FROM old_defects
+        GROUP BY project_id, class_id
+    ) d
+    WHERE s.project_id = d.project_id AND s.class_id = d.class_id;
+
+    DELETE FROM project_defect_stats s
+    USING (SELECT DISTINCT project_id, class_id FROM old_defects) d
+    WHERE s.project_id = d.project_id AND s.class_id = d.class_id AND s.files <= 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER project_defect_stats_insert
+AFTER INSERT ON file_defects
+REFERENCING NEW TABLE AS new_defects
+FOR EACH STATEMENT EXECUTE FUNCTION project_defect_stats_add();
+
+CREATE TRIGGER project_defect_stats_delete
+AFTER DELETE ON file_defects
+REFERENCING OLD TABLE AS old_defects
+FOR EACH STATEMENT EXECUTE FUNCTION project_defect_stats_remove();
+
+CREATE TRIGGER project_defect_stats_update_remove
+AFTER UPDATE ON file_defects
+REFERENCING OLD TABLE AS old_defects
+FOR EACH STATEMENT EXECUTE FUNCTION project_defect_stats_remove();
+
+CREATE TRIGGER project_defect_stats_update_add
+AFTER UPDATE ON file_defects
+REFERENCING NEW TABLE AS new_defects
+FOR EACH STATEMENT EXECUTE FUNCTION project_defect_stats_add();
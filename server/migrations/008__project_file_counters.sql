@@ -0,0 +1,138 @@
+-- Счетчики файлов проекта по статусам вместо пересчета COUNT(*) на каждую строку project_files
+ALTER TABLE projects ADD COLUMN processing_files INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE projects ADD COLUMN error_files INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE projects ADD COLUMN success_files INTEGER NOT NULL DEFAULT 0;
+
+DROP TRIGGER IF EXISTS update_project_stats ON project_files;
+DROP FUNCTION IF EXISTS update_project_files_stats();
+
+UPDATE projects p
+SET count_of_files = fs.total,
+    processing_files = fs.processing_count,
+    error_files = fs.error_count,
+    success_files = fs.success_count
+FROM (
+    SELECT
+        project_id,
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE status = 'processing') AS processing_count,
+        COUNT(*) FILTER (WHERE status = 'error') AS error_count,
+        COUNT(*) FILTER (WHERE status = 'success') AS success_count
+    FROM project_files
+    GROUP BY project_id
+) fs
+WHERE p.id = fs.project_id;
+
+-- Статус проекта выводится из счетчиков
+CREATE OR REPLACE FUNCTION project_files_status(error_files INTEGER, processing_files INTEGER)
+RETURNS project_files_status_type AS $$
+    SELECT CASE
+        WHEN error_files > 0 THEN 'error'::project_files_status_type
+        WHEN processing_files > 0 THEN 'processing'::project_files_status_type
+        ELSE 'success'::project_files_status_type
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+UPDATE projects SET status_files = project_files_status(error_files, processing_files);
+
+-- Применяет дельту счетчиков к проекту. Нулевая дельта (UPDATE без смены статуса) строку projects не блокирует
+CREATE OR REPLACE FUNCTION apply_project_files_delta(
+    delta_project_id INTEGER, total INTEGER, processing_count INTEGER, error_count INTEGER, success_count INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    IF total = 0 AND processing_count = 0 AND error_count = 0 AND success_count = 0 THEN
+        RETURN;
+    END IF;
+
+    UPDATE projects
+    SET count_of_files = count_of_files + total,
+        processing_files = processing_files + processing_count,
+        error_files = error_files + error_count,
+        success_files = success_files + success_count,
+        status_files = project_files_status(error_files + error_count, processing_files + processing_count)
+    WHERE id = delta_project_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня оператора: дельта по проекту считается один раз на оператор,
+-- +1 за каждую новую строку и -1 за каждую старую
+CREATE OR REPLACE FUNCTION project_files_counters_insert()
+RETURNS TRIGGER AS $$
+DECLARE
+    d RECORD;
+BEGIN
+    FOR d IN
+        SELECT
+            project_id,
+            SUM(diff)::INTEGER AS total,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'processing'), 0)::INTEGER AS processing_count,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'error'), 0)::INTEGER AS error_count,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'success'), 0)::INTEGER AS success_count
+        FROM (SELECT project_id, status, 1 AS diff FROM new_files) c
+        GROUP BY project_id
+    LOOP
+        PERFORM apply_project_files_delta(d.project_id, d.total, d.processing_count, d.error_count, d.success_count);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION project_files_counters_delete()
+RETURNS TRIGGER AS $$
+DECLARE
+    d RECORD;
+BEGIN
+    FOR d IN
+        SELECT
+            project_id,
+            SUM(diff)::INTEGER AS total,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'processing'), 0)::INTEGER AS processing_count,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'error'), 0)::INTEGER AS error_count,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'success'), 0)::INTEGER AS success_count
+        FROM (SELECT project_id, status, -1 AS diff FROM old_files) c
+        GROUP BY project_id
+    LOOP
+        PERFORM apply_project_files_delta(d.project_id, d.total, d.processing_count, d.error_count, d.success_count);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION project_files_counters_update()
+RETURNS TRIGGER AS $$
+DECLARE
+    d RECORD;
+BEGIN
+    FOR d IN
+        SELECT
+            project_id,
+            SUM(diff)::INTEGER AS total,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'processing'), 0)::INTEGER AS processing_count,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'error'), 0)::INTEGER AS error_count,
+            COALESCE(SUM(diff) FILTER (WHERE status = 'success'), 0)::INTEGER AS success_count
+        FROM (SELECT project_id, status, 1 AS diff FROM new_files
+              UNION ALL
+              SELECT project_id, status, -1 AS diff FROM old_files) c
+        GROUP BY project_id
+    LOOP
+        PERFORM apply_project_files_delta(d.project_id, d.total, d.processing_count, d.error_count, d.success_count);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER project_files_counters_insert
+AFTER INSERT ON project_files
+REFERENCING NEW TABLE AS new_files
+FOR EACH STATEMENT EXECUTE FUNCTION project_files_counters_insert();
+
+CREATE TRIGGER project_files_counters_update
+AFTER UPDATE ON project_files
+REFERENCING OLD TABLE AS old_files NEW TABLE AS new_files
+FOR EACH STATEMENT EXECUTE FUNCTION project_files_counters_update();
+
+CREATE TRIGGER project_files_counters_delete
+AFTER DELETE ON project_files
+REFERENCING OLD TABLE AS old_files
+FOR EACH STATEMENT EXECUTE FUNCTION project_files_counters_delete();
@@ -0,0 +1,12 @@
+-- Индексы под keyset-пагинацию списков файлов и проектов
+UPDATE project_files SET defect_count = 0 WHERE defect_count IS NULL;
+ALTER TABLE project_files ALTER COLUMN defect_count SET NOT NULL;
+
+-- Файлы проекта: ORDER BY defect_count DESC, id DESC
+CREATE INDEX idx_project_files_defect_order ON project_files(project_id, defect_count DESC, id DESC);
+CREATE INDEX idx_project_files_status_defect_order ON project_files(project_id, status, defect_count DESC, id DESC);
+
+-- Проекты: ORDER BY created_at DESC, id DESC
+DROP INDEX IF EXISTS idx_projects_created_at;
+CREATE INDEX idx_projects_created_order ON projects(created_at DESC, id DESC);
+CREATE INDEX idx_projects_status_files_created_order ON projects(status_files, created_at DESC, id DESC);
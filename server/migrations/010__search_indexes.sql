@@ -0,0 +1,9 @@
+-- Поиск по подстроке в именах файлов и проектов через триграммы (ILIKE '%...%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX idx_project_files_filename_trgm ON project_files USING gin (filename gin_trgm_ops);
+CREATE INDEX idx_projects_name_trgm ON projects USING gin (name gin_trgm_ops);
+
+-- Поиск по префиксу без учета регистра: диапазон по lower(...) в побайтовом порядке
+CREATE INDEX idx_project_files_filename_prefix ON project_files (project_id, lower(filename) text_pattern_ops);
+CREATE INDEX idx_projects_name_prefix ON projects (lower(name) text_pattern_ops);
@@ -0,0 +1,23 @@
+-- Одна строка дефектов на (файл, класс): нужна для пакетного upsert результата распознавания
+WITH duplicates AS (
+    DELETE FROM file_defects d
+    USING (
+        SELECT file_id, class_id, MIN(id) AS keep_id
+        FROM file_defects
+        GROUP BY file_id, class_id
+        HAVING COUNT(*) > 1
+    ) k
+    WHERE d.file_id = k.file_id AND d.class_id = k.class_id AND d.id <> k.keep_id
+    RETURNING d.file_id, d.class_id, d.count
+)
+UPDATE file_defects f
+SET count = f.count + s.count
+FROM (
+    SELECT file_id, class_id, SUM(COALESCE(count, 0)) AS count
+    FROM duplicates
+    GROUP BY file_id, class_id
+) s
+WHERE f.file_id = s.file_id AND f.class_id = s.class_id;
+
+DROP INDEX IF EXISTS idx_file_defects_file_id;
+CREATE UNIQUE INDEX idx_file_defects_file_class ON file_defects(file_id, class_id);
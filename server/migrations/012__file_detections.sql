@@ -0,0 +1,24 @@
+-- Геометрия каждого объекта разметки, считается при сохранении результата распознавания
+CREATE TABLE file_detections (
+    id BIGSERIAL PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES project_files(id) ON DELETE CASCADE,
+    class_id SMALLINT NOT NULL,
+    area_ratio REAL NOT NULL,  -- Доля площади изображения
+    -- В пикселях изображения, NULL - размеры изображения неизвестны
+    area REAL,
+    perimeter REAL,
+    max_extent REAL,
+    bbox_x REAL,
+    bbox_y REAL,
+    bbox_w REAL,
+    bbox_h REAL
+);
+
+CREATE INDEX idx_file_detections_file_id ON file_detections(file_id);
+
+-- Агрегаты по дефектам файла (без эталонных классов) для фильтров и сортировки списка
+ALTER TABLE project_files ADD COLUMN max_defect_area REAL NOT NULL DEFAULT 0;
+ALTER TABLE project_files ADD COLUMN total_defect_area REAL NOT NULL DEFAULT 0;
+
+CREATE INDEX idx_project_files_max_area_order ON project_files(project_id, max_defect_area DESC, id DESC);
+CREATE INDEX idx_project_files_total_area_order ON project_files(project_id, total_defect_area DESC, id DESC);
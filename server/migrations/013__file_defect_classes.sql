@@ -0,0 +1,14 @@
+-- Классы дефектов файла одним массивом: фильтры "есть все из" / "нет ни одного из" идут по GIN-индексу без join с file_defects
+ALTER TABLE project_files ADD COLUMN defect_classes SMALLINT[] NOT NULL DEFAULT '{}';
+
+UPDATE project_files f
+SET defect_classes = d.classes
+FROM (
+    SELECT file_id, array_agg(class_id::SMALLINT ORDER BY class_id) AS classes
+    FROM file_defects
+    WHERE count > 0
+    GROUP BY file_id
+) d
+WHERE f.id = d.file_id;
+
+CREATE INDEX idx_project_files_defect_classes ON project_files USING GIN (defect_classes);
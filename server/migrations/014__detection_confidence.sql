@@ -0,0 +1,5 @@
+-- Уверенность модели по каждому объекту и порог проекта: смена порога пересчитывает дефекты файлов в БД без повторного распознавания
+ALTER TABLE file_detections ADD COLUMN confidence REAL;  -- NULL - разметка без уверенности, проходит любой порог
+
+ALTER TABLE projects ADD COLUMN confidence_threshold DOUBLE PRECISION
+    CHECK (confidence_threshold IS NULL OR confidence_threshold BETWEEN 0 AND 1);  -- NULL - учитываются все объекты
@@ -0,0 +1,6 @@
+-- Версия модели (SHA-256 весов), которой получен текущий результат файла. NULL - результата текущей модели нет
+ALTER TABLE project_files ADD COLUMN model_version VARCHAR(64);
+
+-- Файлы задачи выбираются страницами по id (досчет идет часами, держать курсор открытым нельзя)
+DROP INDEX IF EXISTS idx_project_files_job_id;
+CREATE INDEX idx_project_files_job_order ON project_files(job_id, id);
@@ -0,0 +1,65 @@
+-- Изображения по содержимому: одинаковые загрузки делят объект S3 и превью.
+-- ref_count - количество файлов проектов со ссылкой на изображение, поддерживается триггерами
+CREATE TABLE blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    size BIGINT NOT NULL,
+    s3_path VARCHAR NOT NULL,
+    s3_url VARCHAR NOT NULL,
+    s3_icon_path VARCHAR NOT NULL,
+    s3_icon_url VARCHAR NOT NULL,
+    s3_preview_path VARCHAR,
+    s3_preview_url VARCHAR,
+    width INTEGER,
+    height INTEGER,
+    image_format VARCHAR(16),
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Кандидаты на удаление (ссылок не осталось)
+CREATE INDEX idx_blobs_unreferenced ON blobs(sha256) WHERE ref_count <= 0;
+
+-- NULL - файл загружен до появления blobs, объекты S3 принадлежат только ему
+ALTER TABLE project_files ADD COLUMN content_hash CHAR(64) REFERENCES blobs(sha256);
+CREATE INDEX idx_project_files_content_hash ON project_files(content_hash) WHERE content_hash IS NOT NULL;
+
+-- content_hash файла не меняется, поэтому достаточно вставки и удаления
+CREATE OR REPLACE FUNCTION blobs_ref_insert() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE blobs b
+    SET ref_count = b.ref_count + n.refs
+    FROM (
+        SELECT content_hash, COUNT(*)::INTEGER AS refs
+        FROM new_rows
+        WHERE content_hash IS NOT NULL
+        GROUP BY content_hash
+    ) n
+    WHERE b.sha256 = n.content_hash;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION blobs_ref_delete() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE blobs b
+    SET ref_count = b.ref_count - o.refs
+    FROM (
+        SELECT content_hash, COUNT(*)::INTEGER AS refs
+        FROM old_rows
+        WHERE content_hash IS NOT NULL
+        GROUP BY content_hash
+    ) o
+    WHERE b.sha256 = o.content_hash;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER project_files_blobs_insert
+    AFTER INSERT ON project_files
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION blobs_ref_insert();
+
+CREATE TRIGGER project_files_blobs_delete
+    AFTER DELETE ON project_files
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION blobs_ref_delete();
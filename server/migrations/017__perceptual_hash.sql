@@ -0,0 +1,26 @@
+-- Перцептивный хеш изображения (64-битный dHash) для поиска повторных снимков, отличающихся побайтно.
+-- NULL - файл загружен до появления хеша
+ALTER TABLE blobs ADD COLUMN phash BIGINT;
+ALTER TABLE project_files ADD COLUMN phash BIGINT;
+
+-- Поиск по расстоянию Хэмминга (multi-index hashing): хеш делится на 4 полосы по 16 бит с индексом на каждую.
+-- У хешей на расстоянии до 7 хотя бы одна полоса совпадает или отличается на 1 бит - кандидаты берутся
+-- по индексам полос, точное расстояние считается только для них
+ALTER TABLE project_files ADD COLUMN phash_band0 INTEGER GENERATED ALWAYS AS (((phash >> 48) & 65535)::INTEGER) STORED;
+ALTER TABLE project_files ADD COLUMN phash_band1 INTEGER GENERATED ALWAYS AS (((phash >> 32) & 65535)::INTEGER) STORED;
+ALTER TABLE project_files ADD COLUMN phash_band2 INTEGER GENERATED ALWAYS AS (((phash >> 16) & 65535)::INTEGER) STORED;
+ALTER TABLE project_files ADD COLUMN phash_band3 INTEGER GENERATED ALWAYS AS ((phash & 65535)::INTEGER) STORED;
+
+CREATE INDEX idx_project_files_phash_band0 ON project_files(project_id, phash_band0) WHERE phash IS NOT NULL;
+CREATE INDEX idx_project_files_phash_band1 ON project_files(project_id, phash_band1) WHERE phash IS NOT NULL;
+CREATE INDEX idx_project_files_phash_band2 ON project_files(project_id, phash_band2) WHERE phash IS NOT NULL;
+CREATE INDEX idx_project_files_phash_band3 ON project_files(project_id, phash_band3) WHERE phash IS NOT NULL;
+
+-- Результат скопирован с почти такого же снимка без распознавания; сбрасывается, когда приходит свой результат
+ALTER TABLE project_files ADD COLUMN near_duplicate_of INTEGER REFERENCES project_files(id) ON DELETE SET NULL;
+CREATE INDEX idx_project_files_near_duplicate_of ON project_files(near_duplicate_of) WHERE near_duplicate_of IS NOT NULL;
+
+-- Порог расстояния Хэмминга, в пределах которого новый файл получает результат распознанного снимка проекта.
+-- NULL - каждый файл распознается сам
+ALTER TABLE projects ADD COLUMN near_duplicate_distance SMALLINT
+    CHECK (near_duplicate_distance IS NULL OR near_duplicate_distance BETWEEN 0 AND 7);
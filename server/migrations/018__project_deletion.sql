@@ -0,0 +1,3 @@
+-- Проект удаляется фоновой задачей: с момента запроса он скрыт из списков и API,
+-- пока задача удаляет его объекты в S3, а затем строки
+ALTER TABLE projects ADD COLUMN deleted_at TIMESTAMP;
@@ -0,0 +1,14 @@
+-- Время загрузки файла: по нему выгрузка для аналитики делится на партиции по дням.
+-- У старых файлов точного времени нет - берется время последнего результата, иначе создания проекта
+ALTER TABLE project_files ADD COLUMN created_at TIMESTAMP;
+
+UPDATE project_files f
+SET created_at = COALESCE((SELECT l.updated_at FROM file_labels l WHERE l.file_id = f.id), p.created_at)
+FROM projects p
+WHERE p.id = f.project_id;
+
+ALTER TABLE project_files ALTER COLUMN created_at SET DEFAULT NOW();
+ALTER TABLE project_files ALTER COLUMN created_at SET NOT NULL;
+
+-- Выгрузка идет по проекту в порядке загрузки: строки одного дня приходят подряд
+CREATE INDEX idx_project_files_created_order ON project_files(project_id, created_at, id);
@@ -0,0 +1,6 @@
+-- Порог уверенности по умолчанию 0.25 - порог, с которым распознавали до хранения уверенности (по умолчанию в ultralytics).
+-- Воркер теперь сохраняет объекты от YOLO_CAPTURE_CONF (0.05): проект без порога считал бы их все дефектами.
+-- NULL по-прежнему можно задать явно - учитываются все объекты
+ALTER TABLE projects ALTER COLUMN confidence_threshold SET DEFAULT 0.25;
+
+UPDATE projects SET confidence_threshold = 0.25 WHERE confidence_threshold IS NULL;
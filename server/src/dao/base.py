@@ -1,13 +1,16 @@
 import contextvars
 import functools
 import threading
-from typing import Any, Callable, Optional, TypeVar
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
 from utils.config import CONFIG
+from utils.metrics import DB_QUERY_SECONDS
 
 Base = declarative_base()
 
@@ -19,6 +22,55 @@ engine = create_engine(f"postgresql+psycopg2://{db_config.username}:{db_config.p
 # Async engine
 async_engine = create_async_engine(f"postgresql+asyncpg://{db_config.username}:{db_config.password}@{db_config.host}:{db_config.port}/{db_config.database}")
 
+# Соединения без транзакции: каждый запрос фиксируется сам, BEGIN и COMMIT на сервер не отправляются
+autocommit_engine = async_engine.execution_options(isolation_level="AUTOCOMMIT")
+
+
+@dataclass
+class QueryStats:
+    """Запросы к БД за HTTP-запрос (rest.db_stats.DbStatsMiddleware): число, суммарное время и самые долгие"""
+    keep: int  # Сколько самых долгих запросов запоминать
+    count: int = 0
+    duration: float = 0.0  # Секунды
+    slowest: List[Tuple[float, str]] = field(default_factory=list)  # (секунды, SQL) по убыванию времени
+
+    def add(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        if self.keep and (len(self.slowest) < self.keep or duration > self.slowest[-1][0]):
+            self.slowest.append((duration, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[self.keep:]
+
+
+# Статистика текущего HTTP-запроса; задачи с пустым контекстом (фоновые, отчеты) в нее не попадают
+query_stats = contextvars.ContextVar[Optional[QueryStats]]("query_stats", default=None)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    DB_QUERY_SECONDS.observe(duration)
+    stats = query_stats.get()
+    if stats is not None:
+        stats.add(statement, duration)
+
+
+@event.listens_for(engine, "handle_error")
+@event.listens_for(async_engine.sync_engine, "handle_error")
+def _handle_error(context):
+    # Упавший запрос не доходит до after_cursor_execute
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
 
 class SessionFactory:
     def __init__(self):
@@ -28,6 +80,7 @@ class SessionFactory:
 
         # Async session maker
         self.async_sessionmaker = async_sessionmaker(async_engine, expire_on_commit=False)
+        self.async_read_sessionmaker = async_sessionmaker(autocommit_engine, expire_on_commit=False)
         self.async_context_var = contextvars.ContextVar[Optional[AsyncSession]]("async_session", default=None)
 
     # Sync methods
@@ -86,6 +139,25 @@ class SessionFactory:
             await session.close()
             self.async_context_var.set(None)
 
+    def open_request_async(self, read_only: bool) -> Tuple[AsyncSession, contextvars.Token]:
+        """
+        Сессия на весь HTTP-запрос (rest.db_session.DbSessionMiddleware): вложенные with_async_db_session ее не
+        закрывают. read_only - сессия без транзакции (autocommit_engine), ее commit не стоит обращения к БД
+        """
+        session = (self.async_read_sessionmaker if read_only else self.async_sessionmaker)()
+        return session, self.async_context_var.set(session)
+
+    async def close_request_async(self, session: AsyncSession, commit: bool) -> None:
+        """Фиксирует (commit) или откатывает сессию запроса; дальше в этом контексте открываются свои сессии"""
+        self.async_context_var.set(None)
+        try:
+            if commit:
+                await session.commit()
+            else:
+                await session.rollback()
+        finally:
+            await session.close()
+
     async def __aenter__(self):
         return await self.open_async()
 
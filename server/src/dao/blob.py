@@ -0,0 +1,72 @@
+from typing import List, Optional, Sequence
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String, delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+
+from dao.base import Base, session_factory, with_async_db_session
+
+
+class Blob(Base):
+    """
+    Изображение, сохраненное по хешу содержимого (SHA-256). Одинаковые загрузки ссылаются на одну запись.
+    ref_count поддерживают триггеры на project_files; записи без ссылок удаляются вместе с объектами S3.
+    """
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    s3_path = Column(String, nullable=False)
+    s3_url = Column(String, nullable=False)
+    s3_icon_path = Column(String, nullable=False)
+    s3_icon_url = Column(String, nullable=False)
+    s3_preview_path = Column(String, nullable=True)
+    s3_preview_url = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    image_format = Column(String(16), nullable=True)
+    phash = Column(BigInteger, nullable=True)  # Перцептивный хеш (service.phash)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    @property
+    def s3_paths(self) -> List[str]:
+        return [path for path in (self.s3_path, self.s3_icon_path, self.s3_preview_path) if path]
+
+    @staticmethod
+    @with_async_db_session
+    async def get(sha256: str) -> Optional["Blob"]:
+        session = session_factory.get_async()
+        result = await session.execute(select(Blob).where(Blob.sha256 == sha256))
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def add(**values) -> None:
+        """
+        Регистрирует загруженное изображение. Без commit: запись должна появиться в одной транзакции
+        с файлом, который на нее ссылается, иначе ее может удалить сборка мусора
+        """
+        session = session_factory.get_async()
+        await session.execute(insert(Blob).values(**values).on_conflict_do_nothing(index_elements=[Blob.sha256]))
+
+    @staticmethod
+    async def lock_unreferenced(limit: int) -> Sequence["Blob"]:
+        """
+        Блокирует до limit записей без ссылок. Без commit: объекты S3 удаляются, пока блокировка держится,
+        а записи - следом (delete_locked). Загрузка того же изображения в это время ждет и затем
+        загружает его заново.
+        """
+        session = session_factory.get_async()
+        result = await session.execute(
+            select(Blob)
+            .where(Blob.ref_count <= 0)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return result.scalars().all()
+
+    @staticmethod
+    async def delete_locked(sha256s: List[str]) -> None:
+        session = session_factory.get_async()
+        await session.execute(delete(Blob).where(Blob.sha256.in_(sha256s)))
+        await session.commit()
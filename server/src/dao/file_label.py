@@ -0,0 +1,82 @@
+import hashlib
+import zlib
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, LargeBinary, String, select
+from sqlalchemy.dialects.postgresql import Insert, insert
+from sqlalchemy.sql import func
+
+from dao.base import Base, session_factory, with_async_db_session
+
+
+def label_hash(label: str) -> str:
+    return hashlib.sha256(label.encode("utf-8")).hexdigest()
+
+
+class FileLabel(Base):
+    __tablename__ = "file_labels"
+
+    file_id = Column(Integer, ForeignKey("project_files.id", ondelete="CASCADE"), primary_key=True)
+    label = Column(LargeBinary, nullable=False)  # zlib
+    label_hash = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(self.label).decode("utf-8")
+
+    @staticmethod
+    @with_async_db_session
+    async def get_by_file_id(file_id: int) -> Optional["FileLabel"]:
+        session = session_factory.get_async()
+        result = await session.execute(select(FileLabel).where(FileLabel.file_id == file_id))
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    @with_async_db_session
+    async def save(file_id: int, label: str) -> str:
+        """Сохраняет (или заменяет) разметку файла, возвращает ее хеш"""
+        session = session_factory.get_async()
+        stmt, digest = FileLabel.upsert(file_id, label)
+        await session.execute(stmt)
+        await session.commit()
+        return digest
+
+    @staticmethod
+    @with_async_db_session
+    async def save_if_missing(file_id: int, label: str) -> str:
+        """
+        Сохраняет разметку, только если у файла ее еще нет, и возвращает сохраненную в БД: записанная
+        тем временем свежая разметка не заменяется переданной (перенос старой разметки из S3)
+        """
+        session = session_factory.get_async()
+        stmt = (
+            insert(FileLabel)
+            .values(file_id=file_id, label=zlib.compress(label.encode("utf-8")), label_hash=label_hash(label))
+            .on_conflict_do_nothing(index_elements=[FileLabel.file_id])
+            .returning(FileLabel.file_id)
+        )
+        inserted = (await session.execute(stmt)).scalar_one_or_none()
+        await session.commit()
+        if inserted is not None:
+            return label
+        stored = await FileLabel.get_by_file_id(file_id)
+        return stored.text if stored else label
+
+    @staticmethod
+    def upsert(file_id: int, label: str) -> Tuple[Insert, str]:
+        """Оператор сохранения разметки и ее хеш - для выполнения в чужой транзакции"""
+        return FileLabel.upsert_many({file_id: label}), label_hash(label)
+
+    @staticmethod
+    def upsert_many(labels: Dict[int, str]) -> Insert:
+        """Один оператор сохранения разметки нескольких файлов (file_id -> текст)"""
+        stmt = insert(FileLabel).values([
+            dict(file_id=file_id, label=zlib.compress(label.encode("utf-8")), label_hash=label_hash(label))
+            for file_id, label in labels.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FileLabel.file_id],
+            set_={"label": stmt.excluded.label, "label_hash": stmt.excluded.label_hash, "updated_at": func.now()},
+        )
+        return stmt
@@ -1,12 +1,18 @@
 from datetime import datetime
-from typing import List, Optional, Tuple
-from sqlalchemy import Column, Integer, String, DateTime, Enum, select, delete, update
-from sqlalchemy.sql import func
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, DateTime, Double, Enum, Integer, Row, SmallInteger, String, delete, select, tuple_, update
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
 
-from dao.base import Base, with_async_db_session, session_factory
+from dao.base import Base, session_factory, with_async_db_session
 from dao.project_file import ProjectFile
-from rest.models.project import ProjectData, ProjectStatusType, ProjectFilesStatusType
+from dao.search import text_search
+from rest.models.project import ProjectData, ProjectFilesStatusType, ProjectStatusType
+
+# Порог уверенности нового проекта: с ним распознавали до хранения уверенности объектов (миграция 020)
+DEFAULT_CONFIDENCE_THRESHOLD = 0.25
+
 
 class Project(Base):
     __tablename__ = "projects"
@@ -16,7 +22,16 @@ class Project(Base):
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     status = Column(Enum(ProjectStatusType, name="project_status_type"), nullable=False, default=ProjectStatusType.open)
     count_of_files = Column(Integer, nullable=False, default=0)
+    # Счетчики файлов по статусам, поддерживаются триггерами на project_files
+    processing_files = Column(Integer, nullable=False, default=0)
+    error_files = Column(Integer, nullable=False, default=0)
+    success_files = Column(Integer, nullable=False, default=0)
     status_files = Column(Enum(ProjectFilesStatusType, name="project_files_status_type"), nullable=False, default=ProjectFilesStatusType.processing)
+    # Порог уверенности объектов разметки, NULL - учитываются все
+    confidence_threshold = Column(Double, nullable=True, default=DEFAULT_CONFIDENCE_THRESHOLD)
+    # Новый файл получает результат распознанного снимка проекта не дальше этого расстояния (service.phash), NULL - нет
+    near_duplicate_distance = Column(SmallInteger, nullable=True)
+    deleted_at = Column(DateTime, nullable=True)  # Проект удаляется фоновой задачей и уже скрыт
 
     # Relationship with ProjectFile
     files = relationship("ProjectFile", back_populates="project", cascade="all, delete-orphan")
@@ -28,7 +43,12 @@ class Project(Base):
             created_at=self.created_at,
             status=self.status,
             count_of_files=self.count_of_files,
-            status_files=self.status_files
+            processing_files=self.processing_files,
+            error_files=self.error_files,
+            success_files=self.success_files,
+            status_files=self.status_files,
+            confidence_threshold=self.confidence_threshold,
+            near_duplicate_distance=self.near_duplicate_distance
         )
 
     @staticmethod
@@ -47,13 +67,20 @@ class Project(Base):
     @staticmethod
     @with_async_db_session
     async def search_projects(name: Optional[str] = None, status_files: Optional[str] = None,start_date: Optional[datetime] = None,
-                              end_date: Optional[datetime] = None, page: int = 1, size: int = 20) -> Tuple[List["Project"], int]:
+                              end_date: Optional[datetime] = None, page: int = 1, size: int = 20,
+                              name_prefix: bool = False,
+                              after: Optional[Tuple[datetime, int]] = None) -> Tuple[List["Project"], int]:
+        """
+        Проекты по убыванию (created_at, id).
+        after - ключ последнего проекта предыдущей страницы: если задан, page игнорируется и OFFSET не используется.
+        name_prefix - искать name по началу названия, а не по подстроке.
+        """
         session = session_factory.get_async()
         # Базовый запрос
-        query = select(Project)
+        query = select(Project).where(Project.deleted_at.is_(None))
         # Добавляем фильтр по названию если указан
         if name:
-            query = query.where(Project.name.ilike(f"%{name}%"))
+            query = query.where(text_search(Project.name, name, prefix=name_prefix))
         # Фильтр по статусу
         if status_files:
             query = query.where(Project.status_files == status_files)
@@ -66,8 +93,11 @@ class Project(Base):
         count_query = select(func.count()).select_from(query.subquery())
         total = await session.scalar(count_query)
         # Применяем пагинацию
-        offset = (page - 1) * size
-        paginated_query = query.order_by(Project.created_at.desc(), Project.id).offset(offset).limit(size)
+        if after is not None:
+            query = query.where(tuple_(Project.created_at, Project.id) < tuple_(*after))
+        else:
+            query = query.offset((page - 1) * size)
+        paginated_query = query.order_by(Project.created_at.desc(), Project.id.desc()).limit(size)
         # Выполняем запрос
         result = await session.execute(paginated_query)
         projects = result.scalars().all()
@@ -78,13 +108,42 @@ class Project(Base):
     @with_async_db_session
     async def get_project_by_id(project_id: int) -> Optional["Project"]:
         session = session_factory.get_async()
-        query = select(Project).where(Project.id == project_id)
-        result = await session.execute(query)
-        return result.scalar_one_or_none()
+        # Уже загруженный в сессию проект берется из identity map без запроса к БД
+        project = await session.get(Project, project_id)
+        return project if project is not None and project.deleted_at is None else None
+
+    @staticmethod
+    @with_async_db_session
+    async def get_project_sizes(project_id: Optional[int] = None) -> Sequence[Row]:
+        """Не удаленные проекты (все или один): (id, count_of_files) по возрастанию id"""
+        session = session_factory.get_async()
+        query = select(Project.id, Project.count_of_files).where(Project.deleted_at.is_(None))
+        if project_id is not None:
+            query = query.where(Project.id == project_id)
+        result = await session.execute(query.order_by(Project.id))
+        return result.all()
+
+    @staticmethod
+    @with_async_db_session
+    async def mark_deleted(project_id: int) -> bool:
+        """
+        Скрывает проект до его удаления. Уже помеченный проект тоже подходит - так повторяется прервавшееся удаление.
+        False - проекта нет
+        """
+        session = session_factory.get_async()
+        result = await session.execute(
+            update(Project)
+            .where(Project.id == project_id)
+            .values(deleted_at=func.coalesce(Project.deleted_at, func.now()))
+            .returning(Project.id)
+        )
+        await session.commit()
+        return result.scalar_one_or_none() is not None
 
     @staticmethod
     @with_async_db_session
     async def delete_project_by_id(project_id: int) -> None:
+        """Удаляет проект одним запросом: файлы, дефекты, геометрию и разметку удаляют каскады внешних ключей"""
         session = session_factory.get_async()
         delete_query = delete(Project).where(Project.id == project_id)
         await session.execute(delete_query)
@@ -94,34 +153,69 @@ class Project(Base):
     @with_async_db_session
     async def update_project_name(project_id: int, new_name: str) -> Optional["Project"]:
         session = session_factory.get_async()
+        result = await session.execute(
+            update(Project)
+            .where(Project.id == project_id, Project.deleted_at.is_(None))
+            .values(name=new_name)
+            .returning(Project)
+            .execution_options(populate_existing=True)
+        )
+        project = result.scalar_one_or_none()
+        await session.commit()
+        return project
 
-        # Update project name
-        update_query = update(Project).where(Project.id == project_id).values(name=new_name)
-        await session.execute(update_query)
+    @staticmethod
+    @with_async_db_session
+    async def update_confidence_threshold(project_id: int, threshold: Optional[float],
+                                          reference_classes: Sequence[int]) -> Optional["Project"]:
+        """Меняет порог уверенности и одной транзакцией пересчитывает под него распознанные файлы проекта"""
+        session = session_factory.get_async()
+        result = await session.execute(
+            update(Project)
+            .where(Project.id == project_id, Project.deleted_at.is_(None))
+            .values(confidence_threshold=threshold)
+            .returning(Project.id)
+        )
+        if result.scalar_one_or_none() is None:
+            await session.rollback()
+            return None
+        await ProjectFile.apply_confidence_threshold(project_id, threshold, reference_classes)
         await session.commit()
 
-        # Get updated project
-        query = select(Project).where(Project.id == project_id)
-        result = await session.execute(query)
+        result = await session.execute(select(Project).where(Project.id == project_id).execution_options(populate_existing=True))
         return result.scalar_one_or_none()
 
     @staticmethod
     @with_async_db_session
-    async def update_project_status(project_id: int) -> Optional["Project"]:
+    async def update_near_duplicate_distance(project_id: int, max_distance: Optional[int]) -> Optional["Project"]:
         session = session_factory.get_async()
-
-        # Получаем количество файлов
-        file_count = await session.scalar(
-            select(func.count())
-            .select_from(ProjectFile)
-            .where(ProjectFile.project_id == project_id)
+        result = await session.execute(
+            update(Project)
+            .where(Project.id == project_id, Project.deleted_at.is_(None))
+            .values(near_duplicate_distance=max_distance)
+            .returning(Project)
+            .execution_options(populate_existing=True)
         )
+        project = result.scalar_one_or_none()
+        await session.commit()
+        return project
+
+    @staticmethod
+    @with_async_db_session
+    async def update_project_status(project_id: int) -> Optional["Project"]:
+        """
+        Пересчитывает счетчики файлов проекта с нуля.
+        В обычной работе их поддерживают триггеры, метод нужен для ручной сверки.
+        """
+        session = session_factory.get_async()
 
         # Получаем статистику по статусам файлов
         status_query = await session.execute(
             select(
+                func.count().label('file_count'),
                 func.count().filter(ProjectFile.status == 'error').label('error_count'),
-                func.count().filter(ProjectFile.status == 'processing').label('processing_count')
+                func.count().filter(ProjectFile.status == 'processing').label('processing_count'),
+                func.count().filter(ProjectFile.status == 'success').label('success_count')
             ).where(ProjectFile.project_id == project_id)
         )
 
@@ -141,7 +235,10 @@ class Project(Base):
             update(Project)
             .where(Project.id == project_id)
             .values(
-                count_of_files=file_count,
+                count_of_files=stats.file_count,
+                processing_files=stats.processing_count,
+                error_files=stats.error_count,
+                success_files=stats.success_count,
                 status_files=new_status
             )
         )
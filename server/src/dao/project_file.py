@@ -1,11 +1,65 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, select, delete, Enum, update
-from sqlalchemy.orm import relationship, selectinload
+import os
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import (
+    REAL,
+    BigInteger,
+    Column,
+    Computed,
+    Date,
+    DateTime,
+    Double,
+    Enum,
+    ForeignKey,
+    Integer,
+    Row,
+    Select,
+    SmallInteger,
+    String,
+    and_,
+    case,
+    cast,
+    column,
+    delete,
+    literal,
+    or_,
+    select,
+    true,
+    tuple_,
+    union,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import raiseload, relationship
 from sqlalchemy.sql import func
-from typing import List, Optional, Tuple
 
-from dao.base import Base, with_async_db_session, session_factory
-from rest.models.project_file import ProjectFileData, ProjectFileStatusType, FileDefectData
+from dao.base import Base, session_factory, with_async_db_session
+from dao.blob import Blob
+from dao.file_label import FileLabel
+from dao.project_job import ProjectJob
+from dao.search import text_search
 from rest.models.panda_data import DefectType
+from rest.models.project_file import FileDefectData, FileDetectionData, ProjectFileData, ProjectFileSortType, ProjectFileStatusType
+from rest.models.project_job import ProjectJobStatusType
+
+# До скольких совпадений поиска по имени сортируем найденное в памяти, а не идем по индексу сортировки
+SEARCH_SORT_LIMIT = 20000
+
+def file_object_stem(project_id: int, file_id: int, s3_path: str, content_hash: Optional[str]) -> str:
+    """
+    Начало ключей S3 производных файла (разметка, отчет).
+    Изображение из blobs делят несколько файлов, поэтому для них ключи строятся по id файла
+    """
+    if content_hash:
+        return f"{project_id}/files/{file_id}"
+    return os.path.splitext(s3_path)[0]
+
+
+# model_version разметки, загруженной вручную: при досчете после смены модели не перезаписывается
+MANUAL_MODEL_VERSION = "manual"
 
 
 class FileDefect(Base):
@@ -14,23 +68,13 @@ class FileDefect(Base):
 
     id = Column(Integer, primary_key=True)
     file_id = Column(Integer, ForeignKey("project_files.id"), nullable=False)
+    project_id = Column(Integer, nullable=False)  # Копия project_files.project_id для статистики, заполняется триггером
     class_id = Column(Integer, nullable=False)  # ID класса дефекта из YOLO
     count = Column(Integer, default=1)  # Количество одинаковых дефектов
 
     # Связь с файлом
     file = relationship("ProjectFile", back_populates="defects")
 
-    @classmethod
-    @with_async_db_session
-    async def create(cls, file_id: int, class_id: int, count: int = 1):
-        session = session_factory.get_async()
-
-        defect = cls(file_id=file_id, class_id=class_id, count=count)
-        session.add(defect)
-        await session.commit()
-        await session.refresh(defect)
-        return defect
-
     @classmethod
     @with_async_db_session
     async def delete_by_file(cls, file_id: int):
@@ -49,6 +93,58 @@ class FileDefect(Base):
         )
 
 
+class FileDetection(Base):
+    """Геометрия одного объекта разметки. Пишется вместе с результатом распознавания (ProjectFile.save_recognition)"""
+    __tablename__ = "file_detections"
+    __table_args__ = {'extend_existing': True}
+
+    id = Column(BigInteger, primary_key=True)
+    file_id = Column(Integer, ForeignKey("project_files.id", ondelete="CASCADE"), nullable=False)
+    class_id = Column(SmallInteger, nullable=False)
+    area_ratio = Column(REAL, nullable=False)  # Доля площади изображения
+    confidence = Column(REAL, nullable=True)  # Уверенность модели, NULL - проходит любой порог проекта
+    # В пикселях изображения, NULL - размеры изображения неизвестны
+    area = Column(REAL, nullable=True)
+    perimeter = Column(REAL, nullable=True)
+    max_extent = Column(REAL, nullable=True)  # Максимальный размер (диаметр Ферета)
+    bbox_x = Column(REAL, nullable=True)
+    bbox_y = Column(REAL, nullable=True)
+    bbox_w = Column(REAL, nullable=True)
+    bbox_h = Column(REAL, nullable=True)
+
+    @staticmethod
+    @with_async_db_session
+    async def get_by_file(file_id: int) -> List["FileDetection"]:
+        session = session_factory.get_async()
+        result = await session.execute(
+            select(FileDetection).where(FileDetection.file_id == file_id).order_by(FileDetection.id)
+        )
+        return result.scalars().all()
+
+    def to_api(self) -> FileDetectionData:
+        return FileDetectionData(
+            class_id=self.class_id,
+            defect_name=DefectType.get_by_id(self.class_id).defect,
+            area_ratio=self.area_ratio,
+            confidence=self.confidence,
+            area=self.area,
+            perimeter=self.perimeter,
+            max_extent=self.max_extent,
+            bbox=[self.bbox_x, self.bbox_y, self.bbox_w, self.bbox_h] if self.bbox_x is not None else None,
+        )
+
+
+class ProjectDefectStat(Base):
+    """Количество дефектов по классам в проекте. Пересчитывается триггерами на file_defects"""
+    __tablename__ = "project_defect_stats"
+    __table_args__ = {'extend_existing': True}
+
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+    class_id = Column(Integer, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)  # Количество дефектов класса
+    files = Column(Integer, nullable=False, default=0)  # Количество файлов с дефектом класса
+
+
 class ProjectFile(Base):
     __tablename__ = "project_files"
 
@@ -63,12 +159,56 @@ class ProjectFile(Base):
     s3_txt_url = Column(String, nullable=False)
     s3_report_path = Column(String, nullable=True)
     s3_report_url = Column(String, nullable=True)
+    s3_preview_path = Column(String, nullable=True)
+    s3_preview_url = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    image_format = Column(String(16), nullable=True)
+    job_id = Column(Integer, ForeignKey("project_jobs.id", ondelete="SET NULL"), nullable=True)
+    report_label_hash = Column(String(64), nullable=True)  # Версия отчета: хеш разметки и порога (report_key)
+    model_version = Column(String(64), nullable=True)  # SHA-256 весов модели, давшей текущий результат
+    # Изображение в blobs, NULL - объекты S3 принадлежат только этому файлу
+    content_hash = Column(String(64), ForeignKey("blobs.sha256"), nullable=True)
+    # Перцептивный хеш изображения (service.phash) и его полосы по 16 бит для поиска по расстоянию Хэмминга
+    phash = Column(BigInteger, nullable=True)
+    phash_band0 = Column(Integer, Computed("((phash >> 48) & 65535)::INTEGER", persisted=True))
+    phash_band1 = Column(Integer, Computed("((phash >> 32) & 65535)::INTEGER", persisted=True))
+    phash_band2 = Column(Integer, Computed("((phash >> 16) & 65535)::INTEGER", persisted=True))
+    phash_band3 = Column(Integer, Computed("(phash & 65535)::INTEGER", persisted=True))
+    # Файл, с почти такого же снимка которого скопирован результат без распознавания
+    near_duplicate_of = Column(Integer, ForeignKey("project_files.id", ondelete="SET NULL"), nullable=True)
     status = Column(Enum(ProjectFileStatusType, name="file_status_type"), nullable=False, default=ProjectFileStatusType.processing)
 
     project = relationship("Project", back_populates="files")
 
-    defects = relationship("FileDefect", back_populates="file", cascade="all, delete-orphan", lazy='joined')
-    defect_count = Column(Integer, default=0)  # Общее количество дефектов
+    # Вторым запросом по id загруженных файлов: join размножал бы строки файла по числу классов дефектов
+    defects = relationship("FileDefect", back_populates="file", cascade="all, delete-orphan", lazy='selectin')
+    defect_count = Column(Integer, default=0, nullable=False)  # Общее количество дефектов
+    # Площади дефектов в пикселях (эталонные классы не считаются), детали - в file_detections
+    max_defect_area = Column(REAL, default=0, nullable=False)
+    total_defect_area = Column(REAL, default=0, nullable=False)
+    # Классы из file_defects по возрастанию, для фильтров по индексу без join
+    defect_classes = Column(ARRAY(SmallInteger), default=list, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    @property
+    def object_stem(self) -> str:
+        return file_object_stem(self.project_id, self.id, self.s3_path, self.content_hash)
+
+    @staticmethod
+    def phash_bands() -> List[Column]:
+        return [ProjectFile.phash_band0, ProjectFile.phash_band1, ProjectFile.phash_band2, ProjectFile.phash_band3]
+
+    @staticmethod
+    def phash_distance(left, right):
+        """Расстояние Хэмминга между хешами в SQL"""
+        return func.bit_count(func.int8send(left.op("#")(right)))
+
+    @staticmethod
+    def unclaimed():
+        """Файл не занят задачей распознавания: не привязан к задаче или его задача уже не идет (упала, не отпустив файлы)"""
+        active = select(ProjectJob.id).where(ProjectJob.status.in_([ProjectJobStatusType.queued, ProjectJobStatusType.running]))
+        return or_(ProjectFile.job_id.is_(None), ProjectFile.job_id.not_in(active))
 
     def to_api(self, label: str = "") -> ProjectFileData:
         return ProjectFileData(
@@ -83,16 +223,30 @@ class ProjectFile(Base):
             s3_txt_url=self.s3_txt_url,
             s3_report_path=self.s3_report_path or "",
             s3_report_url=self.s3_report_url or "",
+            s3_preview_path=self.s3_preview_path or "",
+            s3_preview_url=self.s3_preview_url or "",
+            width=self.width,
+            height=self.height,
+            image_format=self.image_format,
             status=self.status,
             defects=[defect.to_api() for defect in self.defects] if self.defects else [],
             defect_count=self.defect_count,
+            max_defect_area=self.max_defect_area,
+            total_defect_area=self.total_defect_area,
+            model_version=self.model_version,
+            content_hash=self.content_hash,
+            near_duplicate_of=self.near_duplicate_of,
             label=label
         )
 
     @staticmethod
     @with_async_db_session
     async def create_file(project_id: int, filename: str, s3_path: str, s3_url: str, s3_icon_path: str,
-                          s3_icon_url: str, s3_txt_path: str = "", s3_txt_url: str = "") -> "ProjectFile":
+                          s3_icon_url: str, s3_txt_path: str = "", s3_txt_url: str = "",
+                          s3_preview_path: Optional[str] = None, s3_preview_url: Optional[str] = None,
+                          width: Optional[int] = None, height: Optional[int] = None,
+                          image_format: Optional[str] = None, content_hash: Optional[str] = None,
+                          phash: Optional[int] = None) -> "ProjectFile":
         session = session_factory.get_async()
         project_file = ProjectFile(
             project_id=project_id,
@@ -103,6 +257,13 @@ class ProjectFile(Base):
             s3_icon_url=s3_icon_url,
             s3_txt_path=s3_txt_path,
             s3_txt_url=s3_txt_url,
+            s3_preview_path=s3_preview_path,
+            s3_preview_url=s3_preview_url,
+            width=width,
+            height=height,
+            image_format=image_format,
+            content_hash=content_hash,
+            phash=phash,
         )
         session.add(project_file)
         await session.commit()
@@ -111,71 +272,88 @@ class ProjectFile(Base):
 
     @staticmethod
     @with_async_db_session
-    async def upload_txt(file_id: int, s3_txt_path: str, s3_txt_url: str):
-        session = session_factory.get_async()
-
-        update_query = update(ProjectFile).where(ProjectFile.id == file_id).values(s3_txt_path=s3_txt_path,
-                                                                                   s3_txt_url=s3_txt_url)
-        await session.execute(update_query)
-        await session.commit()
-
-        query = select(ProjectFile).options(selectinload(ProjectFile.defects)).where(ProjectFile.id == file_id)
-        result = await session.execute(query)
-        return result.scalar_one_or_none()
+    async def create_file_from_blob(project_id: int, filename: str, blob: Blob) -> Optional["ProjectFile"]:
+        """
+        Файл со ссылкой на уже загруженное изображение. None - изображение успели удалить как не нужное
+        (сборка мусора blobs), его надо загрузить заново
+        """
+        try:
+            return await ProjectFile.create_file(
+                project_id=project_id, filename=filename, s3_path=blob.s3_path, s3_url=blob.s3_url,
+                s3_icon_path=blob.s3_icon_path, s3_icon_url=blob.s3_icon_url,
+                s3_preview_path=blob.s3_preview_path, s3_preview_url=blob.s3_preview_url,
+                width=blob.width, height=blob.height, image_format=blob.image_format, content_hash=blob.sha256,
+                phash=blob.phash,
+            )
+        except IntegrityError:
+            await session_factory.get_async().rollback()
+            return None
 
     @staticmethod
     @with_async_db_session
     async def get_file_by_id(file_id: int) -> Optional["ProjectFile"]:
         session = session_factory.get_async()
-        query = select(ProjectFile).options(selectinload(ProjectFile.defects)).where(ProjectFile.id == file_id)
+        query = select(ProjectFile).where(ProjectFile.id == file_id)
         result = await session.execute(query)
         return result.scalar_one_or_none()
 
     @staticmethod
     @with_async_db_session
     async def get_files_by_project_id(project_id: int, filename: Optional[str] = None, status: Optional[str] = None,
-                                      defect_type: Optional[str] = None, min_defects: Optional[int] = None,
-                                      max_defects: Optional[int] = None, page: int = 1, size: int = 20) -> Tuple[List["ProjectFile"], int]:
+                                      include_classes: Optional[List[int]] = None,
+                                      exclude_classes: Optional[List[int]] = None, min_defects: Optional[int] = None,
+                                      max_defects: Optional[int] = None, page: int = 1, size: int = 20,
+                                      filename_prefix: bool = False, after: Optional[Tuple[Any, int]] = None,
+                                      with_total: bool = True,
+                                      sort: ProjectFileSortType = ProjectFileSortType.defect_count,
+                                      min_defect_area: Optional[float] = None,
+                                      min_total_defect_area: Optional[float] = None) -> Tuple[List["ProjectFile"], Optional[int]]:
+        """
+        Файлы проекта по убыванию (sort, id), sort - defect_count, max_defect_area или total_defect_area.
+        after - ключ (значение sort, id) последнего файла предыдущей страницы: если задан, страница берется по индексу
+        без OFFSET и page игнорируется. with_total=False пропускает подсчет (total = None).
+        filename_prefix - искать filename по началу имени, а не по подстроке.
+        include_classes - в файле есть дефекты всех этих классов, exclude_classes - нет ни одного из этих классов.
+        min_defect_area - площадь самого крупного дефекта не меньше, min_total_defect_area - суммарная площадь не меньше.
+        """
         session = session_factory.get_async()
-        # Запрос для подсчета общего количества (без загрузки связанных данных)
-        count_query = select(func.count(ProjectFile.id)).where(ProjectFile.project_id == project_id)
-
-        # Фильтры для count_query
+        conditions = [ProjectFile.project_id == project_id]
         if filename:
-            count_query = count_query.where(ProjectFile.filename.ilike(f"%{filename}%"))
+            conditions.append(text_search(ProjectFile.filename, filename, prefix=filename_prefix))
         if status:
-            count_query = count_query.where(ProjectFile.status == status)
+            conditions.append(ProjectFile.status == status)
+        if include_classes:
+            conditions.append(ProjectFile.defect_classes.contains(sorted(set(include_classes))))
+        if exclude_classes:
+            conditions.append(~ProjectFile.defect_classes.overlap(sorted(set(exclude_classes))))
         if min_defects is not None:
-            count_query = count_query.where(ProjectFile.defect_count >= min_defects)
+            conditions.append(ProjectFile.defect_count >= min_defects)
         if max_defects is not None:
-            count_query = count_query.where(ProjectFile.defect_count <= max_defects)
+            conditions.append(ProjectFile.defect_count <= max_defects)
+        if min_defect_area is not None:
+            conditions.append(ProjectFile.max_defect_area >= min_defect_area)
+        if min_total_defect_area is not None:
+            conditions.append(ProjectFile.total_defect_area >= min_total_defect_area)
 
-        # Выполняем запрос для подсчета
-        total = await session.scalar(count_query)
+        total = None
+        if with_total:
+            total = await session.scalar(select(func.count(ProjectFile.id)).where(*conditions))
 
-        # Основной запрос с загрузкой связанных данных
-        query = select(ProjectFile).options(selectinload(ProjectFile.defects)).where(
-            ProjectFile.project_id == project_id)
+        sort_column = getattr(ProjectFile, ProjectFileSortType(sort).value)
+        query = select(ProjectFile).where(*conditions)
+        if after is not None:
+            query = query.where(tuple_(sort_column, ProjectFile.id) < tuple_(*after))
+        else:
+            query = query.offset((page - 1) * size)
+        order_key = sort_column
+        if filename and total is not None and total <= SEARCH_SORT_LIMIT:
+            # Совпадений по имени мало: выражение в ORDER BY не дает планировщику идти по индексу сортировки,
+            # поэтому строки сначала отбираются индексом поиска и сортируются в памяти
+            order_key = sort_column + 0
+        query = query.order_by(order_key.desc(), ProjectFile.id.desc()).limit(size)
 
-        # Фильтры для основного запроса
-        if filename:
-            query = query.where(ProjectFile.filename.ilike(f"%{filename}%"))
-        if status:
-            query = query.where(ProjectFile.status == status)
-        if defect_type is not None:
-            query = query.join(FileDefect).where(FileDefect.class_id == defect_type)
-        if min_defects is not None:
-            query = query.where(ProjectFile.defect_count >= min_defects)
-        if max_defects is not None:
-            query = query.where(ProjectFile.defect_count <= max_defects)
-        # Пагинация и сортировка
-        query = query.order_by(ProjectFile.defect_count.desc())
-        query = query.offset((page - 1) * size).limit(size)
-        # Выполняем запрос
         result = await session.execute(query)
-        projects = result.unique().scalars().all()
-
-        return projects, total
+        return result.scalars().all(), total
 
     @staticmethod
     @with_async_db_session
@@ -192,72 +370,680 @@ class ProjectFile(Base):
         """ Обновляет статус файла на указанный"""
         session = session_factory.get_async()
 
-        # Обновляем файл
-        await session.execute(update(ProjectFile).where(ProjectFile.id == file_id).values(status=status))
+        result = await session.execute(
+            update(ProjectFile)
+            .where(ProjectFile.id == file_id)
+            .values(status=status)
+            .returning(ProjectFile)
+            .execution_options(populate_existing=True)
+        )
+        project_file = result.scalar_one_or_none()
+        await session.commit()
+        return project_file
+
+    @staticmethod
+    @with_async_db_session
+    async def get_defect_stats(project_id: int) -> List[FileDefectData]:
+        """Возвращает статистику по дефектам для проекта из project_defect_stats"""
+        session = session_factory.get_async()
+        query = (select(ProjectDefectStat.class_id, ProjectDefectStat.count)
+                 .where(ProjectDefectStat.project_id == project_id, ProjectDefectStat.count > 0)
+                 .order_by(ProjectDefectStat.class_id))
+
+        result = await session.execute(query)
+        return [FileDefectData(class_id=class_id,
+                               defect_name=DefectType.get_by_id(class_id).defect,
+                               count=total)
+                for class_id, total in result.all()]
+
+    @staticmethod
+    @with_async_db_session
+    async def update_report_path(file_id: int, s3_report_path: str, s3_report_url: str,
+                                 report_label_hash: Optional[str] = None) -> Optional["ProjectFile"]:
+        """ Обновляет ссылки на отчеты .pdf"""
+        session = session_factory.get_async()
 
-        # Получаем обновленный проект
         result = await session.execute(
-            select(ProjectFile)
-            .options(selectinload(ProjectFile.defects))
+            update(ProjectFile)
             .where(ProjectFile.id == file_id)
+            .values(s3_report_path=s3_report_path, s3_report_url=s3_report_url, report_label_hash=report_label_hash)
+            .returning(ProjectFile)
+            .execution_options(populate_existing=True)
         )
+        project_file = result.scalar_one_or_none()
+        await session.commit()
+        return project_file
 
+    @staticmethod
+    @with_async_db_session
+    async def assign_job(project_id: int, job_id: int) -> int:
+        """
+        Переводит файлы проекта в обработку в рамках задачи, возвращает количество файлов.
+        Файлы другой идущей задачи (например, досчета) не трогаются: их результат засчитала бы не та задача
+        """
+        session = session_factory.get_async()
+        result = await session.execute(
+            update(ProjectFile)
+            .where(ProjectFile.project_id == project_id, ProjectFile.unclaimed())
+            .values(status=ProjectFileStatusType.processing, job_id=job_id)
+        )
         await session.commit()
-        return result.scalar_one_or_none()
+        return result.rowcount
 
     @staticmethod
     @with_async_db_session
-    async def delete_file_defects(file_id: int):
-        """Удаляет все дефекты файла"""
+    async def assign_stale_job(project_id: int, job_id: int, model_version: str) -> int:
+        """
+        Привязывает к задаче файлы проекта без результата модели model_version: от старой модели,
+        не распознанные или с ошибкой отправки. Ручная разметка и файлы другой идущей задачи не трогаются.
+        Статус не меняется - прежний результат виден, пока не придет новый. Возвращает количество файлов
+        """
         session = session_factory.get_async()
-        await session.execute(delete(FileDefect).where(FileDefect.file_id == file_id))
+        result = await session.execute(
+            update(ProjectFile)
+            .where(ProjectFile.project_id == project_id,
+                   ProjectFile.model_version.is_distinct_from(model_version),
+                   ProjectFile.model_version.is_distinct_from(MANUAL_MODEL_VERSION),
+                   ProjectFile.unclaimed())
+            .values(job_id=job_id)
+        )
         await session.commit()
+        return result.rowcount
+
+    @staticmethod
+    async def stream_job_files(job_id: int, batch_size: int) -> AsyncIterator[Sequence[Row]]:
+        """
+        Отдает файлы задачи пачками по возрастанию id. Каждая пачка - отдельный короткий запрос в своей сессии
+        (keyset по (job_id, id)): задача может идти часами, открытая транзакция держала бы vacuum.
+        Файлы, результат которых уже пришел (job_id сброшен), в следующие пачки не попадают.
+        """
+        last_id = 0
+        while True:
+            async with session_factory.async_sessionmaker() as session:
+                result = await session.execute(
+                    select(ProjectFile.id, ProjectFile.project_id, ProjectFile.s3_url)
+                    .where(ProjectFile.job_id == job_id, ProjectFile.id > last_id)
+                    .order_by(ProjectFile.id)
+                    .limit(batch_size)
+                )
+                partition = result.all()
+            if not partition:
+                return
+            yield partition
+            if len(partition) < batch_size:
+                return
+            last_id = partition[-1].id
+
+    @staticmethod
+    def _export_conditions(project_id: int, file_ids: Optional[List[int]], status: Optional[ProjectFileStatusType],
+                           include_classes: Optional[List[int]], manual_only: bool) -> list:
+        """Условия отбора распознанных файлов проекта в обучающую выборку"""
+        conditions = [ProjectFile.project_id == project_id, ProjectFile.job_id.is_(None),
+                      ProjectFile.status.in_([ProjectFileStatusType.success, ProjectFileStatusType.error])]
+        if file_ids:
+            conditions.append(ProjectFile.id.in_(file_ids))
+        if status:
+            conditions.append(ProjectFile.status == status)
+        if include_classes:
+            conditions.append(ProjectFile.defect_classes.overlap(sorted(set(include_classes))))
+        if manual_only:
+            conditions.append(ProjectFile.model_version == MANUAL_MODEL_VERSION)
+        return conditions
 
     @staticmethod
     @with_async_db_session
-    async def get_defect_stats(project_id: int) -> List[FileDefectData]:
-        """Возвращает статистику по дефектам для проекта"""
+    async def count_export_files(project_id: int, file_ids: Optional[List[int]] = None,
+                                 status: Optional[ProjectFileStatusType] = None,
+                                 include_classes: Optional[List[int]] = None, manual_only: bool = False) -> int:
         session = session_factory.get_async()
-        query = (select(
-            FileDefect.class_id,
-            func.sum(FileDefect.count).label("total")
-        ).join(ProjectFile).where(
-            ProjectFile.project_id == project_id
-        ).group_by(FileDefect.class_id))
+        conditions = ProjectFile._export_conditions(project_id, file_ids, status, include_classes, manual_only)
+        return await session.scalar(select(func.count()).select_from(ProjectFile).where(*conditions))
 
-        result = await session.execute(query)
-        return [FileDefectData(class_id=class_id,
-                               defect_name=DefectType.get_by_id(class_id).defect,
-                               count=total)
-                for class_id, total in result.all()]
+    @staticmethod
+    async def stream_export_files(project_id: int, batch_size: int, file_ids: Optional[List[int]] = None,
+                                  status: Optional[ProjectFileStatusType] = None,
+                                  include_classes: Optional[List[int]] = None,
+                                  manual_only: bool = False) -> AsyncIterator[Sequence[Row]]:
+        """
+        Файлы для обучающей выборки пачками по возрастанию id вместе с разметкой:
+        (id, filename, s3_path, s3_txt_path, content_hash, label, label_hash), label - zlib, None - разметки в БД нет.
+        include_classes - есть дефект хотя бы одного из классов, manual_only - только разметка, проверенная вручную.
+        Каждая пачка - отдельный короткий запрос (keyset по id): между пачками идет копирование в S3
+        """
+        conditions = ProjectFile._export_conditions(project_id, file_ids, status, include_classes, manual_only)
+        last_id = 0
+        while True:
+            async with session_factory.async_sessionmaker() as session:
+                result = await session.execute(
+                    select(ProjectFile.id, ProjectFile.filename, ProjectFile.s3_path, ProjectFile.s3_txt_path,
+                           ProjectFile.content_hash, FileLabel.label, FileLabel.label_hash)
+                    .outerjoin(FileLabel, FileLabel.file_id == ProjectFile.id)
+                    .where(*conditions, ProjectFile.id > last_id)
+                    .order_by(ProjectFile.id)
+                    .limit(batch_size)
+                )
+                partition = result.all()
+            if not partition:
+                return
+            yield partition
+            if len(partition) < batch_size:
+                return
+            last_id = partition[-1].id
 
-    @classmethod
+    @staticmethod
+    async def stream_project_defects(project_id: int, batch_size: int) -> AsyncIterator[Sequence[Row]]:
+        """
+        Отдает файлы проекта вместе с дефектами (file_id, filename, status, class_id, count) через серверный курсор.
+        Строки одного файла идут подряд; у файла без дефектов class_id = None.
+        """
+        async with session_factory.async_sessionmaker() as session:
+            result = await session.stream(
+                select(ProjectFile.id, ProjectFile.filename, ProjectFile.status, FileDefect.class_id, FileDefect.count)
+                .outerjoin(FileDefect, FileDefect.file_id == ProjectFile.id)
+                .where(ProjectFile.project_id == project_id)
+                .order_by(ProjectFile.id)
+                .execution_options(yield_per=batch_size)
+            )
+            async for partition in result.partitions():
+                yield partition
+
+    @staticmethod
+    async def _stream_query(query: Select, batch_size: int) -> AsyncIterator[Sequence[Row]]:
+        async with session_factory.async_sessionmaker() as session:
+            result = await session.stream(query.execution_options(yield_per=batch_size))
+            async for partition in result.partitions():
+                yield partition
+
+    @staticmethod
+    def _upload_date():
+        return cast(ProjectFile.created_at, Date).label("date")
+
+    @staticmethod
+    def stream_analytics_files(project_id: int, batch_size: int) -> AsyncIterator[Sequence[Row]]:
+        """
+        Файлы проекта для аналитики через серверный курсор, в порядке загрузки (строки одного дня идут подряд):
+        (project_id, date, id, created_at, filename, status, width, height, image_format, model_version,
+        defect_count, max_defect_area, total_defect_area, defect_classes, content_hash, near_duplicate_of)
+        """
+        return ProjectFile._stream_query(
+            select(ProjectFile.project_id, ProjectFile._upload_date(), ProjectFile.id, ProjectFile.created_at,
+                   ProjectFile.filename, ProjectFile.status, ProjectFile.width, ProjectFile.height,
+                   ProjectFile.image_format, ProjectFile.model_version, ProjectFile.defect_count,
+                   ProjectFile.max_defect_area, ProjectFile.total_defect_area, ProjectFile.defect_classes,
+                   ProjectFile.content_hash, ProjectFile.near_duplicate_of)
+            .where(ProjectFile.project_id == project_id)
+            .order_by(ProjectFile.created_at, ProjectFile.id),
+            batch_size)
+
+    @staticmethod
+    def stream_analytics_defects(project_id: int, batch_size: int) -> AsyncIterator[Sequence[Row]]:
+        """Дефекты файлов проекта в порядке загрузки файлов: (project_id, date, file_id, class_id, count)"""
+        return ProjectFile._stream_query(
+            select(ProjectFile.project_id, ProjectFile._upload_date(), FileDefect.file_id, FileDefect.class_id,
+                   FileDefect.count)
+            .join(ProjectFile, ProjectFile.id == FileDefect.file_id)
+            .where(ProjectFile.project_id == project_id)
+            .order_by(ProjectFile.created_at, ProjectFile.id, FileDefect.class_id),
+            batch_size)
+
+    @staticmethod
+    def stream_analytics_detections(project_id: int, batch_size: int) -> AsyncIterator[Sequence[Row]]:
+        """
+        Объекты разметки файлов проекта с геометрией в порядке загрузки файлов: (project_id, date, id, file_id,
+        class_id, confidence, area_ratio, area, perimeter, max_extent, bbox_x, bbox_y, bbox_w, bbox_h)
+        """
+        return ProjectFile._stream_query(
+            select(ProjectFile.project_id, ProjectFile._upload_date(), FileDetection.id, FileDetection.file_id,
+                   FileDetection.class_id, FileDetection.confidence, FileDetection.area_ratio, FileDetection.area,
+                   FileDetection.perimeter, FileDetection.max_extent, FileDetection.bbox_x, FileDetection.bbox_y,
+                   FileDetection.bbox_w, FileDetection.bbox_h)
+            .join(ProjectFile, ProjectFile.id == FileDetection.file_id)
+            .where(ProjectFile.project_id == project_id)
+            .order_by(ProjectFile.created_at, ProjectFile.id, FileDetection.id),
+            batch_size)
+
+    @staticmethod
     @with_async_db_session
-    async def update_defect_count(cls, file_id: int, count: int):
+    async def fail_job_files(file_ids: List[int], keep_result: bool = False) -> None:
+        """
+        Файлы, которые не удалось отправить на распознавание, отвязываются от задачи. Их результат полное
+        распознавание уже сбросило - статус error, версия модели сбрасывается, файл попадет в досчет.
+        keep_result (досчет) - прежний результат остается как был: версия модели все так же не новая,
+        файл попадет в следующий досчет
+        """
         session = session_factory.get_async()
+        values = dict(job_id=None) if keep_result else dict(status=ProjectFileStatusType.error, job_id=None, model_version=None)
         await session.execute(
-            update(cls)
-            .where(cls.id == file_id)
-            .values(defect_count=count)
+            update(ProjectFile)
+            .where(ProjectFile.id.in_(file_ids))
+            .values(**values)
         )
         await session.commit()
 
     @staticmethod
     @with_async_db_session
-    async def update_report_path(file_id: int, s3_report_path: str, s3_report_url: str) -> Optional["ProjectFile"]:
-        """ Обновляет ссылки на отчеты .pdf"""
+    async def get_image_info(file_id: int) -> Optional[Row]:
+        """
+        (project_id, s3_path, content_hash, width, height, confidence_threshold) изображения файла и порог его проекта,
+        None - файла нет
+        """
+        from dao.project import Project
         session = session_factory.get_async()
+        result = await session.execute(
+            select(ProjectFile.project_id, ProjectFile.s3_path, ProjectFile.content_hash,
+                   ProjectFile.width, ProjectFile.height, Project.confidence_threshold)
+            .join(Project, Project.id == ProjectFile.project_id)
+            .where(ProjectFile.id == file_id)
+        )
+        return result.first()
 
-        # Обновляем файл
-        await session.execute(update(ProjectFile).where(ProjectFile.id == file_id).values(s3_report_path=s3_report_path,
-                                                                                          s3_report_url=s3_report_url))
+    @staticmethod
+    @with_async_db_session
+    async def get_report_info(file_id: int) -> Optional[Row]:
+        """(file, confidence_threshold) - файл без дефектов и порог его проекта для отчета, None - файла нет"""
+        from dao.project import Project
+        session = session_factory.get_async()
+        result = await session.execute(
+            select(ProjectFile, Project.confidence_threshold)
+            .options(raiseload(ProjectFile.defects))  # Отчет строится по разметке
+            .join(Project, Project.id == ProjectFile.project_id)
+            .where(ProjectFile.id == file_id)
+        )
+        return result.first()
 
-        # Получаем обновленный проект
+    @staticmethod
+    @with_async_db_session
+    async def get_image_infos(file_ids: List[int]) -> Sequence[Row]:
+        """(id, project_id, s3_path, content_hash, width, height) изображений файлов; удаленных файлов нет в ответе"""
+        session = session_factory.get_async()
+        result = await session.execute(
+            select(ProjectFile.id, ProjectFile.project_id, ProjectFile.s3_path, ProjectFile.content_hash,
+                   ProjectFile.width, ProjectFile.height)
+            .where(ProjectFile.id.in_(file_ids))
+        )
+        return result.all()
+
+    @staticmethod
+    @with_async_db_session
+    async def get_file_names(project_id: int) -> Sequence[Row]:
+        """(id, filename) всех файлов проекта - для сопоставления по имени"""
+        session = session_factory.get_async()
+        result = await session.execute(
+            select(ProjectFile.id, ProjectFile.filename).where(ProjectFile.project_id == project_id)
+        )
+        return result.all()
+
+    @staticmethod
+    @with_async_db_session
+    async def find_result_donor(project_id: int, content_hash: str, file_id: int) -> Optional["ProjectFile"]:
+        """
+        Последний распознанный моделью файл проекта с тем же изображением: его результат можно скопировать
+        без распознавания. Ручная разметка не подходит - она не результат модели
+        """
+        session = session_factory.get_async()
         result = await session.execute(
             select(ProjectFile)
-            .options(selectinload(ProjectFile.defects))
-            .where(ProjectFile.id == file_id)
+            .options(raiseload(ProjectFile.defects))  # Донору нужны только ссылки на результат
+            .where(ProjectFile.project_id == project_id,
+                   ProjectFile.content_hash == content_hash,
+                   ProjectFile.id != file_id,
+                   ProjectFile.model_version.is_not(None),
+                   ProjectFile.model_version != MANUAL_MODEL_VERSION,
+                   ProjectFile.job_id.is_(None),
+                   ProjectFile.status.in_([ProjectFileStatusType.success, ProjectFileStatusType.error]))
+            .order_by(ProjectFile.id.desc())
+            .limit(1)
         )
+        return result.scalars().first()
+
+    @staticmethod
+    @with_async_db_session
+    async def find_similar_donor(project_id: int, phash: int, band_values: List[List[int]], max_distance: int,
+                                 file_id: int) -> Optional["ProjectFile"]:
+        """
+        Ближайший по перцептивному хешу распознанный моделью файл проекта не дальше max_distance.
+        band_values - допустимые значения каждой полосы (service.phash.band_values): кандидаты берутся по индексам
+        полос, точное расстояние считается только для них. Ручная разметка не подходит - она сделана для другого снимка
+        """
+        session = session_factory.get_async()
+        distance = ProjectFile.phash_distance(ProjectFile.phash, phash)
+        result = await session.execute(
+            select(ProjectFile)
+            .options(raiseload(ProjectFile.defects))
+            .where(ProjectFile.project_id == project_id,
+                   ProjectFile.phash.is_not(None),
+                   or_(*(band.in_(values) for band, values in zip(ProjectFile.phash_bands(), band_values, strict=True))),
+                   distance <= max_distance,
+                   ProjectFile.id != file_id,
+                   ProjectFile.model_version.is_not(None),
+                   ProjectFile.model_version != MANUAL_MODEL_VERSION,
+                   ProjectFile.job_id.is_(None),
+                   ProjectFile.status.in_([ProjectFileStatusType.success, ProjectFileStatusType.error]))
+            .order_by(distance, ProjectFile.id.desc())
+            .limit(1)
+        )
+        return result.scalars().first()
+
+    @staticmethod
+    @with_async_db_session
+    async def get_near_duplicate_pairs(project_id: int, masks: List[int], max_distance: int) -> Sequence[Row]:
+        """
+        Пары различных перцептивных хешей проекта на расстоянии не больше max_distance.
+        Хеши сравниваются без повторов (одинаковые хеши многих файлов - одна строка), кандидаты - хеши,
+        у которых полоса равна полосе другого XOR одна из masks (service.phash.band_masks), по полосам отдельно
+        """
+        session = session_factory.get_async()
+        hashes = (
+            select(ProjectFile.phash, *ProjectFile.phash_bands())
+            .where(ProjectFile.project_id == project_id, ProjectFile.phash.is_not(None))
+            .distinct()
+            .cte("hashes")
+        )
+        left, right = hashes.alias("a"), hashes.alias("b")
+        mask_table = values(column("mask", Integer), name="masks").data([(mask,) for mask in masks])
+        band_names = [band.name for band in ProjectFile.phash_bands()]
+        candidates = [
+            select(left.c.phash.label("a"), right.c.phash.label("b"))
+            .select_from(left.join(mask_table, true())
+                         .join(right, right.c[name] == left.c[name].op("#")(mask_table.c.mask)))
+            .where(left.c.phash < right.c.phash,
+                   ProjectFile.phash_distance(left.c.phash, right.c.phash) <= max_distance)
+            for name in band_names
+        ]
+        result = await session.execute(union(*candidates))
+        return result.all()
+
+    @staticmethod
+    @with_async_db_session
+    async def get_phashes(project_id: int) -> Sequence[Row]:
+        """(id, phash) файлов проекта с перцептивным хешем"""
+        session = session_factory.get_async()
+        result = await session.execute(
+            select(ProjectFile.id, ProjectFile.phash)
+            .where(ProjectFile.project_id == project_id, ProjectFile.phash.is_not(None))
+            .order_by(ProjectFile.id)
+        )
+        return result.all()
+
+    @staticmethod
+    @with_async_db_session
+    async def get_files_by_ids(file_ids: List[int]) -> List["ProjectFile"]:
+        session = session_factory.get_async()
+        result = await session.execute(select(ProjectFile).where(ProjectFile.id.in_(file_ids)))
+        return result.scalars().all()
+
+    @staticmethod
+    @with_async_db_session
+    async def copy_recognition(file_id: int, donor_id: int, s3_txt_path: str, s3_txt_url: str,
+                               threshold: Optional[float], reference_classes: Sequence[int],
+                               near_duplicate: bool = False) -> None:
+        """
+        Копирует результат распознавания donor_id в file_id одной транзакцией: статус, агрегаты и версию модели,
+        дефекты по классам, геометрию объектов и разметку. Объект разметки в S3 копирует вызывающий.
+        Статус и агрегаты затем пересчитываются по скопированной геометрии под порог threshold проекта file_id,
+        как при его смене; без геометрии остаются агрегаты донора.
+        near_duplicate - донор лишь похож (перцептивный хеш): он запоминается в near_duplicate_of.
+        Геометрия в пикселях остается от снимка донора, доли площади от разрешения не зависят
+        """
+        session = session_factory.get_async()
+        donor = select(ProjectFile).where(ProjectFile.id == donor_id).subquery()
+        await session.execute(
+            update(ProjectFile)
+            .where(ProjectFile.id == file_id, ProjectFile.id != donor.c.id)
+            .values(status=donor.c.status, defect_count=donor.c.defect_count, defect_classes=donor.c.defect_classes,
+                    max_defect_area=donor.c.max_defect_area, total_defect_area=donor.c.total_defect_area,
+                    model_version=donor.c.model_version, s3_txt_path=s3_txt_path, s3_txt_url=s3_txt_url,
+                    near_duplicate_of=donor.c.id if near_duplicate else None)
+        )
+        await session.execute(
+            insert(FileDefect).from_select(
+                [FileDefect.file_id, FileDefect.class_id, FileDefect.count],
+                select(literal(file_id), FileDefect.class_id, FileDefect.count).where(FileDefect.file_id == donor_id),
+            )
+        )
+        detection_columns = [column for column in FileDetection.__table__.columns if column.name not in ("id", "file_id")]
+        await session.execute(
+            insert(FileDetection).from_select(
+                ["file_id"] + [column.name for column in detection_columns],
+                select(literal(file_id), *detection_columns).where(FileDetection.file_id == donor_id).order_by(FileDetection.id),
+            )
+        )
+        await session.execute(
+            insert(FileLabel).from_select(
+                [FileLabel.file_id, FileLabel.label, FileLabel.label_hash],
+                select(literal(file_id), FileLabel.label, FileLabel.label_hash).where(FileLabel.file_id == donor_id),
+            )
+        )
+        await ProjectFile._apply_threshold(select(ProjectFile.id).where(ProjectFile.id == file_id), threshold,
+                                           reference_classes)
+        await session.commit()
+
+    @staticmethod
+    async def apply_confidence_threshold(project_id: int, threshold: Optional[float], reference_classes: Sequence[int]) -> None:
+        """
+        Пересчитывает по file_detections результаты распознанных файлов проекта под новый порог уверенности:
+        статус, количество, классы и площади дефектов, file_defects. Без commit - вызывается внутри
+        транзакции смены порога (Project.update_confidence_threshold), счетчики проекта и статистику
+        дефектов поддерживают триггеры.
+        Файлы без строк в file_detections (распознаны до их появления) не трогаются.
+        """
+        recognized = (
+            select(ProjectFile.id)
+            .where(ProjectFile.project_id == project_id,
+                   ProjectFile.status.in_([ProjectFileStatusType.success, ProjectFileStatusType.error]))
+        )
+        await ProjectFile._apply_threshold(recognized, threshold, reference_classes)
+
+    @staticmethod
+    async def _apply_threshold(recognized: Select, threshold: Optional[float], reference_classes: Sequence[int]) -> None:
+        """Пересчет apply_confidence_threshold для файлов из recognized (выборка id) одного проекта, без commit"""
+        session = session_factory.get_async()
+        passing = true() if threshold is None else or_(FileDetection.confidence.is_(None),
+                                                       FileDetection.confidence >= threshold)
+        is_defect = and_(passing, FileDetection.class_id.not_in(list(reference_classes)))
+
+        files = (
+            select(FileDetection.file_id,
+                   func.coalesce(func.max(FileDetection.area).filter(is_defect), 0).label("max_defect_area"),
+                   func.coalesce(func.sum(cast(FileDetection.area, Double)).filter(is_defect), 0).label("total_defect_area"),
+                   func.bool_or(is_defect).label("has_defects"))
+            .where(FileDetection.file_id.in_(recognized))
+            .group_by(FileDetection.file_id)
+            .subquery("files")
+        )
+        counts = (
+            select(FileDetection.file_id, FileDetection.class_id, func.count().label("count"))
+            .where(FileDetection.file_id.in_(recognized), passing)
+            .group_by(FileDetection.file_id, FileDetection.class_id)
+            .subquery("counts")
+        )
+        classes = (
+            select(counts.c.file_id, func.sum(counts.c.count).label("defect_count"),
+                   func.array_agg(aggregate_order_by(counts.c.class_id, counts.c.class_id)).label("defect_classes"))
+            .group_by(counts.c.file_id)
+            .subquery("classes")
+        )
+        results = (
+            select(files, classes.c.defect_count, classes.c.defect_classes)
+            .select_from(files.outerjoin(classes, classes.c.file_id == files.c.file_id))
+            .subquery("results")
+        )
+
+        # Сначала project_files: как и в save_recognition, их триггер первым блокирует строку проекта
+        status_type = ProjectFile.status.type
+        await session.execute(
+            update(ProjectFile)
+            .where(ProjectFile.id == results.c.file_id)
+            .values(
+                status=case((results.c.has_defects, literal(ProjectFileStatusType.error, status_type)),
+                            else_=literal(ProjectFileStatusType.success, status_type)),
+                defect_count=func.coalesce(results.c.defect_count, 0),
+                defect_classes=func.coalesce(results.c.defect_classes, literal([], ProjectFile.defect_classes.type)),
+                max_defect_area=results.c.max_defect_area,
+                total_defect_area=results.c.total_defect_area,
+            )
+        )
+        await session.execute(
+            delete(FileDefect)
+            .where(FileDefect.file_id.in_(select(files.c.file_id)),
+                   tuple_(FileDefect.file_id, FileDefect.class_id).not_in(select(counts.c.file_id, counts.c.class_id)))
+        )
+        stmt = insert(FileDefect).from_select(
+            [FileDefect.file_id, FileDefect.project_id, FileDefect.class_id, FileDefect.count],
+            select(counts.c.file_id, ProjectFile.project_id, counts.c.class_id, counts.c.count)
+            .join(ProjectFile, ProjectFile.id == counts.c.file_id),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FileDefect.file_id, FileDefect.class_id],
+            set_={"count": stmt.excluded["count"]},
+            where=FileDefect.count.is_distinct_from(stmt.excluded["count"]),
+        )
+        await session.execute(stmt)
+
+    @staticmethod
+    async def _lock_projects(file_ids: Sequence[int]) -> None:
+        """
+        Блокирует строки проектов файлов по порядку id в транзакции вызывающего. Сохранение результата берет их
+        первыми, до строк файлов и статистики дефектов: триггер счетчиков блокирует проект только при смене
+        статуса, а без общего порядка блокировок результаты одного проекта ловят deadlock
+        """
+        from dao.project import Project
+        session = session_factory.get_async()
+        await session.execute(
+            select(Project.id)
+            .where(Project.id.in_(select(ProjectFile.project_id).where(ProjectFile.id.in_(file_ids))))
+            .order_by(Project.id)
+            .with_for_update()
+        )
+
+    @staticmethod
+    @with_async_db_session
+    async def save_recognitions(results: Sequence[Dict[str, Any]], model_version: Optional[str]) -> Sequence[Row]:
+        """
+        Сохраняет результаты распознавания пачки файлов одной транзакцией - то же, что save_recognition, но каждой
+        таблице по одному оператору на всю пачку, поэтому триггеры счетчиков проекта и статистики дефектов
+        срабатывают один раз. results - по одному на файл: file_id, status, defect_counts, label, detections,
+        max_defect_area, total_defect_area, s3_txt_path, s3_txt_url (None - путь разметки в S3 не меняется).
+        Геометрия объектов загружается через COPY. Возвращает (id, project_id, job_id) сохраненных файлов,
+        удаленных к этому моменту файлов в ответе нет.
+        """
+        session = session_factory.get_async()
+        await ProjectFile._lock_projects([result["file_id"] for result in results])
+        data = values(
+            column("id", Integer), column("status", ProjectFile.status.type), column("defect_count", Integer),
+            column("defect_classes", ARRAY(SmallInteger)), column("max_defect_area", REAL),
+            column("total_defect_area", REAL), column("s3_txt_path", String), column("s3_txt_url", String),
+            name="results",
+        ).data([
+            (result["file_id"], result["status"], sum(result["defect_counts"].values()),
+             sorted(class_id for class_id, count in result["defect_counts"].items() if count > 0),
+             result["max_defect_area"], result["total_defect_area"], result["s3_txt_path"], result["s3_txt_url"])
+            for result in results
+        ])
+        # Строки блокируются по порядку id: пачки, идущие параллельно, не ловят deadlock
+        locked = (
+            select(ProjectFile.id, ProjectFile.job_id)
+            .where(ProjectFile.id.in_([result["file_id"] for result in results]))
+            .order_by(ProjectFile.id)
+            .with_for_update()
+            .subquery()
+        )
+        saved = (await session.execute(
+            update(ProjectFile)
+            .where(ProjectFile.id == locked.c.id, ProjectFile.id == data.c.id)
+            .values(status=data.c.status, defect_count=data.c.defect_count, defect_classes=data.c.defect_classes,
+                    max_defect_area=data.c.max_defect_area, total_defect_area=data.c.total_defect_area,
+                    s3_txt_path=func.coalesce(data.c.s3_txt_path, ProjectFile.s3_txt_path),
+                    s3_txt_url=func.coalesce(data.c.s3_txt_url, ProjectFile.s3_txt_url), model_version=model_version,
+                    job_id=None, near_duplicate_of=None)
+            .returning(ProjectFile.id, ProjectFile.project_id, locked.c.job_id)
+        )).all()
+        if not saved:
+            await session.rollback()
+            return saved
+
+        project_ids = {row.id: row.project_id for row in saved}
+        results = [result for result in results if result["file_id"] in project_ids]
+        file_ids = list(project_ids)
+
+        await session.execute(delete(FileDefect).where(FileDefect.file_id.in_(file_ids)))
+        defects = [dict(file_id=result["file_id"], project_id=project_ids[result["file_id"]], class_id=class_id, count=count)
+                   for result in results for class_id, count in result["defect_counts"].items()]
+        if defects:
+            await session.execute(insert(FileDefect).values(defects))
+
+        await session.execute(delete(FileDetection).where(FileDetection.file_id.in_(file_ids)))
+        detection_columns = ["file_id", "class_id", "area_ratio", "confidence", "area", "perimeter", "max_extent",
+                             "bbox_x", "bbox_y", "bbox_w", "bbox_h"]
+        records = [(result["file_id"], *(detection.get(name) for name in detection_columns[1:]))
+                   for result in results for detection in result["detections"]]
+        if records:
+            connection = await (await session.connection()).get_raw_connection()
+            await connection.driver_connection.copy_records_to_table(
+                FileDetection.__tablename__, records=records, columns=detection_columns)
+
+        await session.execute(FileLabel.upsert_many({result["file_id"]: result["label"] for result in results}))
+        for job_id, done in Counter(row.job_id for row in saved if row.job_id is not None).items():
+            await ProjectJob.increment(job_id, done=done)
+        await session.commit()
+        return saved
+
+    @staticmethod
+    @with_async_db_session
+    async def save_recognition(file_id: int, status: ProjectFileStatusType, defect_counts: Dict[int, int], label: str,
+                               detections: Sequence[Dict[str, Any]] = (), max_defect_area: float = 0,
+                               total_defect_area: float = 0, model_version: Optional[str] = None,
+                               s3_txt_path: Optional[str] = None, s3_txt_url: Optional[str] = None) -> Optional[Row]:
+        """
+        Сохраняет результат распознавания одной транзакцией: статус, количество и площади дефектов файла,
+        дефекты по классам (upsert), геометрию объектов (detections - значения колонок FileDetection без file_id,
+        заменяют прежние), разметку, освобождение файла от задачи и прогресс задачи.
+        Возвращает (project_id, job_id) - job_id задачи, к которой был привязан файл. None - файла нет.
+        """
+        session = session_factory.get_async()
+
+        await ProjectFile._lock_projects([file_id])
+        # Один UPDATE ... RETURNING: блокируем строку, чтобы забрать прежний job_id, и сразу его сбрасываем
+        locked = select(ProjectFile.id, ProjectFile.job_id).where(ProjectFile.id == file_id).with_for_update().subquery()
+        values = dict(status=status, defect_count=sum(defect_counts.values()), job_id=None,
+                      defect_classes=sorted(class_id for class_id, count in defect_counts.items() if count > 0),
+                      max_defect_area=max_defect_area, total_defect_area=total_defect_area, model_version=model_version,
+                      near_duplicate_of=None)
+        if s3_txt_path is not None:
+            values.update(s3_txt_path=s3_txt_path, s3_txt_url=s3_txt_url)
+        result = await session.execute(
+            update(ProjectFile)
+            .where(ProjectFile.id == locked.c.id)
+            .values(**values)
+            .returning(ProjectFile.project_id, locked.c.job_id)
+        )
+        saved = result.first()
+        if saved is None:
+            await session.rollback()
+            return None
+
+        await session.execute(
+            delete(FileDefect).where(FileDefect.file_id == file_id, FileDefect.class_id.not_in(list(defect_counts)))
+        )
+        if defect_counts:
+            stmt = insert(FileDefect).values([
+                dict(file_id=file_id, project_id=saved.project_id, class_id=class_id, count=count)
+                for class_id, count in defect_counts.items()
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[FileDefect.file_id, FileDefect.class_id],
+                set_={"count": stmt.excluded["count"]},
+                where=FileDefect.count.is_distinct_from(stmt.excluded["count"]),
+            )
+            await session.execute(stmt)
+
+        await session.execute(delete(FileDetection).where(FileDetection.file_id == file_id))
+        if detections:
+            await session.execute(insert(FileDetection), [dict(detection, file_id=file_id) for detection in detections])
 
+        label_stmt, _ = FileLabel.upsert(file_id, label)
+        await session.execute(label_stmt)
+        if saved.job_id is not None:
+            await ProjectJob.increment(saved.job_id, done=1)
         await session.commit()
-        return result.scalar_one_or_none()
\ No newline at end of file
+        return saved
@@ -0,0 +1,130 @@
+from typing import Optional
+
+from sqlalchemy import Column, DateTime, Enum, ForeignKey, Integer, String, and_, select, update
+from sqlalchemy.sql import func
+
+from dao.base import Base, session_factory, with_async_db_session
+from rest.models.project_job import ProjectJobData, ProjectJobStatusType, ProjectJobType
+
+
+class ProjectJob(Base):
+    __tablename__ = "project_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="SET NULL"), nullable=True)
+    type = Column(String(32), nullable=False)
+    status = Column(Enum(ProjectJobStatusType, name="job_status_type"), nullable=False, default=ProjectJobStatusType.queued)
+    total = Column(Integer, nullable=False, default=0)
+    dispatched = Column(Integer, nullable=False, default=0)
+    done = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    result_url = Column(String, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+    def to_api(self) -> ProjectJobData:
+        return ProjectJobData(
+            id=self.id,
+            project_id=self.project_id,
+            type=ProjectJobType(self.type),
+            status=self.status,
+            total=self.total,
+            queued=max(self.total - self.dispatched - self.failed, 0),
+            dispatched=self.dispatched,
+            done=self.done,
+            failed=self.failed,
+            error=self.error,
+            result_url=self.result_url,
+            created_at=self.created_at,
+            updated_at=self.updated_at,
+            finished_at=self.finished_at
+        )
+
+    @staticmethod
+    @with_async_db_session
+    async def create_job(project_id: Optional[int], job_type: ProjectJobType) -> "ProjectJob":
+        session = session_factory.get_async()
+        job = ProjectJob(project_id=project_id, type=job_type.value, status=ProjectJobStatusType.queued)
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+    @staticmethod
+    @with_async_db_session
+    async def get_job_by_id(job_id: int) -> Optional["ProjectJob"]:
+        session = session_factory.get_async()
+        result = await session.execute(select(ProjectJob).where(ProjectJob.id == job_id))
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    @with_async_db_session
+    async def start(job_id: int, total: int, auto_finish: bool = True) -> None:
+        session = session_factory.get_async()
+        await session.execute(
+            update(ProjectJob)
+            .where(ProjectJob.id == job_id)
+            .values(status=ProjectJobStatusType.running, total=total, updated_at=func.now())
+        )
+        if auto_finish:
+            await ProjectJob._finish_if_complete(job_id)
+        await session.commit()
+
+    @staticmethod
+    @with_async_db_session
+    async def add_progress(job_id: int, dispatched: int = 0, done: int = 0, failed: int = 0, auto_finish: bool = True) -> None:
+        """Атомарно увеличивает счетчики. Задача завершается, когда по всем файлам есть итог
+        (если auto_finish=False - только явным вызовом finish)."""
+        session = session_factory.get_async()
+        await ProjectJob.increment(job_id, dispatched=dispatched, done=done, failed=failed, auto_finish=auto_finish)
+        await session.commit()
+
+    @staticmethod
+    async def increment(job_id: int, dispatched: int = 0, done: int = 0, failed: int = 0, auto_finish: bool = True) -> None:
+        """То же, что add_progress, но в текущей транзакции вызывающего - без commit"""
+        session = session_factory.get_async()
+        await session.execute(
+            update(ProjectJob)
+            .where(ProjectJob.id == job_id)
+            .values(dispatched=ProjectJob.dispatched + dispatched,
+                    done=ProjectJob.done + done,
+                    failed=ProjectJob.failed + failed,
+                    updated_at=func.now())
+        )
+        if auto_finish:
+            await ProjectJob._finish_if_complete(job_id)
+
+    @staticmethod
+    async def _finish_if_complete(job_id: int) -> None:
+        session = session_factory.get_async()
+        await session.execute(
+            update(ProjectJob)
+            .where(and_(ProjectJob.id == job_id,
+                        ProjectJob.status == ProjectJobStatusType.running,
+                        ProjectJob.done + ProjectJob.failed >= ProjectJob.total))
+            .values(status=ProjectJobStatusType.done, finished_at=func.now())
+        )
+
+    @staticmethod
+    @with_async_db_session
+    async def finish(job_id: int, result_url: Optional[str] = None) -> None:
+        session = session_factory.get_async()
+        await session.execute(
+            update(ProjectJob)
+            .where(ProjectJob.id == job_id)
+            .values(status=ProjectJobStatusType.done, result_url=result_url, updated_at=func.now(), finished_at=func.now())
+        )
+        await session.commit()
+
+    @staticmethod
+    @with_async_db_session
+    async def fail(job_id: int, error: str) -> None:
+        session = session_factory.get_async()
+        await session.execute(
+            update(ProjectJob)
+            .where(ProjectJob.id == job_id)
+            .values(status=ProjectJobStatusType.failed, error=error, updated_at=func.now(), finished_at=func.now())
+        )
+        await session.commit()
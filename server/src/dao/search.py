@@ -0,0 +1,44 @@
+import sys
+from typing import Optional
+
+from sqlalchemy import ColumnElement, and_, func
+
+# Суррогатные коды не бывают символами строки Postgres
+SURROGATES = range(0xD800, 0xE000)
+
+
+def escape_like(term: str) -> str:
+    """Экранирует спецсимволы LIKE, чтобы % и _ в запросе искались буквально"""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def text_search(column, term: str, prefix: bool = False) -> ColumnElement[bool]:
+    """
+    Условие поиска по строковой колонке без учета регистра.
+
+    contains - ILIKE '%term%', обслуживается GIN-индексом gin_trgm_ops (для term от 3 символов).
+    prefix - диапазон lower(column) в [term, следующая строка) операторами text_pattern_ops:
+    в отличие от LIKE 'term%', диапазон использует btree-индекс и в обобщенном плане prepared statement.
+    """
+    if not prefix:
+        return column.ilike(f"%{escape_like(term)}%")
+    lower_bound = term.lower()
+    upper_bound = prefix_upper_bound(lower_bound)
+    lowered = func.lower(column)
+    if upper_bound is None:
+        return lowered.op("~>=~")(lower_bound)
+    return and_(lowered.op("~>=~")(lower_bound), lowered.op("~<~")(upper_bound))
+
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """
+    Первая строка после всех строк с началом prefix: последний символ увеличивается на единицу, суррогаты
+    пропускаются, а последний символ Unicode переносит увеличение в предыдущий. None - такой строки нет
+    """
+    for end in range(len(prefix), 0, -1):
+        code = ord(prefix[end - 1]) + 1
+        if code in SURROGATES:
+            code = SURROGATES.stop
+        if code <= sys.maxunicode:
+            return prefix[:end - 1] + chr(code)
+    return None
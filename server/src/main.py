@@ -1,17 +1,18 @@
 import asyncio
 import signal
 import threading
-from asyncio import AbstractEventLoop
 import time
+from asyncio import AbstractEventLoop
 
-import uvicorn
 import psycopg2
+import uvicorn
 import yoyo
 from starlette.middleware.cors import CORSMiddleware
 
 from rest import router_init
 from utils.config import CONFIG
 from utils.logger import get_logger, get_logger_univorn
+from utils.process_pool import shutdown_process_pool
 from utils.shutdown import GLOBAL_SHUTDOWN_EVENT
 
 log = get_logger("Main")
@@ -72,6 +73,7 @@ class Main:
         print("Shutting down servers gracefully...")
         self.rest_server.should_exit = True
         self.uvicorn_start_thread.join()
+        shutdown_process_pool()
 
         # self.grpc_server.stop(grace=15)
 
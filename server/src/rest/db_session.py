@@ -0,0 +1,50 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from dao.base import session_factory
+from rest.db_stats import check_query_budget
+
+# Методы без изменений данных: их сессия работает без транзакции
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class DbSessionMiddleware:
+    """
+    Одна сессия БД на HTTP-запрос: сервисы и DAO с with_async_db_session берут ее из контекста, а не открывают
+    каждый свою - меньше соединений из пула и фиксаций, а повторно загруженные объекты (проект запроса)
+    находятся в identity map сессии.
+    Запросы на чтение идут без транзакции. Сессия фиксируется до начала ответа: клиент видит успех только
+    после commit, а тело потокового ответа (StreamingResponse, SSE) открывает свои сессии и не держит соединение
+    запроса. Перед commit проверяется бюджет запросов эндпоинта (check_query_budget). Исключение, не ставшее
+    ответом, откатывает сессию.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        session, token = session_factory.open_request_async(read_only=scope["method"] in READ_METHODS)
+        closed = False
+
+        async def close(commit: bool) -> None:
+            nonlocal closed
+            if not closed:
+                closed = True
+                await session_factory.close_request_async(session, commit)
+
+        async def send_with_commit(message: Message) -> None:
+            if message["type"] == "http.response.start" and not closed:
+                # Отложенные изменения ORM - тоже запросы запроса: flush до проверки, чтобы бюджет их учел
+                await session.flush()
+                check_query_budget(scope)
+                await close(commit=True)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_commit)
+        finally:
+            await close(commit=False)
+            session_factory.async_context_var.reset(token)
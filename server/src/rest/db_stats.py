@@ -0,0 +1,104 @@
+import re
+from typing import Callable, List, Tuple, TypeVar
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from dao.base import QueryStats, query_stats
+from utils.config import CONFIG
+from utils.logger import get_logger
+from utils.metrics import HTTP_DB_BUDGET_EXCEEDED, HTTP_DB_QUERIES, HTTP_DB_SECONDS
+
+log = get_logger("DbStats")
+
+F = TypeVar("F", bound=Callable)
+
+# Длина SQL в заголовке X-DB-Slowest
+STATEMENT_PREVIEW = 200
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(queries: int) -> Callable[[F], F]:
+    """
+    Бюджет запросов к БД эндпоинта - сколько их может быть до начала ответа (тело StreamingResponse не считается).
+    Ставится под декоратором маршрута. Превышение - предупреждение в лог и метрика, а при db_stats.enforce_budgets -
+    ошибка 500: так проверочный прогон API (tests/test_query_budgets.py) ловит лишние запросы (N+1, повторные загрузки)
+    """
+
+    def decorator(endpoint: F) -> F:
+        endpoint.query_budget = queries
+        return endpoint
+
+    return decorator
+
+
+def check_query_budget(scope: Scope) -> None:
+    """
+    Сверяет число запросов к БД HTTP-запроса с бюджетом его эндпоинта (query_budget). Вызывает DbSessionMiddleware
+    после flush, перед фиксацией сессии запроса: при db_stats.enforce_budgets превышение откатывает незафиксированные
+    изменения, и клиент не получает успех. То, что DAO уже зафиксировали сами (commit внутри метода), остается -
+    поэтому enforce_budgets только для проверочных прогонов, не для рабочего сервера
+    """
+    stats = query_stats.get()
+    budget = getattr(scope.get("endpoint"), "query_budget", None)
+    if stats is None or budget is None or stats.count <= budget:
+        return
+    route = _route(scope)
+    HTTP_DB_BUDGET_EXCEEDED.labels(scope["method"], route).inc()
+    slowest = "; ".join(f"{duration * 1000:.1f} ms {_preview(statement)}" for duration, statement in stats.slowest)
+    message = f"{scope['method']} {route}: {stats.count} DB queries, budget {budget}. Slowest: {slowest}"
+    if CONFIG.db_stats.enforce_budgets:
+        raise QueryBudgetExceeded(message)
+    log.warning(message)
+
+
+class DbStatsMiddleware:
+    """
+    Число запросов к БД, их суммарное время и самые долгие за HTTP-запрос (события движков в dao.base).
+    Метрики - по шаблону пути эндпоинта, вместе с телом ответа. Заголовки X-DB-Queries, X-DB-Time-Ms и X-DB-Slowest
+    (при db_stats.headers) - на момент начала ответа. Бюджет (query_budget) проверяет DbSessionMiddleware
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(keep=CONFIG.db_stats.slowest)
+        token = query_stats.set(stats)
+
+        async def send_with_stats(message: Message) -> None:
+            if message["type"] == "http.response.start" and CONFIG.db_stats.headers:
+                message = {**message, "headers": [*message.get("headers", []), *_headers(stats)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            query_stats.reset(token)
+            route = _route(scope)
+            HTTP_DB_QUERIES.labels(scope["method"], route).observe(stats.count)
+            HTTP_DB_SECONDS.labels(scope["method"], route).observe(stats.duration)
+
+
+def _route(scope: Scope) -> str:
+    # Шаблон пути, а не сам путь: у метрик не должно быть метки на каждый id
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def _headers(stats: QueryStats) -> List[Tuple[bytes, bytes]]:
+    headers = [(b"x-db-queries", str(stats.count).encode()),
+               (b"x-db-time-ms", f"{stats.duration * 1000:.1f}".encode())]
+    headers.extend((b"x-db-slowest", f"{duration * 1000:.1f} ms {_preview(statement)}".encode("latin-1", "replace"))
+                   for duration, statement in stats.slowest)
+    return headers
+
+
+def _preview(statement: str) -> str:
+    return re.sub(r"\s+", " ", statement).strip()[:STATEMENT_PREVIEW]
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Path, Query, Response
-from typing import Optional
+from typing import List, Optional
 
-from rest.models.project_file import ProjectFileData, ProjectFileListData
+from fastapi import APIRouter, Depends, File, Path, Query, Response, UploadFile
+from fastapi.responses import RedirectResponse
+
+from rest.db_stats import query_budget
+from rest.models.project_file import FileDetectionData, ProjectFileData, ProjectFileListData, ProjectFileSortType
 from service.file_service import FileService
+from service.report_service import ReportService
 from utils.logger import get_logger
 
 log = get_logger("FileEndpoint")
@@ -11,6 +15,7 @@ router = APIRouter(prefix="/projects/{project_id}/files", tags=["files"])
 
 
 @router.post("", response_model=ProjectFileData)
+@query_budget(14)
 async def upload_file(
     project_id: int = Path(..., description="Project ID"),
     file: UploadFile = File(...),
@@ -24,28 +29,45 @@ async def upload_file(
 
 
 @router.get("", response_model=ProjectFileListData)
+@query_budget(5)
 async def get_project_files(
     project_id: int = Path(..., description="Project ID"),
     filename: Optional[str] = Query(None, description="Фильтр по имени файла"),
+    filename_match: str = Query("contains", description="Как искать filename: по подстроке или по началу имени", enum=["contains", "prefix"]),
     status: Optional[str] = Query(None, description="Фильтр по статусу файла", enum=["processing", "success", "error"]),
     page: int = Query(1, ge=1, description="Номер страницы"),
     size: int = Query(20, ge=1, le=100, description="Количество элементов на странице"),
+    sort: ProjectFileSortType = Query(ProjectFileSortType.defect_count,
+                                      description="Сортировка по убыванию: количество дефектов, самый крупный дефект или суммарная площадь"),
+    min_defect_area: Optional[float] = Query(None, ge=0, description="Площадь самого крупного дефекта не меньше, пикселей"),
+    min_total_defect_area: Optional[float] = Query(None, ge=0, description="Суммарная площадь дефектов не меньше, пикселей"),
+    defect_class: Optional[List[int]] = Query(None, description="ID классов дефектов, которые все есть в файле"),
+    exclude_class: Optional[List[int]] = Query(None, description="ID классов дефектов, которых в файле нет"),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы, при нем page не учитывается"),
     service: FileService = Depends()
 ) -> ProjectFileListData:
     """Получить список файлов с возможностью фильтрации"""
-    log.info(f"Getting files for project {project_id}, filters: filename={filename}, status={status}, page={page}, size={size}")
+    log.info(f"Getting files for project {project_id}, filters: filename={filename}, status={status}, sort={sort.value}, page={page}, size={size}")
     result = await service.get_project_files(
         project_id=project_id,
         filename=filename,
+        filename_prefix=filename_match == "prefix",
         status=status,
         page=page,
-        size=size
+        size=size,
+        cursor=cursor,
+        sort=sort,
+        min_defect_area=min_defect_area,
+        min_total_defect_area=min_total_defect_area,
+        defect_classes=defect_class,
+        exclude_classes=exclude_class
     )
     log.info(f"Retrieved {len(result.items)} files for project {project_id}")
     return result
 
 
 @router.get("/{file_id}", response_model=ProjectFileData)
+@query_budget(3)
 async def get_file(
     project_id: int = Path(..., description="Project ID"),
     file_id: int = Path(..., description="File ID"),
@@ -58,7 +80,22 @@ async def get_file(
     return result
 
 
+@router.get("/{file_id}/detections", response_model=List[FileDetectionData])
+@query_budget(3)
+async def get_file_detections(
+    project_id: int = Path(..., description="Project ID"),
+    file_id: int = Path(..., description="File ID"),
+    service: FileService = Depends()
+):
+    """Геометрия дефектов файла: площадь, периметр, максимальный размер и bbox каждого объекта"""
+    log.info(f"Received request to get detections of file {file_id} from project {project_id}")
+    result = await service.get_file_detections(project_id, file_id)
+    log.info(f"Retrieved {len(result)} detections of file {file_id}")
+    return result
+
+
 @router.delete("/{file_id}")
+@query_budget(5)
 async def delete_file(
     project_id: int = Path(..., description="Project ID"),
     file_id: int = Path(..., description="File ID"),
@@ -72,6 +109,7 @@ async def delete_file(
 
 
 @router.post("/{file_id}/training", response_model=ProjectFileData)
+@query_budget(5)
 async def training_file(
     project_id: int = Path(..., description="Project ID"),
     file_id: int = Path(..., description="File ID"),
@@ -85,13 +123,17 @@ async def training_file(
 
 
 @router.get("/{file_id}/report")
-async def get_report_for_file(project_id: int, file_id: int, service: FileService = Depends()) -> Response:
-    """Создать и скачать отчет о файле в формате PDF"""
+@query_budget(3)
+async def get_report_for_file(project_id: int, file_id: int, service: ReportService = Depends()) -> Response:
+    """Скачать отчет о файле в формате PDF. Готовый отчет отдается редиректом на S3"""
     log.info(f"Received request to get report for file {file_id} from project {project_id}")
-    pdf_bytes = await service.get_report(project_id=project_id, file_id=file_id)
+    report = await service.get_file_report(project_id=project_id, file_id=file_id)
+    if report.content is None:
+        log.info(f"Redirecting to cached PDF report for file {file_id} from project {project_id}")
+        return RedirectResponse(report.url)
     log.info(f"Retrieved PDF report for file {file_id} from project {project_id}")
     return Response(
-        content=pdf_bytes,
+        content=report.content,
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename=report_{file_id}.pdf"})
 
@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class AnalyticsTable(str, Enum):
+    files = "files"  # Файлы проекта: статус, размеры, агрегаты дефектов
+    defects = "defects"  # Количество дефектов по классам на файл
+    detections = "detections"  # Объекты разметки с геометрией
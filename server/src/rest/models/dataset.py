@@ -0,0 +1,23 @@
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from rest.models.project_file import ProjectFileStatusType
+
+
+class DatasetFormat(str, Enum):
+    files = "files"  # Отдельные объекты images/ и labels/, выборка копится между выгрузками
+    shards = "shards"  # tar-шарды в формате WebDataset, каждая выгрузка - новый набор шардов с index.json
+
+
+class TrainingExportData(BaseModel):
+    """Какие файлы проекта выгрузить в обучающую выборку и в каком виде"""
+    format: DatasetFormat = DatasetFormat.files
+    dataset: str = Field("default", pattern=r"^[A-Za-z0-9_.-]{1,64}$", description="Имя выборки в бакете обучения")
+    file_ids: Optional[List[int]] = Field(None, description="Только эти файлы")
+    status: Optional[ProjectFileStatusType] = None
+    defect_classes: Optional[List[int]] = Field(None, description="Файлы с дефектом хотя бы одного из классов")
+    manual_only: bool = Field(False, description="Только файлы с разметкой, загруженной или исправленной вручную")
+    val_percent: int = Field(20, ge=0, le=50, description="Доля валидационной части, %")
+    shard_size_mb: int = Field(256, ge=16, le=4096, description="Размер tar-шарда, МБ (для format=shards)")
@@ -1,7 +1,8 @@
 from datetime import datetime
 from enum import Enum
 from typing import List, Optional
-from pydantic import BaseModel
+
+from pydantic import BaseModel, Field
 
 
 class S3LinkData(BaseModel):
@@ -26,7 +27,21 @@ class ProjectData(BaseModel):
     created_at: datetime = None
     status: ProjectStatusType
     count_of_files: int
+    processing_files: int = 0
+    error_files: int = 0
+    success_files: int = 0
     status_files: ProjectFilesStatusType
+    confidence_threshold: Optional[float] = None  # None - учитываются все объекты разметки, у нового проекта 0.25
+    near_duplicate_distance: Optional[int] = None  # None - почти одинаковые снимки распознаются каждый сам
+
+
+class ConfidenceThresholdData(BaseModel):
+    threshold: Optional[float] = Field(None, ge=0, le=1, description="Порог уверенности, None - учитывать все объекты")
+
+
+class NearDuplicateDistanceData(BaseModel):
+    max_distance: Optional[int] = Field(None, ge=0, le=7, description="Расстояние Хэмминга перцептивных хешей, "
+                                                                      "None - не копировать результат похожих снимков")
 
 
 class CreateProjectData(BaseModel):
@@ -38,3 +53,4 @@ class ProjectListData(BaseModel):
     total: int
     page: int
     size: int
+    next_cursor: Optional[str] = None  # курсор следующей страницы, None - страница последняя
@@ -0,0 +1,13 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from rest.models.project_file import FileDefectData, ProjectFileStatusType
+
+
+class FileEventData(BaseModel):
+    file_id: int
+    project_id: int
+    status: ProjectFileStatusType
+    defect_count: int = 0
+    defects: List[FileDefectData] = Field(default_factory=list)
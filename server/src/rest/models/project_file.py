@@ -1,6 +1,7 @@
-from pydantic import BaseModel, Field
-from typing import List
 from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
 
 
 class YoloAnnotationData(BaseModel):
@@ -15,6 +16,12 @@ class ProjectFileStatusType(str, Enum):
     process_error = "process_error"
 
 
+class ProjectFileSortType(str, Enum):
+    defect_count = "defect_count"
+    max_defect_area = "max_defect_area"  # Площадь самого крупного дефекта
+    total_defect_area = "total_defect_area"  # Суммарная площадь дефектов
+
+
 class FileDefectData(BaseModel):
     class_id: int
     defect_name: str
@@ -33,12 +40,34 @@ class ProjectFileData(BaseModel):
     s3_txt_url: str
     s3_report_path: str = None
     s3_report_url: str = None
+    s3_preview_path: str = None
+    s3_preview_url: str = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    image_format: Optional[str] = None
     status: ProjectFileStatusType
     defects: List[FileDefectData] = Field(default_factory=list)
     defect_count: int = 0
+    max_defect_area: float = 0  # В пикселях
+    total_defect_area: float = 0
+    model_version: Optional[str] = None  # SHA-256 весов модели, давшей результат
+    content_hash: Optional[str] = None  # SHA-256 изображения
+    near_duplicate_of: Optional[int] = None  # Результат скопирован с почти такого же снимка этого файла
     label: str = None
 
 
+class FileDetectionData(BaseModel):
+    """Геометрия объекта разметки. Пиксельные метрики None, если размеры изображения неизвестны"""
+    class_id: int
+    defect_name: str
+    area_ratio: float
+    confidence: Optional[float] = None
+    area: Optional[float] = None
+    perimeter: Optional[float] = None
+    max_extent: Optional[float] = None
+    bbox: Optional[List[float]] = None  # x, y, ширина, высота
+
+
 class ProjectFileListData(BaseModel):
     items: List[ProjectFileData]
     total: int
@@ -46,3 +75,17 @@ class ProjectFileListData(BaseModel):
     size: int
     defect_statistics: List[FileDefectData] = Field(default_factory=list)
     total_defects: int = 0
+    next_cursor: Optional[str] = None  # курсор следующей страницы, None - страница последняя
+
+
+class NearDuplicateClusterData(BaseModel):
+    """Группа почти одинаковых снимков: связаны цепочкой пар на расстоянии Хэмминга не больше порога"""
+    files: List[ProjectFileData]
+
+
+class NearDuplicateClusterListData(BaseModel):
+    items: List[NearDuplicateClusterData]
+    total: int  # Количество групп
+    page: int
+    size: int
+    max_distance: int
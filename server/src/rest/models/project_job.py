@@ -0,0 +1,39 @@
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class ProjectJobStatusType(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class ProjectJobType(str, Enum):
+    recognition = "recognition"
+    reprocess = "reprocess"  # Досчет файлов без результата текущей модели
+    report = "report"
+    deletion = "deletion"  # Удаление проекта: прогресс - удаленные объекты S3
+    training_export = "training_export"  # Выгрузка обучающей выборки, result_url - манифест или индекс шардов
+    analytics_export = "analytics_export"  # Выгрузка таблиц для аналитики в Parquet, без проекта - все проекты
+    label_import = "label_import"  # Импорт архива разметки, result_url - итог (несопоставленные имена)
+
+
+class ProjectJobData(BaseModel):
+    id: int
+    project_id: Optional[int] = None
+    type: ProjectJobType
+    status: ProjectJobStatusType
+    total: int
+    queued: int
+    dispatched: int
+    done: int
+    failed: int
+    error: Optional[str] = None
+    result_url: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
@@ -1,12 +1,22 @@
-from fastapi import APIRouter, Depends, Query
-from typing import Optional
 from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, File, Query, UploadFile
+from fastapi.responses import StreamingResponse
 
-from rest.models.project import ProjectData, ProjectListData, CreateProjectData
-from rest.models.project_file import ProjectFileListData
+from rest.db_stats import query_budget
+from rest.models.analytics import AnalyticsTable
+from rest.models.dataset import TrainingExportData
+from rest.models.project import ConfidenceThresholdData, CreateProjectData, NearDuplicateDistanceData, ProjectData, ProjectListData
+from rest.models.project_file import NearDuplicateClusterListData
+from rest.models.project_job import ProjectJobData
+from service.analytics_service import PARQUET_CONTENT_TYPE, AnalyticsExportService
+from service.dataset_service import DatasetExportService
+from service.event_service import EVENT_BUS
 from service.file_service import FileService
+from service.label_import_service import LabelImportService
+from service.project_report_service import ProjectReportService
 from service.project_service import ProjectService
-
 from utils.logger import get_logger
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
@@ -14,6 +24,7 @@ log = get_logger("project_endpoint")
 
 
 @router.post("", response_model=ProjectData)
+@query_budget(2)
 async def create_project(create_project_data: CreateProjectData, service: ProjectService = Depends()) -> ProjectData:
     """Создать проект"""
     log.info(f"Creating project with data: {create_project_data}")
@@ -23,23 +34,28 @@ async def create_project(create_project_data: CreateProjectData, service: Projec
 
 
 @router.get("", response_model=ProjectListData)
+@query_budget(2)
 async def search_projects(
     name: Optional[str] = Query(None, description="Фильтр по названию проекта"),
+    name_match: str = Query("contains", description="Как искать name: по подстроке или по началу названия", enum=["contains", "prefix"]),
     status_files: Optional[str] = Query(None, description="Фильтр по статусу файлов", enum=["processing", "success", "error"]),
     start_date: Optional[datetime] = Query(None, description="Дата начала периода (включительно)"),
     end_date: Optional[datetime] = Query(None, description="Дата окончания периода (включительно)"),
     page: int = Query(1, ge=1, description="Номер страницы"),
     size: int = Query(20, ge=1, le=100, description="Количество элементов на странице"),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы, при нем page не учитывается"),
     service: ProjectService = Depends()
 ) -> ProjectListData:
     """Получить список проектов с возможностью фильтрации"""
     log.info(f"Searching projects: name={name}, date_range={start_date}-{end_date}, page={page}, size={size}")
     result = await service.search_projects(
         name=name,
+        name_prefix=name_match == "prefix",
         start_date=start_date,
         end_date=end_date,
         page=page,
         size=size,
+        cursor=cursor,
         status_files=status_files
     )
     log.info(f"Found {result.total} matching projects")
@@ -47,6 +63,7 @@ async def search_projects(
 
 
 @router.get("/{project_id}", response_model=ProjectData)
+@query_budget(1)
 async def get_project(project_id: int, service: ProjectService = Depends()) -> ProjectData:
     """Получить проекте по ID"""
     log.info(f"Getting project with id: {project_id}")
@@ -55,19 +72,21 @@ async def get_project(project_id: int, service: ProjectService = Depends()) -> P
     return result
 
 
-@router.delete("/{project_id}")
-async def delete_project(project_id: int, p_service: ProjectService = Depends(), f_service: FileService = Depends()):
-    """Удалить проект по ID"""
+@router.delete("/{project_id}", response_model=ProjectJobData)
+@query_budget(3)
+async def delete_project(project_id: int, service: ProjectService = Depends()) -> ProjectJobData:
+    """
+    Удалить проект по ID. Проект сразу пропадает из списков, объекты S3 и строки удаляются в фоне,
+    прогресс - в возвращаемой задаче
+    """
     log.info(f"Deleting project and s3 folder with id: {project_id}")
-    files = await f_service.get_project_files(project_id, to_delete=True)
-    for file in files:
-            await f_service.delete_file(file.id)
-    await p_service.delete_project(project_id)
-    log.info(f"Project {project_id} deleted")
-    return {"status": "success"}
+    result = await service.delete_project(project_id)
+    log.info(f"Project {project_id} deletion started: job {result.id}")
+    return result
 
 
 @router.put("/{project_id}", response_model=ProjectData)
+@query_budget(2)
 async def update_project_name(
     project_id: int, project_data: CreateProjectData, service: ProjectService = Depends()
 ) -> ProjectData:
@@ -78,7 +97,46 @@ async def update_project_name(
     return result
 
 
+@router.put("/{project_id}/confidence-threshold", response_model=ProjectData)
+@query_budget(5)
+async def update_confidence_threshold(
+    project_id: int, threshold_data: ConfidenceThresholdData, service: ProjectService = Depends()
+) -> ProjectData:
+    """Изменить порог уверенности проекта: статусы и дефекты распознанных файлов пересчитываются без повторного распознавания"""
+    log.info(f"Updating project {project_id} confidence threshold to: {threshold_data.threshold}")
+    result = await service.update_confidence_threshold(project_id, threshold_data.threshold)
+    log.info(f"Project updated: {result}")
+    return result
+
+
+@router.put("/{project_id}/near-duplicate-distance", response_model=ProjectData)
+@query_budget(1)
+async def update_near_duplicate_distance(
+    project_id: int, distance_data: NearDuplicateDistanceData, service: ProjectService = Depends()
+) -> ProjectData:
+    """Изменить порог похожести снимков: новый файл, похожий на распознанный, получит его результат без распознавания"""
+    log.info(f"Updating project {project_id} near duplicate distance to: {distance_data.max_distance}")
+    result = await service.update_near_duplicate_distance(project_id, distance_data.max_distance)
+    log.info(f"Project updated: {result}")
+    return result
+
+
+@router.get("/{project_id}/near-duplicates", response_model=NearDuplicateClusterListData)
+@query_budget(5)
+async def get_near_duplicates(
+    project_id: int,
+    max_distance: int = Query(4, ge=0, le=7, description="Расстояние Хэмминга перцептивных хешей"),
+    page: int = Query(1, ge=1),
+    size: int = Query(20, ge=1, le=100),
+    service: FileService = Depends()
+) -> NearDuplicateClusterListData:
+    """Группы почти одинаковых снимков проекта, от больших к меньшим"""
+    log.info(f"Getting near duplicates of project {project_id}, max distance {max_distance}")
+    return await service.get_near_duplicates(project_id, max_distance, page, size)
+
+
 @router.get("/{project_id}/status", response_model=ProjectData)
+@query_budget(4)
 async def update_project_status(project_id: int, service: ProjectService = Depends()) -> ProjectData:
     """Обновить статус проекта"""
     log.info(f"Updating project {project_id} status")
@@ -87,10 +145,118 @@ async def update_project_status(project_id: int, service: ProjectService = Depen
     return result
 
 
-@router.post("/{project_id}", response_model=ProjectFileListData)
-async def process_project_files(project_id: int, service: ProjectService = Depends()) -> ProjectFileListData:
-    """Отправляет проект на обработку (можно использовать для повторной обработки)"""
+@router.post("/{project_id}", response_model=ProjectJobData)
+@query_budget(3)
+async def process_project_files(project_id: int, service: ProjectService = Depends()) -> ProjectJobData:
+    """Отправляет проект на обработку (можно использовать для повторной обработки).
+    Возвращает фоновую задачу, прогресс - в GET /{project_id}/jobs/{job_id}"""
     log.info(f"Started reprocessing project {project_id}")
     result = await service.process_project_files(project_id=project_id)
-    log.info(f"Reprocessing project {project_id} completed!")
-    return result
\ No newline at end of file
+    log.info(f"Reprocessing project {project_id} started as job {result.id}")
+    return result
+
+
+@router.post("/{project_id}/reprocess", response_model=ProjectJobData)
+@query_budget(3)
+async def reprocess_stale_files(
+    project_id: int,
+    max_rate: Optional[float] = Query(None, gt=0, description="Файлов в секунду, по умолчанию batch.reprocess_rate"),
+    service: ProjectService = Depends()
+) -> ProjectJobData:
+    """Досчитывает только файлы без результата текущей модели воркера (после смены модели или ошибок).
+    Повторный вызов продолжает прерванный досчет. Прогресс - в GET /{project_id}/jobs/{job_id}"""
+    log.info(f"Started stale reprocessing of project {project_id}")
+    result = await service.reprocess_stale_files(project_id=project_id, max_rate=max_rate)
+    log.info(f"Stale reprocessing of project {project_id} started as job {result.id}")
+    return result
+
+
+@router.post("/{project_id}/training-export", response_model=ProjectJobData)
+@query_budget(3)
+async def export_training_dataset(
+    project_id: int, export_data: TrainingExportData, service: DatasetExportService = Depends()
+) -> ProjectJobData:
+    """
+    Выгрузить распознанные файлы проекта в обучающую выборку YOLO: format=files - images/, labels/, data.yaml,
+    manifest.jsonl (уже выгруженные файлы с той же разметкой пропускаются), format=shards - tar-шарды WebDataset
+    и index.json. Прогресс - в возвращаемой задаче
+    """
+    log.info(f"Exporting project {project_id} files to dataset {export_data.dataset}")
+    return await service.start_export(project_id, export_data)
+
+
+@router.post("/{project_id}/labels/import", response_model=ProjectJobData)
+@query_budget(3)
+async def import_project_labels(project_id: int, archive: UploadFile = File(...),
+                                service: LabelImportService = Depends()) -> ProjectJobData:
+    """
+    Импортировать архив (zip, tar, tar.gz) разметки YOLO: {имя}.txt применяется к файлам проекта с тем же именем
+    без расширения как ручная разметка. Прогресс - в возвращаемой задаче, итог импорта - по result_url
+    """
+    log.info(f"Importing labels archive {archive.filename} into project {project_id}")
+    return await service.start_import(project_id, archive)
+
+
+@router.get("/{project_id}/analytics/{table}")
+@query_budget(1)
+async def get_project_analytics(project_id: int, table: AnalyticsTable,
+                                service: AnalyticsExportService = Depends()) -> StreamingResponse:
+    """Скачать таблицу проекта для аналитики (files, defects, detections) одним файлом Parquet"""
+    log.info(f"Streaming analytics table {table.value} of project {project_id}")
+    await service.get_project(project_id)
+    return StreamingResponse(
+        service.stream_parquet(project_id, table),
+        media_type=PARQUET_CONTENT_TYPE,
+        headers={"Content-Disposition": f"attachment; filename=project_{project_id}_{table.value}.parquet"})
+
+
+@router.post("/{project_id}/analytics-export", response_model=ProjectJobData)
+@query_budget(3)
+async def export_project_analytics(project_id: int, service: AnalyticsExportService = Depends()) -> ProjectJobData:
+    """
+    Выгрузить таблицы проекта для аналитики в S3: analytics/{table}/project_id=.../date=.../part-00000.parquet.
+    Прогресс - в возвращаемой задаче
+    """
+    log.info(f"Exporting analytics of project {project_id}")
+    return await service.start_export(project_id)
+
+
+@router.get("/{project_id}/jobs/{job_id}", response_model=ProjectJobData)
+@query_budget(1)
+async def get_project_job(project_id: int, job_id: int, service: ProjectService = Depends()) -> ProjectJobData:
+    """Получить прогресс фоновой задачи проекта"""
+    return await service.get_job(project_id, job_id)
+
+
+@router.get("/{project_id}/report/csv")
+@query_budget(1)
+async def get_project_report_csv(project_id: int, service: ProjectReportService = Depends()) -> StreamingResponse:
+    """Скачать отчет по дефектам всего проекта в формате CSV (строка на файл)"""
+    log.info(f"Streaming CSV report for project {project_id}")
+    await service.get_project(project_id)
+    return StreamingResponse(
+        service.stream_csv(project_id),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename=project_{project_id}_report.csv"})
+
+
+@router.post("/{project_id}/report", response_model=ProjectJobData)
+@query_budget(3)
+async def create_project_report_pdf(project_id: int, service: ProjectReportService = Depends()) -> ProjectJobData:
+    """Запустить построение PDF-отчета по всему проекту. Ссылка на отчет появится в result_url задачи"""
+    log.info(f"Starting PDF report for project {project_id}")
+    result = await service.start_pdf(project_id)
+    log.info(f"PDF report for project {project_id} started as job {result.id}")
+    return result
+
+
+@router.get("/{project_id}/events")
+@query_budget(1)
+async def project_events(project_id: int, service: ProjectService = Depends()) -> StreamingResponse:
+    """Поток событий проекта (Server-Sent Events): статусы файлов, агрегаты проекта и прогресс задач"""
+    log.info(f"Subscribing to project {project_id} events")
+    await service.get_project(project_id)
+    return StreamingResponse(
+        EVENT_BUS.subscribe(project_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,16 +1,35 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from rest.system_endpoint import router as SystemEndpoint
+
 from rest.auth_endpoint import router as AuthEndpoint
-from rest.project_endpoint import router as ProjectRouter
+from rest.db_session import DbSessionMiddleware
+from rest.db_stats import DbStatsMiddleware
 from rest.file_endpoint import router as FileRouter
+from rest.project_endpoint import router as ProjectRouter
+from rest.system_endpoint import router as SystemEndpoint
 from rest.yolo_endpoint import router as YOLORouter
+from service.analytics_service import AnalyticsExportService
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Периодические задачи стартуют в event loop сервера
+    AnalyticsExportService.schedule()
+    yield
+
 
 app = FastAPI(
     title="HACK",
     description="HACK",
     version="0.0.1",
+    lifespan=lifespan,
 )
 
+app.add_middleware(DbSessionMiddleware)
+# Снаружи сессии запроса: учитывает и запросы, сделанные при ее фиксации
+app.add_middleware(DbStatsMiddleware)
+
 app.include_router(SystemEndpoint)
 app.include_router(AuthEndpoint)
 app.include_router(ProjectRouter)
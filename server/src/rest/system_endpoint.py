@@ -1,6 +1,8 @@
 import json
 import os
-from fastapi import APIRouter
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from rest.models.health_data import HealthData
 from rest.models.version_data import VersionData
@@ -41,3 +43,9 @@ async def health() -> HealthData:
 )
 async def version() -> VersionData:
     return version_info
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Метрики Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
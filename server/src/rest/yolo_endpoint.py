@@ -1,5 +1,8 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends
 
+from rest.db_stats import query_budget
 from rest.models.panda_data import LabelData
 from service.file_service import set_service_url
 from service.panda_service import YoloResultService
@@ -11,10 +14,12 @@ router = APIRouter(prefix="/yolo", tags=["YOLO"])
 
 
 @router.post("", response_model=LabelData)
-async def upload_yolo_label(project_id: int, file_id: int, label: str, service: YoloResultService = Depends()) -> LabelData:
-    """Загрузить разметку YOLO и сохранить в s3"""
+@query_budget(8)
+async def upload_yolo_label(project_id: int, file_id: int, label: str, model_version: Optional[str] = None,
+                            service: YoloResultService = Depends()) -> LabelData:
+    """Загрузить разметку YOLO и сохранить в s3. model_version - SHA-256 весов модели воркера"""
     log.info(f"Received request to save YOLO label as .txt for file {file_id} from project {project_id}")
-    result = await service.analysis_yolo_txt(file_id=file_id, txt=label)
+    result = await service.analysis_yolo_txt(file_id=file_id, txt=label, model_version=model_version)
     log.info(f"Saved YOLO label as .txt for file {file_id} from project {project_id}")
     return result
 
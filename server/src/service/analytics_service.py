@@ -0,0 +1,256 @@
+import asyncio
+import itertools
+import json
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi import HTTPException
+from sqlalchemy import Row
+
+from dao.project import Project
+from dao.project_file import ProjectFile
+from dao.project_job import ProjectJob
+from rest.models.analytics import AnalyticsTable
+from rest.models.panda_data import DefectType
+from rest.models.project_job import ProjectJobData, ProjectJobType
+from service.job_service import run_job, spawn
+from service.s3 import MultipartUpload, get_s3
+from utils.config import CONFIG
+from utils.logger import get_logger
+
+log = get_logger("AnalyticsExportService")
+
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+
+# Колонки партиции идут первыми в строках DAO. В S3 они в пути (project_id=.../date=...), в скачиваемом файле - в строках
+PARTITION_FIELDS = [pa.field("project_id", pa.int32()), pa.field("date", pa.date32())]
+
+# Колонки таблиц в порядке строк ProjectFile.stream_analytics_*
+TABLE_FIELDS: Dict[AnalyticsTable, List[pa.Field]] = {
+    AnalyticsTable.files: [
+        pa.field("file_id", pa.int32()),
+        pa.field("created_at", pa.timestamp("us")),
+        pa.field("filename", pa.string()),
+        pa.field("status", pa.string()),
+        pa.field("width", pa.int32()),
+        pa.field("height", pa.int32()),
+        pa.field("image_format", pa.string()),
+        pa.field("model_version", pa.string()),
+        pa.field("defect_count", pa.int32()),
+        pa.field("max_defect_area", pa.float32()),
+        pa.field("total_defect_area", pa.float32()),
+        pa.field("defect_classes", pa.list_(pa.int16())),
+        pa.field("content_hash", pa.string()),
+        pa.field("near_duplicate_of", pa.int32()),
+    ],
+    AnalyticsTable.defects: [
+        pa.field("file_id", pa.int32()),
+        pa.field("class_id", pa.int16()),
+        pa.field("count", pa.int32()),
+    ],
+    AnalyticsTable.detections: [
+        pa.field("detection_id", pa.int64()),
+        pa.field("file_id", pa.int32()),
+        pa.field("class_id", pa.int16()),
+        pa.field("confidence", pa.float32()),
+        pa.field("area_ratio", pa.float32()),
+        pa.field("area", pa.float32()),
+        pa.field("perimeter", pa.float32()),
+        pa.field("max_extent", pa.float32()),
+        pa.field("bbox_x", pa.float32()),
+        pa.field("bbox_y", pa.float32()),
+        pa.field("bbox_w", pa.float32()),
+        pa.field("bbox_h", pa.float32()),
+    ],
+}
+
+TABLE_STREAMS: Dict[AnalyticsTable, Callable[[int, int], AsyncIterator[Sequence[Row]]]] = {
+    AnalyticsTable.files: ProjectFile.stream_analytics_files,
+    AnalyticsTable.defects: ProjectFile.stream_analytics_defects,
+    AnalyticsTable.detections: ProjectFile.stream_analytics_detections,
+}
+
+
+def table_schema(table: AnalyticsTable, partitioned: bool) -> pa.Schema:
+    """Схема файла таблицы. partitioned - колонки партиции вынесены в путь. Названия классов - в метаданных схемы"""
+    fields = TABLE_FIELDS[table] if partitioned else PARTITION_FIELDS + TABLE_FIELDS[table]
+    names = {class_id: defect_type.defect for class_id, defect_type in enumerate(DefectType)}
+    return pa.schema(fields, metadata={"defect_classes": json.dumps(names, ensure_ascii=False)})
+
+
+def rows_to_table(rows: Sequence[Row], schema: pa.Schema) -> pa.Table:
+    """Строки DAO в таблицу arrow по колонкам; колонки партиции отбрасываются, если их нет в схеме"""
+    columns = list(zip(*rows, strict=True))[len(rows[0]) - len(schema):]
+    return pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema, strict=True)],
+                                schema=schema)
+
+
+class ParquetStream:
+    """
+    Запись Parquet в любой приемник с write(): строки копятся до row_group_size и уходят одной группой,
+    так в памяти не больше одной группы строк, а группы не мельчат до размера пачки курсора
+    """
+
+    def __init__(self, sink, schema: pa.Schema, row_group_size: int):
+        self.writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+        self.row_group_size = row_group_size
+        self.pending: List[pa.Table] = []
+        self.rows = 0
+
+    def write(self, table: pa.Table) -> None:
+        self.pending.append(table)
+        self.rows += table.num_rows
+        if self.rows >= self.row_group_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        self.writer.close()
+
+    def _flush(self) -> None:
+        if self.pending:
+            self.writer.write_table(pa.concat_tables(self.pending), row_group_size=self.row_group_size)
+            self.pending = []
+            self.rows = 0
+
+
+class _ChunkSink:
+    """Приемник для скачивания: записанное забирается кусками по мере готовности групп строк"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class AnalyticsExportService:
+    """
+    Таблицы для аналитики в Parquet: files (project_files), defects (file_defects), detections (геометрия объектов).
+    Строки читаются серверным курсором и пишутся группами по analytics.row_group_size - память не зависит от проекта.
+
+    Выгрузка в S3: {prefix}/{table}/project_id={id}/date={YYYY-MM-DD}/part-00000.parquet, партиции по дню загрузки
+    файла (hive-разбиение, читается pyarrow.dataset, Spark, DuckDB). Каждая выгрузка переписывает партиции
+    проекта целиком и удаляет те, которых больше нет. Без проекта выгружаются все проекты - так работает
+    периодическая выгрузка (analytics.interval_minutes).
+    """
+
+    def __init__(self):
+        self.s3 = get_s3()
+
+    @staticmethod
+    async def get_project(project_id: int) -> Project:
+        project = await Project.get_project_by_id(project_id)
+        if not project:
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
+        return project
+
+    async def stream_parquet(self, project_id: int, table: AnalyticsTable) -> AsyncIterator[bytes]:
+        """Один файл Parquet с таблицей проекта (с колонками project_id и date) кусками для StreamingResponse"""
+        schema = table_schema(table, partitioned=False)
+        sink = _ChunkSink()
+        writer = ParquetStream(sink, schema, CONFIG.analytics.row_group_size)
+        async for partition in TABLE_STREAMS[table](project_id, CONFIG.batch.cursor_batch_size):
+            await asyncio.to_thread(writer.write, rows_to_table(partition, schema))
+            if sink.chunks:
+                yield sink.drain()
+        await asyncio.to_thread(writer.close)
+        yield sink.drain()
+
+    async def start_export(self, project_id: int) -> ProjectJobData:
+        """Запускает выгрузку таблиц проекта в S3 в фоне"""
+        await self.get_project(project_id)
+        job = await ProjectJob.create_job(project_id, ProjectJobType.analytics_export)
+        run_job(job.id, lambda: self._export(job.id, project_id))
+        return job.to_api()
+
+    @staticmethod
+    def schedule() -> None:
+        """Периодическая выгрузка всех проектов, если задан analytics.interval_minutes"""
+        interval = CONFIG.analytics.interval_minutes
+        if interval > 0:
+            log.info(f"Analytics export scheduled every {interval} minutes")
+            spawn(lambda: AnalyticsExportService()._run_periodically(interval), name="analytics export")
+
+    async def _run_periodically(self, interval: int) -> None:
+        while True:
+            # Сбой одной выгрузки (например, БД недоступна) не должен останавливать расписание
+            try:
+                job = await ProjectJob.create_job(None, ProjectJobType.analytics_export)
+                await run_job(job.id, lambda job_id=job.id: self._export(job_id, None))
+            except Exception:
+                log.exception("Scheduled analytics export failed")
+            await asyncio.sleep(interval * 60)
+
+    async def _export(self, job_id: int, project_id: Optional[int]) -> None:
+        projects = await Project.get_project_sizes(project_id)
+        await ProjectJob.start(job_id, sum(project.count_of_files for project in projects), auto_finish=False)
+        log.info(f"Job {job_id}: exporting analytics of {len(projects)} projects")
+
+        written = set()
+        for project in projects:
+            for table in AnalyticsTable:
+                written.update(await self._export_table(project.id, table))
+            await ProjectJob.add_progress(job_id, dispatched=project.count_of_files, done=project.count_of_files,
+                                          auto_finish=False)
+
+        # Партиции, которых в этой выгрузке нет: удаленные файлы, проекты
+        scope = "" if project_id is None else f"project_id={project_id}/"
+        prefixes = [f"{CONFIG.analytics.prefix}/{table.value}/{scope}" for table in AnalyticsTable]
+        removed = await asyncio.to_thread(self._remove_stale, prefixes, written)
+        await ProjectJob.finish(job_id)
+        log.info(f"Job {job_id}: analytics exported, {len(written)} partitions written, {removed} stale removed")
+
+    async def _export_table(self, project_id: int, table: AnalyticsTable) -> List[str]:
+        """Пишет партиции таблицы проекта по дням, возвращает их ключи"""
+        schema = table_schema(table, partitioned=True)
+        keys: List[str] = []
+        current_date = None
+        upload: Optional[MultipartUpload] = None
+        writer: Optional[ParquetStream] = None
+        try:
+            async for partition in TABLE_STREAMS[table](project_id, CONFIG.batch.cursor_batch_size):
+                # Строки идут в порядке загрузки файлов - строки одного дня подряд
+                for date, rows in itertools.groupby(partition, key=lambda row: row.date):
+                    if date != current_date:
+                        current_date = date
+                        if writer:
+                            await asyncio.to_thread(self._close_part, writer, upload)
+                        keys.append(f"{CONFIG.analytics.prefix}/{table.value}/project_id={project_id}/"
+                                    f"date={date.isoformat()}/part-00000.parquet")
+                        upload = await asyncio.to_thread(self.s3.open_upload, keys[-1], PARQUET_CONTENT_TYPE)
+                        writer = ParquetStream(upload, schema, CONFIG.analytics.row_group_size)
+                    await asyncio.to_thread(writer.write, rows_to_table(list(rows), schema))
+            if writer:
+                await asyncio.to_thread(self._close_part, writer, upload)
+        except BaseException:
+            if upload and not upload.closed:
+                await asyncio.to_thread(upload.abort)
+            raise
+        return keys
+
+    @staticmethod
+    def _close_part(writer: ParquetStream, upload: MultipartUpload) -> None:
+        writer.close()
+        upload.complete()
+
+    def _remove_stale(self, prefixes: List[str], written: set) -> int:
+        removed = 0
+        for prefix in prefixes:
+            for keys in self.s3.list_keys(prefix):
+                stale = [key for key in keys if key not in written]
+                if stale:
+                    failed = self.s3.delete_many(stale)
+                    if failed:
+                        log.error(f"Failed to remove {len(failed)} stale analytics partitions, e.g. {failed[0]}")
+                    removed += len(stale) - len(failed)
+        return removed
@@ -0,0 +1,350 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+import zlib
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+import yaml
+from fastapi import HTTPException
+from sqlalchemy import Row
+
+from dao.project import Project
+from dao.project_file import ProjectFile
+from dao.project_job import ProjectJob
+from rest.models.dataset import DatasetFormat, TrainingExportData
+from rest.models.panda_data import DefectType
+from rest.models.project_job import ProjectJobData, ProjectJobType
+from service.job_service import run_job
+from service.s3 import S3, MultipartUpload, get_s3
+from service.yolo_label import parse_label
+from utils.config import CONFIG
+from utils.logger import get_logger
+
+log = get_logger("DatasetExportService")
+
+MANIFEST_NAME = "manifest.jsonl"
+DATA_YAML_NAME = "data.yaml"
+INDEX_NAME = "index.json"
+SPLITS = ("train", "val")
+
+# Выгрузки одной выборки идут по очереди: каждая переписывает общий манифест
+_dataset_locks: Dict[str, asyncio.Lock] = {}
+
+
+@dataclass
+class ManifestEntry:
+    """Строка манифеста выборки: файл, его объекты в выборке (пути от корня выборки) и хеши содержимого"""
+    file_id: int
+    project_id: int
+    filename: str
+    split: str
+    image: str
+    label: str
+    image_sha256: Optional[str]  # None - файл загружен до хранения изображений по хешу
+    label_sha256: str
+
+
+def dataset_split(key: str, val_percent: int) -> str:
+    """Часть выборки по хешу ключа: не меняется между выгрузками, одинаковые изображения не попадают в обе части"""
+    return "val" if int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % 100 < val_percent else "train"
+
+
+def sample_key(project_id: int, file_id: int) -> str:
+    """Имя файла в выборке без расширения. Без точек: WebDataset отделяет ключ образца по первой точке"""
+    return f"{project_id}_{file_id}"
+
+
+class ShardWriter:
+    """
+    tar-шарды одной части выборки: {split}-000000.tar, {split}-000001.tar, ...
+    Шард пишется потоком прямо в S3 (multipart upload), следующий начинается, когда текущий дорос до shard_size.
+    Файлы образца ({key}.jpg, {key}.txt, {key}.json) идут в tar подряд и между шардами не разрываются.
+    Методы блокирующие - вызываются из потока
+    """
+
+    def __init__(self, target: S3, prefix: str, split: str, shard_size: int, mtime: int):
+        self.target = target
+        self.prefix = prefix
+        self.split = split
+        self.shard_size = shard_size
+        self.mtime = mtime
+        self.shards: List[dict] = []  # Записанные шарды для индекса
+        self.upload: Optional[MultipartUpload] = None
+        self.tar: Optional[tarfile.TarFile] = None
+        self.samples = 0  # Образцов в текущем шарде
+
+    def add(self, key: str, members: Dict[str, bytes]) -> None:
+        """Дописывает образец: members - расширение -> содержимое"""
+        if self.upload is None:
+            self.upload = self.target.open_upload(f"{self.prefix}/{self._shard_name(len(self.shards))}",
+                                                  "application/x-tar")
+            self.tar = tarfile.open(fileobj=self.upload, mode="w|")
+        for extension, data in members.items():
+            info = tarfile.TarInfo(f"{key}.{extension}")
+            info.size = len(data)
+            info.mtime = self.mtime
+            info.mode = 0o644
+            self.tar.addfile(info, io.BytesIO(data))
+        self.samples += 1
+        if self.upload.size >= self.shard_size:
+            self._close_shard()
+
+    def finish(self) -> None:
+        if self.upload is not None:
+            self._close_shard()
+
+    def abort(self) -> None:
+        if self.upload is not None:
+            self.upload.abort()
+            self.upload = None
+
+    def index(self) -> dict:
+        """Часть индекса: шарды и шаблон имен для загрузчиков WebDataset ({split}-{000000..000009}.tar)"""
+        count = len(self.shards)
+        pattern = f"{self.split}-{{{self._shard_index(0)}..{self._shard_index(count - 1)}}}.tar" if count else None
+        return {"samples": sum(shard["samples"] for shard in self.shards), "pattern": pattern, "shards": self.shards}
+
+    def _close_shard(self) -> None:
+        self.tar.close()
+        self.upload.complete()
+        self.shards.append({
+            "path": self._shard_name(len(self.shards)),
+            "samples": self.samples,
+            "bytes": self.upload.size,
+            "sha256": self.upload.digest.hexdigest(),
+        })
+        self.upload = None
+        self.tar = None
+        self.samples = 0
+
+    def _shard_name(self, number: int) -> str:
+        return f"{self.split}-{self._shard_index(number)}.tar"
+
+    @staticmethod
+    def _shard_index(number: int) -> str:
+        return f"{number:06d}"
+
+
+class DatasetExportService:
+    """
+    Обучающая выборка YOLO в бакете обучения, разметка пишется из БД в стандартном формате YOLO
+    (без уверенности, объекты ниже порога проекта отброшены). Два формата:
+
+    files - datasets/{dataset}/images/{train,val}, labels/{train,val}, data.yaml и manifest.jsonl.
+    Изображения копируются на стороне S3 параллельно. Выгрузка инкрементальная: файлы из манифеста с той же
+    разметкой пропускаются, у изменившихся переписывается только разметка. Выборка копится - удаленные
+    из проекта файлы из нее не убираются.
+
+    shards - datasets/{dataset}/shards/{job_id}/{train,val}-NNNNNN.tar и index.json: образцы упакованы
+    в tar-шарды WebDataset, чтобы обучение читало выборку последовательно крупными объектами.
+    Изображения скачиваются окнами по export_concurrency и сразу пишутся в шард, на диск ничего не кладется.
+    Каждая выгрузка - новый полный набор шардов.
+    """
+
+    def __init__(self):
+        self.source = get_s3()
+        self.target = get_s3(CONFIG.s3.training_bucket)
+
+    async def start_export(self, project_id: int, export: TrainingExportData) -> ProjectJobData:
+        """Запускает выгрузку файлов проекта в фоне, результат - result_url задачи (манифест выборки)"""
+        project = await Project.get_project_by_id(project_id)
+        if not project:
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
+        if any(not 0 <= class_id < len(DefectType) for class_id in export.defect_classes or []):
+            raise HTTPException(status_code=400, detail="Invalid defect class")
+
+        job = await ProjectJob.create_job(project_id, ProjectJobType.training_export)
+        run_job(job.id, lambda: self._export(job.id, project_id, project.confidence_threshold, export))
+        return job.to_api()
+
+    async def _export(self, job_id: int, project_id: int, threshold: Optional[float], export: TrainingExportData) -> None:
+        filters = dict(file_ids=export.file_ids, status=export.status, include_classes=export.defect_classes,
+                       manual_only=export.manual_only)
+        if export.format == DatasetFormat.shards:
+            await self._export_shards(job_id, project_id, threshold, export, filters)
+        else:
+            await self._export_files(job_id, project_id, threshold, export, filters)
+
+    async def _export_files(self, job_id: int, project_id: int, threshold: Optional[float],
+                            export: TrainingExportData, filters: dict) -> None:
+        prefix = f"datasets/{export.dataset}"
+        async with _dataset_locks.setdefault(export.dataset, asyncio.Lock()):
+            total = await ProjectFile.count_export_files(project_id, **filters)
+            await ProjectJob.start(job_id, total, auto_finish=False)
+            manifest = await asyncio.to_thread(self._read_manifest, prefix)
+            log.info(f"Job {job_id}: exporting {total} files of project {project_id} to dataset {export.dataset}, "
+                     f"{len(manifest)} files already there")
+
+            semaphore = asyncio.Semaphore(CONFIG.batch.export_concurrency)
+            copied = 0
+
+            async def export_file(row: Row) -> bool:
+                nonlocal copied
+                async with semaphore:
+                    try:
+                        entry, label_text, copy_image, write_label = await self._plan(
+                            row, project_id, threshold, export.val_percent, manifest.get(row.id))
+                        if copy_image:
+                            await asyncio.to_thread(self.target.copy, row.s3_path, f"{prefix}/{entry.image}",
+                                                    self.source.s3_config.bucket)
+                            copied += 1
+                        if write_label:
+                            await asyncio.to_thread(self.target.write_bytes, f"{prefix}/{entry.label}",
+                                                    label_text.encode("utf-8"), "text/plain; charset=utf-8")
+                    except Exception as e:
+                        log.error(f"Job {job_id}: error exporting file {row.id}: {str(e)}")
+                        return False
+                    manifest[row.id] = entry
+                    return True
+
+            async for partition in ProjectFile.stream_export_files(project_id, CONFIG.batch.cursor_batch_size, **filters):
+                results = await asyncio.gather(*(export_file(row) for row in partition))
+                await ProjectJob.add_progress(job_id, dispatched=len(results), done=sum(results),
+                                              failed=len(results) - sum(results), auto_finish=False)
+
+            manifest_url = await asyncio.to_thread(self._merge_and_write_metadata, prefix, manifest)
+        await ProjectJob.finish(job_id, result_url=manifest_url)
+        log.info(f"Job {job_id}: dataset {export.dataset} exported, {copied} images copied")
+
+    async def _export_shards(self, job_id: int, project_id: int, threshold: Optional[float],
+                             export: TrainingExportData, filters: dict) -> None:
+        prefix = f"datasets/{export.dataset}/shards/{job_id}"
+        total = await ProjectFile.count_export_files(project_id, **filters)
+        await ProjectJob.start(job_id, total, auto_finish=False)
+        log.info(f"Job {job_id}: packing {total} files of project {project_id} into shards {prefix}")
+
+        mtime = int(time.time())
+        writers = {split: ShardWriter(self.target, prefix, split, export.shard_size_mb * 1024 * 1024, mtime)
+                   for split in SPLITS}
+
+        async def load_sample(row: Row) -> Optional[tuple[str, str, Dict[str, bytes]]]:
+            """Часть выборки, ключ и файлы образца; None - файл не удалось прочитать"""
+            try:
+                label_text = await self._label_text(row, threshold)
+                image = await asyncio.to_thread(self.source.get_bytes, row.s3_path)
+            except Exception as e:
+                log.error(f"Job {job_id}: error reading file {row.id}: {str(e)}")
+                return None
+            key = sample_key(project_id, row.id)
+            meta = {"file_id": row.id, "project_id": project_id, "filename": row.filename,
+                    "image_sha256": row.content_hash}
+            members = {
+                os.path.splitext(row.s3_path)[1].lower().lstrip(".") or "jpg": image,
+                "txt": label_text.encode("utf-8"),
+                "json": json.dumps(meta, ensure_ascii=False).encode("utf-8"),
+            }
+            return dataset_split(row.content_hash or key, export.val_percent), key, members
+
+        async def write_window(samples: List[Optional[tuple]]) -> None:
+            loaded = [sample for sample in samples if sample]
+            await asyncio.to_thread(lambda: [writers[split].add(key, members) for split, key, members in loaded])
+            await ProjectJob.add_progress(job_id, dispatched=len(samples), done=len(loaded),
+                                          failed=len(samples) - len(loaded), auto_finish=False)
+
+        # Следующее окно скачивается, пока пишется текущее: в памяти не больше двух окон изображений
+        window = CONFIG.batch.export_concurrency
+        pending: Optional[asyncio.Future] = None
+        try:
+            async for partition in ProjectFile.stream_export_files(project_id, CONFIG.batch.cursor_batch_size, **filters):
+                for start in range(0, len(partition), window):
+                    task = asyncio.gather(*(load_sample(row) for row in partition[start:start + window]))
+                    if pending:
+                        await write_window(await pending)
+                    pending = task
+            if pending:
+                await write_window(await pending)
+                pending = None
+            index_url = await asyncio.to_thread(self._write_index, prefix, writers)
+        except BaseException:
+            if pending:
+                pending.cancel()
+            await asyncio.to_thread(lambda: [writer.abort() for writer in writers.values()])
+            raise
+        await ProjectJob.finish(job_id, result_url=index_url)
+        log.info(f"Job {job_id}: dataset {export.dataset} packed into "
+                 f"{sum(len(writer.shards) for writer in writers.values())} shards")
+
+    async def _label_text(self, row: Row, threshold: Optional[float]) -> str:
+        """Разметка файла в стандартном формате YOLO без объектов ниже порога"""
+        if row.label is not None:
+            text = zlib.decompress(row.label).decode("utf-8")
+        elif row.s3_txt_path:
+            # Распознан до хранения разметки в БД
+            text = await asyncio.to_thread(self.source.get_file_content_as_str, row.s3_txt_path)
+        else:
+            text = ""
+        label = parse_label(text)
+        return label.to_text(label.confident_mask(threshold))
+
+    async def _plan(self, row: Row, project_id: int, threshold: Optional[float], val_percent: int,
+                    previous: Optional[ManifestEntry]) -> tuple[ManifestEntry, str, bool, bool]:
+        """Запись манифеста для файла, текст разметки и что нужно выгрузить: изображение, разметку"""
+        label_text = await self._label_text(row, threshold)
+        stem = sample_key(project_id, row.id)
+        split = previous.split if previous else dataset_split(row.content_hash or stem, val_percent)
+        entry = ManifestEntry(
+            file_id=row.id,
+            project_id=project_id,
+            filename=row.filename,
+            split=split,
+            image=f"images/{split}/{stem}{os.path.splitext(row.s3_path)[1].lower()}",
+            label=f"labels/{split}/{stem}.txt",
+            image_sha256=row.content_hash,
+            label_sha256=hashlib.sha256(label_text.encode("utf-8")).hexdigest(),
+        )
+        copy_image = previous is None or (previous.image, previous.image_sha256) != (entry.image, entry.image_sha256)
+        write_label = previous is None or (previous.label, previous.label_sha256) != (entry.label, entry.label_sha256)
+        return entry, label_text, copy_image, write_label
+
+    def _read_manifest(self, prefix: str) -> Dict[int, ManifestEntry]:
+        """Манифест выборки; пустой - выборки еще нет. Прочие ошибки чтения валят выгрузку, а не обнуляют манифест"""
+        try:
+            content = self.target.get_file_content_as_str(f"{prefix}/{MANIFEST_NAME}")
+        except FileNotFoundError:
+            return {}
+        entries = (ManifestEntry(**json.loads(line)) for line in content.splitlines() if line)
+        return {entry.file_id: entry for entry in entries}
+
+    def _merge_and_write_metadata(self, prefix: str, manifest: Dict[int, ManifestEntry]) -> str:
+        """
+        Дописывает записи выгрузки в манифест, каким он стал к ее концу: выборку могла пополнить выгрузка
+        другого процесса сервера (_dataset_locks - только в пределах процесса), а выгрузка одного файла
+        (training_file) не должна терять остальные
+        """
+        merged = self._read_manifest(prefix)
+        merged.update(manifest)
+        return self._write_metadata(prefix, merged)
+
+    def _write_metadata(self, prefix: str, manifest: Dict[int, ManifestEntry]) -> str:
+        """Пишет data.yaml и манифест, возвращает ссылку на манифест"""
+        data = {
+            # path не указан: ultralytics считает пути от папки data.yaml
+            "train": "images/train",
+            "val": "images/val",
+            "names": {class_id: defect_type.defect for class_id, defect_type in enumerate(DefectType)},
+        }
+        self.target.write_bytes(f"{prefix}/{DATA_YAML_NAME}",
+                                yaml.safe_dump(data, allow_unicode=True, sort_keys=False).encode("utf-8"),
+                                "application/yaml")
+        lines: List[str] = [json.dumps(asdict(manifest[file_id]), ensure_ascii=False) for file_id in sorted(manifest)]
+        return self.target.write_bytes(f"{prefix}/{MANIFEST_NAME}", "".join(line + "\n" for line in lines).encode("utf-8"),
+                                       "application/x-ndjson")
+
+    def _write_index(self, prefix: str, writers: Dict[str, ShardWriter]) -> str:
+        """Закрывает последние шарды и пишет index.json, возвращает ссылку на него"""
+        for writer in writers.values():
+            writer.finish()
+        index = {
+            "format": "webdataset",
+            "names": {class_id: defect_type.defect for class_id, defect_type in enumerate(DefectType)},
+            "splits": {split: writer.index() for split, writer in writers.items()},
+        }
+        return self.target.write_bytes(f"{prefix}/{INDEX_NAME}",
+                                       json.dumps(index, ensure_ascii=False, indent=2).encode("utf-8"),
+                                       "application/json")
@@ -0,0 +1,60 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import AsyncIterator
+
+from pydantic import BaseModel
+
+from utils.logger import get_logger
+
+log = get_logger("EventService")
+
+KEEPALIVE_SECONDS = 15
+QUEUE_SIZE = 256
+
+
+class ProjectEventBus:
+    """
+    Рассылка событий проекта подписчикам (Server-Sent Events).
+    Живет в процессе сервера: события публикуются из того же event loop,
+    в котором обрабатываются результаты /yolo и фоновые задачи.
+    """
+
+    def __init__(self):
+        self.subscribers: dict[int, set[asyncio.Queue]] = defaultdict(set)
+
+    def has_subscribers(self, project_id: int) -> bool:
+        return bool(self.subscribers.get(project_id))
+
+    def publish(self, project_id: int, event: str, data: BaseModel | dict) -> None:
+        queues = self.subscribers.get(project_id)
+        if not queues:
+            return
+        payload = data.model_dump_json() if isinstance(data, BaseModel) else json.dumps(data, default=str)
+        message = f"event: {event}\ndata: {payload}\n\n"
+        for queue in queues:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Медленный клиент: пропускаем событие, а не копим память
+                log.warning(f"Event queue overflow for project {project_id}, event {event} dropped")
+
+    async def subscribe(self, project_id: int) -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.subscribers[project_id].add(queue)
+        log.info(f"Subscribed to project {project_id} events")
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.subscribers[project_id].discard(queue)
+            if not self.subscribers[project_id]:
+                del self.subscribers[project_id]
+            log.info(f"Unsubscribed from project {project_id} events")
+
+
+EVENT_BUS = ProjectEventBus()
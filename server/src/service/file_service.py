@@ -1,49 +1,55 @@
-import uuid
+import asyncio
+import hashlib
+import mimetypes
 import os
 import tempfile
-from collections import defaultdict
-from io import BytesIO
+import uuid
+from typing import List, Optional
 
 import httpx
-from fastapi import UploadFile, HTTPException
-from typing import Optional, Dict
-from pathlib import Path
+from fastapi import HTTPException, UploadFile
 
 from dao.base import with_async_db_session
-from dao.project_file import ProjectFile
+from dao.blob import Blob
 from dao.project import Project
-from rest.models.project_file import ProjectFileData, ProjectFileListData, ProjectFileStatusType
-from rest.models.panda_data import LabelData, DefectType
-from service.s3 import S3
-from service.image_service import create_icon
+from dao.project_file import MANUAL_MODEL_VERSION, FileDetection, ProjectFile
+from rest.models.dataset import TrainingExportData
+from rest.models.panda_data import DefectType, LabelData
+from rest.models.project_file import (
+    FileDetectionData,
+    NearDuplicateClusterData,
+    NearDuplicateClusterListData,
+    ProjectFileData,
+    ProjectFileListData,
+    ProjectFileSortType,
+    ProjectFileStatusType,
+)
+from service import label_service
+from service.dataset_service import DatasetExportService
+from service.image_service import ICON, PREVIEW, create_thumbnails, thumbnail_filename
 from service.panda_service import YoloResultService
-from utils.logger import get_logger
+from service.phash import band_masks, band_values
+from service.s3 import DELETE_BATCH_SIZE, get_s3
+from service.yolo_label import REFERENCE_CLASSES
 from utils.config import CONFIG
-
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-
-# Проверка
-font_path = Path(__file__).parent / "fonts" / "DejaVuSans.ttf"
-if not font_path.exists():
-    raise FileNotFoundError(f"Шрифт не найден по пути: {font_path}")
-
+from utils.cursor import decode_cursor, encode_cursor
+from utils.logger import get_logger
 
 log = get_logger("FileService")
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 service_url = CONFIG.recognize_service
 
+def _content_type(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
 def set_service_url(url):
     global service_url
     service_url = url
 
 class FileService:
     def __init__(self):
-        self.s3 = S3(CONFIG.s3)
-        self.training_bucket = "train-data-dop"
+        self.s3 = get_s3()
 
     @with_async_db_session
     async def upload_file(self, project_id: int, file: UploadFile) -> ProjectFileData:
@@ -54,45 +60,109 @@ class FileService:
             log.error(f"Project {project_id} not found")
             raise HTTPException(status_code=404, detail="Project not found")
 
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else ""
+        file_extension = os.path.splitext(file.filename)[1].lower() if file.filename else ""
         unique_filename = f"{uuid.uuid4()}{file_extension}"
 
-
-        s3_path = f"{project_id}/{unique_filename}"
-        s3_icon_path = f"{project_id}/icon_{unique_filename}"
-
         temp_dir = tempfile.gettempdir()
         temp_file_path = os.path.join(temp_dir, unique_filename)
 
+        # Хеш считается по ходу записи во временный файл, целиком в память загрузка не читается
+        digest = hashlib.sha256()
+        size = 0
         with open(temp_file_path, "wb") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-
-        icon_temp_path = await create_icon(temp_dir, unique_filename)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                temp_file.write(chunk)
+                size += len(chunk)
+        content_hash = digest.hexdigest()
 
+        temp_paths = [temp_file_path]
         try:
-            s3_url = self.s3.upload_file(temp_file_path, s3_path)
-            s3_icon_url = self.s3.upload_file(icon_temp_path, s3_icon_path)
-
-            project_file = await ProjectFile.create_file(
-                project_id=project_id,
-                filename=file.filename,
-                s3_path=s3_path,
-                s3_url=s3_url,
-                s3_icon_path=s3_icon_path,
-                s3_icon_url=s3_icon_url
-            )
-            os.remove(temp_file_path)
-
-            log.info(f"File uploaded successfully: {s3_url}")
+            project_file = None
+            blob = await Blob.get(content_hash)
+            if blob is not None:
+                project_file = await ProjectFile.create_file_from_blob(project_id, file.filename, blob)
+            if project_file is None:
+                image_meta = await create_thumbnails(temp_dir, unique_filename)
+                temp_paths.extend(image_meta.thumbnails.values())
+                blob_values = await asyncio.to_thread(self._store_blob, content_hash, size, file_extension,
+                                                      temp_file_path, image_meta)
+                await Blob.add(**blob_values)
+                project_file = await ProjectFile.create_file_from_blob(project_id, file.filename, Blob(**blob_values))
+                if project_file is None:
+                    raise RuntimeError(f"Image {content_hash} was removed while uploading")
+                log.info(f"File uploaded successfully: {project_file.s3_url}")
+            else:
+                log.info(f"File {file.filename} is a duplicate of stored image {content_hash}, upload skipped")
+            project_file = await self._reuse_recognition(project_file, project) or project_file
 
             return project_file.to_api()
 
         except Exception as e:
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
             log.error(f"Error uploading file: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
+        finally:
+            for path in temp_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _store_blob(self, content_hash: str, size: int, file_extension: str, temp_file_path: str, image_meta) -> dict:
+        """
+        Выгружает изображение и превью в S3 под ключами по хешу содержимого, возвращает поля Blob.
+        Ключи детерминированы, поэтому одновременная загрузка одного изображения просто перезапишет те же объекты
+        """
+        name = f"{content_hash}{file_extension}"
+        prefix = f"blobs/{content_hash[:2]}"
+        s3_path = f"{prefix}/{name}"
+        s3_icon_path = f"{prefix}/{thumbnail_filename(ICON, name)}"
+        s3_preview_path = f"{prefix}/{thumbnail_filename(PREVIEW, name)}"
+        return dict(
+            sha256=content_hash,
+            size=size,
+            s3_path=s3_path,
+            s3_url=self.s3.put_file(temp_file_path, s3_path, _content_type(s3_path)),
+            s3_icon_path=s3_icon_path,
+            s3_icon_url=self.s3.put_file(image_meta.thumbnails[ICON.prefix], s3_icon_path, _content_type(s3_icon_path)),
+            s3_preview_path=s3_preview_path,
+            s3_preview_url=self.s3.put_file(image_meta.thumbnails[PREVIEW.prefix], s3_preview_path,
+                                            _content_type(s3_preview_path)),
+            width=image_meta.width,
+            height=image_meta.height,
+            image_format=image_meta.format,
+            phash=image_meta.phash,
+        )
+
+    async def _reuse_recognition(self, project_file: ProjectFile, project: Project) -> Optional[ProjectFile]:
+        """
+        Копирует новому файлу результат распознавания другого файла проекта с тем же изображением, если он есть.
+        Если нет и у проекта задан near_duplicate_distance - результат ближайшего по перцептивному хешу
+        распознанного файла проекта. Результат копируется вместе с версией модели: после смены модели его
+        пересчитает досчет (reprocess), а статус и дефекты пересчитываются под порог уверенности проекта.
+        Возвращает обновленный файл, None - копировать нечего или не вышло (файл останется в обработке)
+        """
+        near_duplicate_distance = project.near_duplicate_distance
+        near_duplicate = False
+        donor = await ProjectFile.find_result_donor(project.id, project_file.content_hash, project_file.id)
+        if donor is None and near_duplicate_distance is not None and project_file.phash is not None:
+            donor = await ProjectFile.find_similar_donor(project_file.project_id, project_file.phash,
+                                                         band_values(project_file.phash, near_duplicate_distance),
+                                                         near_duplicate_distance, project_file.id)
+            near_duplicate = True
+        if donor is None:
+            return None
+        try:
+            s3_txt_path, s3_txt_url = "", ""
+            if donor.s3_txt_path:
+                s3_txt_path = f"{project_file.object_stem}.txt"
+                s3_txt_url = await asyncio.to_thread(self.s3.copy, donor.s3_txt_path, s3_txt_path)
+            await ProjectFile.copy_recognition(project_file.id, donor.id, s3_txt_path, s3_txt_url,
+                                               project.confidence_threshold, sorted(REFERENCE_CLASSES), near_duplicate)
+        except Exception as e:
+            log.error(f"Error copying recognition of file {donor.id} to {project_file.id}: {str(e)}")
+            return None
+        log.info(f"File {project_file.id}: recognition copied from {'similar ' if near_duplicate else ''}file {donor.id}, "
+                 f"inference skipped")
+        return await ProjectFile.get_file_by_id(project_file.id)
 
     @with_async_db_session
     async def upload_txt(self, project_id: int, file_id: int, text: UploadFile) -> LabelData:
@@ -103,19 +173,10 @@ class FileService:
             log.error(f"File {project_file} not found")
             raise HTTPException(status_code=404, detail="File not found")
 
-        file_extension = ".txt"
-        filename = os.path.splitext(project_file.s3_path)[0]
-
-        s3_txt_path = f"{filename}{file_extension}"
-
-        unique_filename = os.path.basename(s3_txt_path)
-
-        temp_dir = tempfile.gettempdir()
-        temp_file_path = os.path.join(temp_dir, unique_filename)
-
         content = await text.read()
 
-        result = await YoloResultService.analysis_yolo_txt(file_id=file_id, txt=content)
+        result = await YoloResultService().analysis_yolo_txt(file_id=file_id, txt=content.decode("utf-8"),
+                                                             model_version=MANUAL_MODEL_VERSION)
 
         return result
 
@@ -127,17 +188,53 @@ class FileService:
                 log.error(f"File with ID {file_id} not found")
                 raise HTTPException(status_code=404, detail="File not found")
 
-            self.s3.delete(file_record.s3_path)
-            self.s3.delete(file_record.s3_icon_path)
-            self.s3.delete(file_record.s3_txt_path)
+            if not file_record.content_hash:
+                self.s3.delete(file_record.s3_path)
+                self.s3.delete(file_record.s3_icon_path)
+                if file_record.s3_preview_path:
+                    self.s3.delete(file_record.s3_preview_path)
+            if file_record.s3_txt_path:
+                self.s3.delete(file_record.s3_txt_path)
+            if file_record.s3_report_path:
+                self.s3.delete(file_record.s3_report_path)
 
             await ProjectFile.delete_file_by_id(file_id)
+            if file_record.content_hash:
+                # Изображение общее: удаляется, только если ссылок на него больше нет
+                await self.collect_blobs()
 
             log.info(f"File {file_id} deleted successfully")
         except Exception as e:
             log.error(f"Error deleting file: {str(e)}")
             # raise HTTPException(status_code=500, detail=f"Error deleting file: {str(e)}")
 
+    @staticmethod
+    @with_async_db_session
+    async def collect_blobs(batch_size: int = DELETE_BATCH_SIZE // 3) -> int:
+        """
+        Удаляет изображения, на которые не ссылается ни один файл, вместе с их объектами в S3.
+        Объекты удаляются под блокировкой записи: загрузка того же изображения дождется и загрузит его заново.
+        Возвращает количество удаленных изображений
+        """
+        s3 = get_s3()
+        removed = 0
+        while True:
+            blobs = await Blob.lock_unreferenced(batch_size)
+            if not blobs:
+                break
+            # До трех объектов на изображение - вся пачка уходит одним DeleteObjects
+            paths = [path for blob in blobs for path in blob.s3_paths]
+            failed = await asyncio.to_thread(s3.delete_many, paths)
+            if failed:
+                log.error(f"Failed to delete {len(failed)} image objects: {failed[:5]}")
+            await Blob.delete_locked([blob.sha256 for blob in blobs])
+            removed += len(blobs)
+            if len(blobs) < batch_size:
+                break
+        if removed:
+            log.info(f"Removed {removed} unreferenced images")
+        return removed
+
     @staticmethod
     async def get_file(file_id: int) -> ProjectFileData:
         log.info(f"Getting file with ID {file_id}")
@@ -147,13 +244,19 @@ class FileService:
             log.error(f"File with ID {file_id} not found")
             raise HTTPException(status_code=404, detail="File not found")
 
-        return file_record.to_api(label= await FileService.get_label(s3_txt_path=file_record.s3_txt_path))
+        return file_record.to_api(label=await FileService.get_label(file_record.id, file_record.s3_txt_path))
 
     @staticmethod
     async def get_project_files(project_id: int, filename: Optional[str] = None,
                                 status: Optional[str] = None, defect_type: Optional[str] = None,
                                 min_defects: Optional[int] = None, max_defects: Optional[int] = None, page: int = 1,
-                                size: int = 20, to_delete: bool = False) -> ProjectFileListData | list:
+                                size: int = 20,
+                                cursor: Optional[str] = None, filename_prefix: bool = False,
+                                sort: ProjectFileSortType = ProjectFileSortType.defect_count,
+                                min_defect_area: Optional[float] = None,
+                                min_total_defect_area: Optional[float] = None,
+                                defect_classes: Optional[List[int]] = None,
+                                exclude_classes: Optional[List[int]] = None) -> ProjectFileListData:
         log.info(f"Getting files for project {project_id}")
 
         project = await Project.get_project_by_id(project_id)
@@ -161,16 +264,44 @@ class FileService:
             log.error(f"Project {project_id} not found")
             raise HTTPException(status_code=404, detail="Project not found")
 
+        include_classes = list(defect_classes or [])
+        if defect_type is not None:
+            include_classes.append(int(defect_type))
+        exclude_classes = list(exclude_classes or [])
+        if any(not 0 <= class_id < len(DefectType) for class_id in include_classes + exclude_classes):
+            raise HTTPException(status_code=400, detail="Invalid defect class")
+
+        sort = ProjectFileSortType(sort)
+        after = None
+        if cursor:
+            try:
+                cursor_sort, value, file_id = decode_cursor(cursor, 3)
+                # Курсор выдан для другой сортировки - его ключ к этому порядку не относится
+                if cursor_sort != sort.value:
+                    raise ValueError("Cursor sort mismatch")
+                after = (int(value) if sort == ProjectFileSortType.defect_count else float(value), int(file_id))
+            except (TypeError, ValueError) as e:
+                raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+        # Без фильтров общее количество уже посчитано в счетчиках проекта
+        filtered = bool(filename or status or include_classes or exclude_classes) or any(value is not None for value in (
+            min_defects, max_defects, min_defect_area, min_total_defect_area))
         files, total = await ProjectFile.get_files_by_project_id(project_id=project_id, filename=filename,
-                                                                 status=status, defect_type=defect_type,
+                                                                 status=status, include_classes=include_classes,
+                                                                 exclude_classes=exclude_classes,
                                                                  min_defects=min_defects, max_defects=max_defects,
-                                                                 page=page,size=size)
-
-        if to_delete:
-            file_list = [file for file in files]
-            return file_list
+                                                                 filename_prefix=filename_prefix,
+                                                                 page=page, size=size, after=after,
+                                                                 with_total=filtered, sort=sort,
+                                                                 min_defect_area=min_defect_area,
+                                                                 min_total_defect_area=min_total_defect_area)
+        if total is None:
+            total = project.count_of_files
 
         file_list = [file.to_api(label= '') for file in files]
+        next_cursor = None
+        if len(files) == size:
+            next_cursor = encode_cursor(sort.value, getattr(files[-1], sort.value), files[-1].id)
 
         # Получаем статистику по дефектам
         defect_stats = await ProjectFile.get_defect_stats(project_id)
@@ -183,26 +314,73 @@ class FileService:
             page=page,
             size=size,
             defect_statistics=defect_stats,
-            total_defects=total_defects
+            total_defects=total_defects,
+            next_cursor=next_cursor
         )
 
     @staticmethod
     @with_async_db_session
-    async def get_label(s3_txt_path: str) -> str:
+    async def get_file_detections(project_id: int, file_id: int) -> list[FileDetectionData]:
+        """Геометрия объектов разметки файла из БД, без обращения к S3"""
+        project_file = await ProjectFile.get_file_by_id(file_id)
+        if not project_file or project_file.project_id != project_id:
+            log.error(f"File {file_id} not found in project {project_id}")
+            raise HTTPException(status_code=404, detail="File not found")
+        return [detection.to_api() for detection in await FileDetection.get_by_file(file_id)]
+
+    @staticmethod
+    @with_async_db_session
+    async def get_near_duplicates(project_id: int, max_distance: int, page: int = 1,
+                                  size: int = 20) -> NearDuplicateClusterListData:
         """
-        Возвращает строку с полным содержимым текстового файла.
+        Группы почти одинаковых снимков проекта по перцептивному хешу. Пары хешей ищет БД по индексам полос,
+        группы - объединение пар (union-find) по цепочкам, поэтому крайние снимки группы могут отстоять
+        друг от друга дальше max_distance. Файлы без хеша (загружены до его появления) не учитываются
         """
-        if not s3_txt_path:
-            return ""
+        project = await Project.get_project_by_id(project_id)
+        if not project:
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
 
-        log.info(f"Чтение содержимого из файла {s3_txt_path}")
+        parents = {}
+
+        def find(value: int) -> int:
+            root = value
+            while parents.get(root, root) != root:
+                root = parents[root]
+            while value != root:
+                parents[value], value = root, parents[value]
+            return root
+
+        for left, right in await ProjectFile.get_near_duplicate_pairs(project_id, band_masks(max_distance), max_distance):
+            left_root, right_root = find(left), find(right)
+            if left_root != right_root:
+                parents[max(left_root, right_root)] = min(left_root, right_root)
+
+        groups = {}
+        for file_id, phash in await ProjectFile.get_phashes(project_id):
+            groups.setdefault(find(phash), []).append(file_id)
+        clusters = sorted((ids for ids in groups.values() if len(ids) > 1), key=lambda ids: (-len(ids), ids[0]))
+
+        page_clusters = clusters[(page - 1) * size:page * size]
+        files = {file.id: file for file in
+                 await ProjectFile.get_files_by_ids([file_id for ids in page_clusters for file_id in ids])}
+        return NearDuplicateClusterListData(
+            items=[NearDuplicateClusterData(files=[files[file_id].to_api() for file_id in ids if file_id in files])
+                   for ids in page_clusters],
+            total=len(clusters),
+            page=page,
+            size=size,
+            max_distance=max_distance,
+        )
 
-        try:
-            content = S3(CONFIG.s3).get_file_content_as_str(s3_txt_path)
-            return content
-        except Exception as e:
-            log.error(f"Ошибка при чтении файла {s3_txt_path}: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Не удалось прочитать файл: {str(e)}")
+    @staticmethod
+    @with_async_db_session
+    async def get_label(file_id: int, s3_txt_path: str) -> str:
+        """
+        Возвращает строку с полным содержимым разметки.
+        """
+        return await label_service.get_label(file_id, s3_txt_path)
 
     @with_async_db_session
     async def process_file(self, file_id: int, not_processing: bool = False) -> ProjectFileData:
@@ -225,22 +403,9 @@ class FileService:
             # Обновляем статус файла на "в обработке"
             await ProjectFile.update_file_status(file_id=file_id, status=ProjectFileStatusType.processing)
 
-            url = service_url + "/recognize"
-            payload = {
-                "image_url": file_record.s3_url,
-                "image_id": file_record.id,
-                "project_id": file_record.project_id,
-            }
-
+            # Файл остается в обработке: статус по порогу уверенности проекта сохранит результат в /yolo
             async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                recognize_result = response.json()
-
-            if await FileService._is_error(file_record.s3_txt_path):
-                await ProjectFile.update_file_status(file_id=file_id, status=ProjectFileStatusType.error)
-            else:
-                await ProjectFile.update_file_status(file_id=file_id, status=ProjectFileStatusType.success)
+                await FileService.send_to_recognition(client, file_record.id, file_record.project_id, file_record.s3_url)
 
             log.info(f"File {file_id} processing started")
 
@@ -253,212 +418,37 @@ class FileService:
             log.error(f"Error processing file {file_id}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+    @staticmethod
+    async def send_to_recognition(client: httpx.AsyncClient, file_id: int, project_id: int, s3_url: str) -> None:
+        """Ставит файл в очередь воркера распознавания, результат придет в /yolo"""
+        payload = {
+            "image_url": s3_url,
+            "image_id": file_id,
+            "project_id": project_id,
+        }
+        response = await client.post(service_url + "/recognize", json=payload)
+        response.raise_for_status()
+
+    @staticmethod
+    async def get_model_version(client: httpx.AsyncClient) -> str:
+        """Версия модели, загруженной в воркер (SHA-256 весов)"""
+        response = await client.get(service_url + "/model")
+        response.raise_for_status()
+        return response.json()["model_version"]
+
     @with_async_db_session
     async def training_file(self, project_id: int, file_id: int) -> ProjectFileData:
-        """Загружает файлы в s3 для дообучения"""
+        """Добавляет файл в обучающую выборку default. Копирование идет в фоне (DatasetExportService)"""
         log.info(f"Training file with ID {file_id}")
 
         file_record = await ProjectFile.get_file_by_id(file_id)
 
         # Проверка на существование
-        if not file_record:
+        if not file_record or file_record.project_id != project_id:
             log.error(f"File with ID {file_id} not found")
             raise HTTPException(status_code=404, detail="File not found")
+        if file_record.status == ProjectFileStatusType.processing or file_record.job_id is not None:
+            raise HTTPException(status_code=400, detail="File is not recognized yet")
 
-        # Перенесение
-        source_keys = {"img": file_record.s3_path, "txt": file_record.s3_txt_path}
-
-        file_extension = os.path.splitext(file_record.filename)[1]
-        txt_extension = ".txt"
-        filename = os.path.splitext(file_record.s3_path)[0]
-
-        s3_txt_path = f"{filename}{txt_extension}"
-        s3_img_path = f"{filename}{file_extension}"
-
-        dest_keys = {"img": s3_img_path, "txt": s3_txt_path}
-
-        try:
-            # 1. Копируем файл в новый бакет
-            copy_source = {'Bucket': self.s3.s3_config.bucket, 'Key': source_keys["img"]}
-            self.s3.s3_client.copy_object(
-                Bucket=self.training_bucket,
-                Key=dest_keys["img"],
-                CopySource=copy_source
-            )
-            copy_source = {'Bucket': self.s3.s3_config.bucket, 'Key': source_keys["txt"]}
-            self.s3.s3_client.copy_object(
-                Bucket=self.training_bucket,
-                Key=dest_keys["txt"],
-                CopySource=copy_source
-            )
-
-            # # 2. Удаляем оригинал
-            # self.s3.s3_client.delete_object(Bucket=self.s3.s3_config.bucket, Key=source_keys["img"])
-
-        except Exception as e:
-            print(f"Error moving file: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error moving file: {str(e)}")
-
-        result = await ProjectFile.get_file_by_id(file_id)
-
-        return result.to_api()
-
-    @with_async_db_session
-    async def get_report(self, project_id: int, file_id: int) -> bytes:
-        """Возвращает отчет в формате .pdf с анализом дефектов как байты"""
-        log.info(f"Getting report for file {file_id} from project {project_id}")
-
-        # Получаем данные файла
-        file = await ProjectFile.get_file_by_id(file_id)
-        label = self.s3.get_file_content_as_str(file.s3_txt_path)
-
-        # Инициализация стилей PDF
-        styles = self._init_pdf_styles()
-
-        # Анализ данных и подготовка контента
-        defect_data = self._analyze_yolo_labels(label)
-        summary_table = self._build_summary_table(file, defect_data, styles['CyrillicStyle'])
-        full_table = self._generate_full_defects_table(label, styles['CyrillicStyle'])
-
-        # Создаем PDF документ в памяти
-        pdf_bytes = self._create_pdf_document(
-            file=file,
-            project_id=project_id,
-            styles=styles,
-            summary_table=summary_table,
-            full_table=full_table
-        )
-
-        return pdf_bytes
-
-    @staticmethod
-    def _init_pdf_styles():
-        """Инициализирует стили для PDF документа"""
-        font_path = Path(__file__).parent / "fonts" / "DejaVuSans.ttf"
-        pdfmetrics.registerFont(TTFont("DejaVu", str(font_path)))
-
-        styles = getSampleStyleSheet()
-        styles.add(ParagraphStyle(
-            name="CyrillicStyle",
-            fontName="DejaVu",
-            fontSize=12,
-            leading=14,
-            encoding="UTF-8"
-        ))
-        return styles
-
-    def _build_summary_table(self, file, defect_data, style):
-        """Строит сводную таблицу дефектов"""
-        table_data = [[
-            Paragraph("Тип дефекта", style),
-            Paragraph("Количество", style),
-            Paragraph("Процент", style)
-        ]]
-
-        for class_id, count in defect_data.items():
-            defect_type = DefectType.get_by_id(class_id)
-            if defect_type:
-                percentage = (count / file.defect_count) * 100 if file.defect_count > 0 else 0
-                table_data.append([
-                    Paragraph(defect_type.defect, style),
-                    Paragraph(str(count), style),
-                    Paragraph(f"{percentage:.1f}%", style)
-                ])
-
-        table_data.append([
-            Paragraph("Всего", style),
-            Paragraph(str(file.defect_count), style),
-            Paragraph("100%", style)
-        ])
-
-        table = Table(table_data)
-        self._apply_table_style(table, header_color=colors.grey, is_summary_table=True)
-        return table
-
-    def _generate_full_defects_table(self, yolo_text, style):
-        """Генерирует полную таблицу дефектов с координатами"""
-        table_data = [[
-            Paragraph("Тип дефекта", style),
-            Paragraph("Координаты", style)
-        ]]
-
-        for line in yolo_text.split("\n"):
-            parts = line.strip().split()
-            if parts:
-                defect_type = DefectType.get_by_id(int(parts[0]))
-                if defect_type:
-                    table_data.append([
-                        Paragraph(defect_type.defect, style),
-                        Paragraph(" ".join(parts[1:]), style)
-                    ])
-
-        table = Table(table_data)
-        self._apply_table_style(table, header_color=colors.grey, is_summary_table=False)
-        return table
-
-    @staticmethod
-    def _apply_table_style(table, header_color, is_summary_table=True):
-        """Применяет единый стиль к таблице"""
-        style = [
-            ('BACKGROUND', (0, 0), (-1, 0), header_color),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ]
-
-        # Добавляем стили только для сводной таблицы
-        if is_summary_table:
-            style.extend([
-                ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
-                ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-            ])
-        else:
-            # Для полной таблицы - просто бежевый фон всех строк кроме заголовка
-            style.append(('BACKGROUND', (0, 1), (-1, -1), colors.beige))
-
-        table.setStyle(TableStyle(style))
-
-    @staticmethod
-    def _create_pdf_document(file, project_id, styles, summary_table, full_table):
-        """Создает PDF документ и возвращает его в виде байтов"""
-        buffer = BytesIO()
-
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        elements = [
-            Paragraph(f"Отчет по дефектам для файла: {file.filename}", styles['CyrillicStyle']),
-            Paragraph(f"Проект ID: {project_id}", styles['CyrillicStyle']),
-            Spacer(1, 12),
-            summary_table,
-            Spacer(1, 12),
-            Paragraph("Полная статистика", styles['CyrillicStyle']),
-            full_table
-        ]
-
-        doc.build(elements)
-        buffer.seek(0)
-        return buffer.getvalue()
-
-    @staticmethod
-    def _analyze_yolo_labels(yolo_text: str) -> Dict:
-        """Анализирует YOLO разметку и возвращает статистику по классам"""
-        defect_counts = defaultdict(int)
-        for line in yolo_text.split("\n"):
-            parts = line.strip().split()
-            if parts:
-                defect_counts[int(parts[0])] += 1
-        return defect_counts
-
-    @staticmethod
-    async def _is_error(s3_txt_path: str) -> bool:
-        text = await FileService.get_label(s3_txt_path=s3_txt_path)
-        for line in text.split("\n"):  # Хз в чем дело, .splitline() и \n не работают
-            parts = line.strip().split()
-            clas = parts[0]
-            if clas not in ["6", "7", "8"]:  # проверяем, что класс не эталон
-                return True
-        return False
\ No newline at end of file
+        await DatasetExportService().start_export(project_id, TrainingExportData(file_ids=[file_id]))
+        return file_record.to_api()
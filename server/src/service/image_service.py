@@ -1,42 +1,108 @@
-from PIL import Image
 import logging
 import os
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+from service.phash import dhash
+from utils.process_pool import run_in_process
+
+
+@dataclass(frozen=True)
+class ThumbnailSpec:
+    prefix: str
+    size: int
+    square: bool  # True - центральный квадрат size x size, False - вписываем по длинной стороне
+    format: str | None = None  # None - формат исходника
+    quality: int = 85
+
+
+ICON = ThumbnailSpec(prefix="icon_", size=100, square=True)
+PREVIEW = ThumbnailSpec(prefix="preview_", size=1024, square=False, format="WEBP", quality=80)
+
+THUMBNAIL_SPECS = (PREVIEW, ICON)
+
+_EXTENSIONS = {"WEBP": ".webp", "JPEG": ".jpg", "PNG": ".png"}
+
+
+@dataclass
+class ImageMeta:
+    width: int
+    height: int
+    format: str
+    thumbnails: dict[str, str] = field(default_factory=dict)  # prefix -> путь в tmp
+    phash: int | None = None  # Перцептивный хеш (service.phash.dhash)
 
 
-async def create_icon(temp_dir: str, filename: str) -> str:
+def thumbnail_filename(spec: ThumbnailSpec, filename: str) -> str:
+    if spec.format is None:
+        return spec.prefix + filename
+    return spec.prefix + os.path.splitext(filename)[0] + _EXTENSIONS[spec.format]
+
+
+def _draft_size(width: int, height: int, specs: tuple[ThumbnailSpec, ...]) -> tuple[int, int]:
+    """Минимальный размер декодирования, которого хватает всем превью"""
+    scale = 0.0
+    for spec in specs:
+        if spec.square:
+            scale = max(scale, spec.size / min(width, height))
+        else:
+            scale = max(scale, spec.size / max(width, height))
+    scale = min(scale, 1.0)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _render(img: Image.Image, spec: ThumbnailSpec) -> Image.Image:
+    if spec.square:
+        width, height = img.size
+        min_side = min(width, height)
+        left = (width - min_side) // 2
+        top = (height - min_side) // 2
+        img = img.crop((left, top, left + min_side, top + min_side))
+        return img.resize((min(spec.size, min_side),) * 2, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    img = img.copy()
+    img.thumbnail((spec.size, spec.size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return img
+
+
+def make_thumbnails(temp_dir: str, filename: str, specs: tuple[ThumbnailSpec, ...] = THUMBNAIL_SPECS) -> ImageMeta:
     """
-    Создает квадратную иконку 100x100 пикселей из исходного изображения
-    с сохранением пропорций и обрезкой при необходимости
+    Декодирует изображение один раз и строит из него все превью и перцептивный хеш.
+    Для JPEG используется draft-режим: декодер сразу отдает картинку в 1/2, 1/4 или 1/8 разрешения,
+    поэтому полноразмерный снимок в память не попадает.
+    Синхронная функция - вызывается в пуле процессов.
 
     :param temp_dir: Путь к изображению в tmp
     :param filename: Имя изображения
     """
     image_path = os.path.join(temp_dir, filename)
-    try:
-        with Image.open(image_path) as img:
-            # Конвертируем в RGB если нужно (для PNG с прозрачностью)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-
-            # Определяем размеры для ресайза с сохранением пропорций
-            width, height = img.size
-            min_side = min(width, height)
-
-            # Обрезаем до центрального квадрата
-            left = (width - min_side) / 2
-            top = (height - min_side) / 2
-            right = (width + min_side) / 2
-            bottom = (height + min_side) / 2
-            img = img.crop((left, top, right, bottom))
-
-            # Ресайз до 100x100
-            img.thumbnail((100, 100))
-
-            # Сохраняем в temp
-            save_path = os.path.join(temp_dir, "icon_"+filename)
-            img.save(save_path)
-            return save_path
+    with Image.open(image_path) as img:
+        width, height = img.size
+        meta = ImageMeta(width=width, height=height, format=img.format or "")
+
+        img.draft(img.mode, _draft_size(width, height, specs))
+        # Конвертируем в RGB если нужно (для PNG с прозрачностью)
+        if img.mode in ('RGBA', 'P'):
+            img = img.convert('RGB')
+        img.load()
+        meta.phash = dhash(img)
+
+        for spec in specs:
+            thumbnail = _render(img, spec)
+            save_path = os.path.join(temp_dir, thumbnail_filename(spec, filename))
+            if spec.format is None:
+                thumbnail.save(save_path)
+            else:
+                thumbnail.save(save_path, spec.format, quality=spec.quality, method=2)
+            meta.thumbnails[spec.prefix] = save_path
 
+    return meta
+
+
+async def create_thumbnails(temp_dir: str, filename: str) -> ImageMeta:
+    """Строит превью в пуле процессов, не блокируя event loop"""
+    try:
+        return await run_in_process(make_thumbnails, temp_dir, filename)
     except Exception as e:
         logging.error(f"Error creating thumbnail: {str(e)}")
-        raise ValueError("Could not process image") from e
\ No newline at end of file
+        raise ValueError("Could not process image") from e
@@ -0,0 +1,51 @@
+import asyncio
+import contextvars
+from typing import Awaitable, Callable
+
+from dao.project_job import ProjectJob
+from utils.logger import get_logger
+
+log = get_logger("JobService")
+
+# Ссылки на запущенные задачи, иначе asyncio может собрать их сборщиком мусора
+_running: dict[int, asyncio.Task] = {}
+_background: set[asyncio.Task] = set()
+
+
+def run_job(job_id: int, job: Callable[[], Awaitable[None]]) -> asyncio.Task:
+    """
+    Запускает фоновую задачу в текущем event loop и сразу возвращает управление.
+    Задача стартует в пустом контексте: сессия БД запроса не должна утечь в фон,
+    она будет закрыта раньше, чем задача закончит работу.
+    """
+    async def runner():
+        try:
+            await job()
+        except Exception as e:
+            log.error(f"Job {job_id} failed: {str(e)}")
+            await ProjectJob.fail(job_id, str(e))
+        finally:
+            _running.pop(job_id, None)
+
+    task = asyncio.create_task(runner(), context=contextvars.Context())
+    _running[job_id] = task
+    return task
+
+
+def is_running(job_id: int) -> bool:
+    return job_id in _running
+
+
+def spawn(job: Callable[[], Awaitable[None]], name: str) -> asyncio.Task:
+    """Фоновая задача без записи в project_jobs (например, прогрев кешей)"""
+    async def runner():
+        try:
+            await job()
+        except Exception as e:
+            log.error(f"Background task {name} failed: {str(e)}")
+        finally:
+            _background.discard(task)
+
+    task = asyncio.create_task(runner(), context=contextvars.Context())
+    _background.add(task)
+    return task
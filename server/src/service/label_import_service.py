@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+from dao.project import Project
+from dao.project_file import MANUAL_MODEL_VERSION, ProjectFile, file_object_stem
+from dao.project_job import ProjectJob
+from rest.models.panda_data import DefectType
+from rest.models.project_job import ProjectJobData, ProjectJobType
+from service.event_service import EVENT_BUS
+from service.job_service import run_job
+from service.panda_service import analyze_labels
+from service.s3 import get_s3
+from utils.config import CONFIG
+from utils.logger import get_logger
+from utils.process_pool import run_in_process
+
+log = get_logger("LabelImportService")
+
+
+def label_entries(path: str) -> Iterator[Tuple[str, bytes]]:
+    """(имя, содержимое) файлов .txt архива zip или tar (в том числе сжатого) по порядку, без распаковки на диск"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_label_name(info.filename):
+                    yield info.filename, archive.read(info)
+        return
+    with tarfile.open(path, "r:*") as archive:
+        for member in archive:
+            if member.isfile() and _is_label_name(member.name):
+                yield member.name, archive.extractfile(member).read()
+
+
+def _is_label_name(name: str) -> bool:
+    basename = os.path.basename(name)
+    # Служебные файлы архиваторов macOS и скрытые файлы
+    return basename.lower().endswith(".txt") and not basename.startswith(".") and "__MACOSX/" not in name
+
+
+def name_stem(name: str) -> str:
+    """Имя без каталогов и расширения: по нему разметка сопоставляется с файлом проекта"""
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def unknown_classes(text: str) -> List[int]:
+    """
+    Классы разметки, которых нет в DefectType (разметка другого набора классов).
+    Строки разбираются как в parse_label: пустые и с нечисловым классом пропускаются
+    """
+    unknown = set()
+    for line in text.splitlines():
+        parts = line.split(maxsplit=1)
+        if not parts:
+            continue
+        try:
+            class_id = int(parts[0])
+        except ValueError:
+            continue
+        if not 0 <= class_id < len(DefectType):
+            unknown.add(class_id)
+    return sorted(unknown)
+
+
+class LabelImportService:
+    """
+    Импорт готовой разметки YOLO архивом: файл разметки {имя}.txt применяется к файлам проекта с тем же именем
+    без расширения (как ручная разметка, досчет новой моделью ее не трогает).
+    Архив читается пачками по cursor_batch_size: разметка пачки разбирается в пуле процессов, сохраняется одной
+    транзакцией (ProjectFile.save_recognitions), объекты разметки выгружаются в S3 параллельно с ней.
+    Разметка с классами, которых нет в DefectType, не применяется. Итог (какие имена не нашлись, не разобрались
+    или ссылаются на неизвестные классы) - JSON в result_url задачи, прогресс - события job подписчикам проекта.
+    """
+
+    def __init__(self):
+        self.s3 = get_s3()
+
+    async def start_import(self, project_id: int, archive: UploadFile) -> ProjectJobData:
+        project = await Project.get_project_by_id(project_id)
+        if not project:
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        # Файл запроса закрывается вместе с ним - задаче нужна своя копия
+        path = await asyncio.to_thread(self._save_archive, archive.file)
+        if not (zipfile.is_zipfile(path) or tarfile.is_tarfile(path)):
+            os.remove(path)
+            raise HTTPException(status_code=400, detail="Unsupported archive, expected zip or tar")
+
+        job = await ProjectJob.create_job(project_id, ProjectJobType.label_import)
+        run_job(job.id, lambda: self._import(job.id, project_id, project.confidence_threshold, path))
+        return job.to_api()
+
+    @staticmethod
+    def _save_archive(source: BinaryIO) -> str:
+        with tempfile.NamedTemporaryFile(suffix=".archive", delete=False) as target:
+            shutil.copyfileobj(source, target)
+            return target.name
+
+    async def _import(self, job_id: int, project_id: int, threshold: Optional[float], path: str) -> None:
+        try:
+            total = await asyncio.to_thread(lambda: sum(1 for _ in label_entries(path)))
+            await ProjectJob.start(job_id, total, auto_finish=False)
+            await self._publish_job(project_id, job_id)
+            files_by_stem: Dict[str, List[int]] = {}
+            for file_id, filename in await ProjectFile.get_file_names(project_id):
+                files_by_stem.setdefault(name_stem(filename), []).append(file_id)
+            log.info(f"Job {job_id}: importing {total} labels into project {project_id}")
+
+            summary = {"labels": total, "files": 0, "unmatched": [], "failed": [], "unknown_classes": {}}
+            entries = label_entries(path)
+            while batch := await asyncio.to_thread(self._next_batch, entries, CONFIG.batch.cursor_batch_size):
+                await self._import_batch(job_id, project_id, threshold, batch, files_by_stem, summary)
+
+            summary_url = await asyncio.to_thread(self.s3.write_bytes, f"{project_id}/imports/{job_id}.json",
+                                                  json.dumps(summary, ensure_ascii=False).encode("utf-8"),
+                                                  "application/json")
+            await ProjectJob.finish(job_id, result_url=summary_url)
+            await self._publish_job(project_id, job_id)
+        finally:
+            os.remove(path)
+        log.info(f"Job {job_id}: {summary['files']} files labeled, {len(summary['unmatched'])} labels unmatched, "
+                 f"{len(summary['failed'])} failed, {len(summary['unknown_classes'])} with unknown classes")
+
+    @staticmethod
+    def _next_batch(entries: Iterator[Tuple[str, bytes]], size: int) -> List[Tuple[str, bytes]]:
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) == size:
+                break
+        return batch
+
+    async def _import_batch(self, job_id: int, project_id: int, threshold: Optional[float],
+                            batch: List[Tuple[str, bytes]], files_by_stem: Dict[str, List[int]], summary: dict) -> None:
+        labels: Dict[int, str] = {}  # file_id -> текст, при повторе имени в архиве побеждает последний
+        failed = 0
+        for name, content in batch:
+            file_ids = files_by_stem.get(name_stem(name))
+            if not file_ids:
+                summary["unmatched"].append(name)
+                failed += 1
+                continue
+            try:
+                text = content.decode("utf-8")
+            except UnicodeDecodeError:
+                summary["failed"].append(name)
+                failed += 1
+                continue
+            unknown = unknown_classes(text)
+            if unknown:
+                summary["unknown_classes"][name] = unknown
+                failed += 1
+                continue
+            labels.update((file_id, text) for file_id in file_ids)
+
+        saved = []
+        if labels:
+            images = {image.id: image for image in await ProjectFile.get_image_infos(list(labels))}
+            file_ids = [file_id for file_id in labels if file_id in images]
+            analyses = await run_in_process(
+                analyze_labels, [(labels[file_id], images[file_id].width, images[file_id].height) for file_id in file_ids],
+                threshold)
+            results = []
+            for file_id, analysis in zip(file_ids, analyses, strict=True):
+                image = images[file_id]
+                # Пустая разметка, как и в YoloResultService.report, в S3 не выгружается
+                s3_txt_path = f"{file_object_stem(project_id, file_id, image.s3_path, image.content_hash)}.txt" \
+                    if labels[file_id] else None
+                results.append(dict(file_id=file_id, status=analysis.status, defect_counts=analysis.defect_counts,
+                                    label=labels[file_id], detections=analysis.detections,
+                                    max_defect_area=analysis.max_defect_area,
+                                    total_defect_area=analysis.total_defect_area,
+                                    s3_txt_path=s3_txt_path, s3_txt_url=s3_txt_path and self.s3.url(s3_txt_path)))
+            if results:
+                saved, _ = await asyncio.gather(ProjectFile.save_recognitions(results, MANUAL_MODEL_VERSION),
+                                                self._upload_labels(job_id, results))
+        summary["files"] += len(saved)
+        await ProjectJob.add_progress(job_id, dispatched=len(batch), done=len(batch) - failed, failed=failed,
+                                      auto_finish=False)
+        await self._publish_job(project_id, job_id)
+
+    @staticmethod
+    async def _publish_job(project_id: int, job_id: int) -> None:
+        """Прогресс задачи и агрегаты проекта (файлы пачки получили новый статус) подписчикам проекта"""
+        if not EVENT_BUS.has_subscribers(project_id):
+            return
+        job = await ProjectJob.get_job_by_id(job_id)
+        if job:
+            EVENT_BUS.publish(project_id, "job", job.to_api())
+        project = await Project.get_project_by_id(project_id)
+        if project:
+            EVENT_BUS.publish(project_id, "project", project.to_api())
+
+    async def _upload_labels(self, job_id: int, results: List[dict]) -> None:
+        """Объекты разметки в S3. Ошибка не отменяет импорт: разметка в БД, S3 догонит повторная загрузка"""
+        semaphore = asyncio.Semaphore(CONFIG.batch.import_concurrency)
+
+        async def upload(result: dict) -> None:
+            async with semaphore:
+                try:
+                    await asyncio.to_thread(self.s3.write_bytes, result["s3_txt_path"], result["label"].encode("utf-8"),
+                                            "text/plain; charset=utf-8")
+                except Exception as e:
+                    log.error(f"Job {job_id}: error uploading label of file {result['file_id']}: {str(e)}")
+
+        await asyncio.gather(*(upload(result) for result in results if result["s3_txt_path"]))
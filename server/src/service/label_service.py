@@ -0,0 +1,33 @@
+import asyncio
+
+from fastapi import HTTPException
+
+from dao.file_label import FileLabel
+from service.s3 import get_s3
+from utils.logger import get_logger
+
+log = get_logger("LabelService")
+
+
+async def get_label(file_id: int, s3_txt_path: str) -> str:
+    """
+    Возвращает строку с полным содержимым разметки.
+    Основная копия лежит в БД; разметку, которой там еще нет (загружена до появления file_labels),
+    один раз читаем из S3 и сохраняем в БД, если ее не записал тем временем новый результат.
+    """
+    if not s3_txt_path:
+        return ""
+
+    file_label = await FileLabel.get_by_file_id(file_id)
+    if file_label:
+        return file_label.text
+
+    log.info(f"Чтение содержимого из файла {s3_txt_path}")
+
+    try:
+        content = await asyncio.to_thread(get_s3().get_file_content_as_str, s3_txt_path)
+    except Exception as e:
+        log.error(f"Ошибка при чтении файла {s3_txt_path}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Не удалось прочитать файл: {str(e)}")
+
+    return await FileLabel.save_if_missing(file_id, content)
@@ -1,119 +1,145 @@
+import asyncio
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
 from fastapi import HTTPException
-from collections import defaultdict
-import os
-import tempfile
 
+from dao.base import with_async_db_session
+from dao.project import Project
+from dao.project_file import ProjectFile, file_object_stem
+from dao.project_job import ProjectJob
 from rest.models.panda_data import LabelData
+from rest.models.project_event import FileEventData
 from rest.models.project_file import ProjectFileStatusType
-from dao.project_file import ProjectFile, FileDefect
-from dao.base import with_async_db_session
-
-from service.s3 import S3
-from utils.config import CONFIG
+from service.event_service import EVENT_BUS
+from service.report_service import ReportService
+from service.s3 import get_s3
+from service.yolo_label import YoloLabel, parse_label
 from utils.logger import get_logger
 
 log = get_logger("YoloResultService")
 
 
+def label_detections(label: YoloLabel, width: Optional[int], height: Optional[int],
+                     min_confidence: Optional[float] = None) -> Tuple[List[Dict[str, Any]], float, float]:
+    """
+    Геометрия объектов разметки для FileDetection и площади дефектов файла: (строки, максимальная, суммарная).
+    Сохраняются все объекты, площади файла считаются по дефектам с уверенностью не ниже min_confidence.
+    Без размеров изображения сохраняется только доля площади, а площади файла остаются нулевыми.
+    """
+    if not len(label):
+        return [], 0.0, 0.0
+    has_size = bool(width and height)
+    geometry = label.geometry(width, height) if has_size else label.geometry()
+    confidences = [None if math.isnan(value) else value for value in label.confidences.tolist()]
+    rows = [dict(class_id=class_id, area_ratio=ratio, confidence=confidence) for class_id, ratio, confidence in
+            zip(label.class_ids.tolist(), geometry.area_ratio.tolist(), confidences, strict=True)]
+    if not has_size:
+        return rows, 0.0, 0.0
+
+    for row, area, perimeter, max_extent, (x, y, w, h) in zip(rows, geometry.area.tolist(), geometry.perimeter.tolist(),
+                                                              geometry.max_extent.tolist(), geometry.bbox.tolist(),
+                                                              strict=True):
+        row.update(area=area, perimeter=perimeter, max_extent=max_extent, bbox_x=x, bbox_y=y, bbox_w=w, bbox_h=h)
+    defect_areas = geometry.area[label.defect_mask(min_confidence)]
+    if not len(defect_areas):
+        return rows, 0.0, 0.0
+    return rows, float(defect_areas.max()), float(defect_areas.sum())
+
+
+@dataclass
+class LabelAnalysis:
+    """Результат распознавания по тексту разметки - то, что сохраняет ProjectFile.save_recognition"""
+    status: ProjectFileStatusType
+    defect_counts: Dict[int, int]
+    detections: List[Dict[str, Any]]
+    max_defect_area: float
+    total_defect_area: float
+
+
+def analyze_label(txt: str, width: Optional[int], height: Optional[int],
+                  min_confidence: Optional[float] = None) -> LabelAnalysis:
+    label = parse_label(txt)
+    # Объекты ниже порога проекта не учитываются, но сохраняются в file_detections для смены порога
+    defect_counts = label.class_counts(min_confidence)
+    # Вердикт: эталонные классы дефектами не считаются
+    status = ProjectFileStatusType.error if label.has_defects(min_confidence) else ProjectFileStatusType.success
+    detections, max_defect_area, total_defect_area = label_detections(label, width, height, min_confidence)
+    return LabelAnalysis(status, defect_counts, detections, max_defect_area, total_defect_area)
+
+
+def analyze_labels(items: List[Tuple[str, Optional[int], Optional[int]]],
+                   min_confidence: Optional[float] = None) -> List[LabelAnalysis]:
+    """analyze_label для пачки (текст, ширина, высота) - одним вызовом в пуле процессов"""
+    return [analyze_label(txt, width, height, min_confidence) for txt, width, height in items]
+
+
 class YoloResultService:
     def __init__(self):
-        self.s3 = S3(CONFIG.s3)
+        self.s3 = get_s3()
 
-    async def analysis_yolo_txt(self, file_id: int, txt: str) -> LabelData:
+    async def analysis_yolo_txt(self, file_id: int, txt: str, model_version: Optional[str] = None) -> LabelData:
         log.info(f"Analysis YOLO for file: {file_id}")
-        result = await self.report(file_id=file_id, txt=txt)
-        await self.process_yolo_defects(file_id=file_id, yolo_content=txt)
+        result, job_id = await self.report(file_id=file_id, txt=txt, model_version=model_version)
+        await self._publish_result(file_id, job_id)
+        ReportService.schedule(file_id)
         log.info(f"Analysis YOLO for file: {file_id} completed")
         return result
 
+    @staticmethod
     @with_async_db_session
-    async def report(self, file_id: int, txt: str) -> LabelData:
-        if not txt:
-            return ProjectFileStatusType.success # Текст пуст - все ок
-
+    async def _publish_result(file_id: int, job_id: Optional[int]) -> None:
+        """Отправляет подписчикам проекта новый статус файла и агрегаты проекта"""
+        if not EVENT_BUS.subscribers:
+            return
         project_file = await ProjectFile.get_file_by_id(file_id)
+        if not project_file or not EVENT_BUS.has_subscribers(project_file.project_id):
+            return
+        project_id = project_file.project_id
+        api_file = project_file.to_api()
+        EVENT_BUS.publish(project_id, "file", FileEventData(file_id=file_id, project_id=project_id, status=api_file.status,
+                                                            defect_count=api_file.defect_count, defects=api_file.defects))
+        project = await Project.get_project_by_id(project_id)
+        if project:
+            EVENT_BUS.publish(project_id, "project", project.to_api())
+        if job_id is not None:
+            job = await ProjectJob.get_job_by_id(job_id)
+            if job:
+                EVENT_BUS.publish(project_id, "job", job.to_api())
 
-        if not project_file:
-            log.error(f"File {project_file} not found")
+    @with_async_db_session
+    async def report(self, file_id: int, txt: str, model_version: Optional[str] = None) -> Tuple[LabelData, Optional[int]]:
+        """
+        Сохраняет результат распознавания. Все записи в БД идут одной транзакцией (ProjectFile.save_recognition),
+        выгрузка разметки в S3 выполняется параллельно с ней. model_version - версия модели, давшей разметку.
+        Возвращает разметку и id задачи, к которой был привязан файл.
+        """
+        image = await ProjectFile.get_image_info(file_id)
+        if image is None:
+            log.error(f"File {file_id} not found")
             raise HTTPException(status_code=404, detail="File not found")
 
-        # Подсчет элементов
-        total = self._analyze_yolo_labels(txt)
-        # Вердикт
-        verdict = ProjectFileStatusType.error if total > 0 else ProjectFileStatusType.success
-
-        file_extension = ".txt"
-        filename = os.path.splitext(project_file.s3_path)[0]
+        analysis = analyze_label(txt, image.width, image.height, image.confidence_threshold)
 
-        s3_txt_path = f"{filename}{file_extension}"
-
-        unique_filename = os.path.basename(s3_txt_path)
-
-        temp_dir = tempfile.gettempdir()
-        temp_file_path = os.path.join(temp_dir, unique_filename)
-
-        with open(temp_file_path, "w") as temp_file:
-            temp_file.write(txt)
+        if not txt:
+            # Текст пуст - дефектов нет, в S3 выгружать нечего
+            saved = await ProjectFile.save_recognition(file_id, analysis.status, analysis.defect_counts, txt,
+                                                       model_version=model_version)
+            return LabelData(s3_txt_path="", label=""), saved.job_id if saved else None
 
+        s3_txt_path = f"{file_object_stem(image.project_id, file_id, image.s3_path, image.content_hash)}.txt"
         try:
-            s3_txt_url = self.s3.upload_file(temp_file_path, s3_txt_path)
-            await project_file.upload_txt(file_id=file_id, s3_txt_path=s3_txt_path, s3_txt_url=s3_txt_url)
-            # Обновляем статус для фотки
-            await project_file.update_file_status(file_id=file_id, status=verdict)
-            os.remove(temp_file_path)
-
-            log.info(f"Txt uploaded successfully: {s3_txt_url}")
-
+            # Сначала S3: БД не ссылается на разметку, которой нет в S3. Упавшая запись в БД
+            # оставляет в S3 новую разметку по тому же пути - повторная отправка результата ее перезапишет
+            s3_txt_url = await asyncio.to_thread(self.s3.write_bytes, s3_txt_path, txt.encode("utf-8"),
+                                                 "text/plain; charset=utf-8")
         except Exception as e:
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
             log.error(f"Error uploading txt: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error uploading txt: {str(e)}")
-
-        # Возвращаем результат
-        return LabelData(s3_txt_path=s3_txt_path, label=txt)
+            raise HTTPException(status_code=500, detail=f"Error uploading txt: {str(e)}") from e
+        saved = await ProjectFile.save_recognition(file_id, analysis.status, analysis.defect_counts, txt, analysis.detections,
+                                                   analysis.max_defect_area, analysis.total_defect_area, model_version,
+                                                   s3_txt_path=s3_txt_path, s3_txt_url=s3_txt_url)
 
-    @staticmethod
-    def _analyze_yolo_labels(text: str) -> int:
-        defect_counts = 0
-        for line in text.split("\n"): # Хз в чем дело, .splitline() и \n не работают
-            parts = line.strip().split()
-            clas = parts[0]
-            if clas not in ["6", "7", "8"]:  # проверяем, что класс не эталон
-                defect_counts += 1
-
-        return defect_counts
-
-    @staticmethod
-    async def process_yolo_defects(file_id: int, yolo_content: str) -> None:
-        """
-        Парсит YOLO-разметку и сохраняет дефекты в БД
-        """
-        # Удаляем старые дефекты
-        await ProjectFile.delete_file_defects(file_id)
-
-        # Парсим новые дефекты
-        defect_counts = defaultdict(int)
-        for line in yolo_content.split("\n"):
-            line = line.strip()
-            if line:
-                parts = line.split()
-                if parts:
-                    try:
-                        class_id = int(parts[0])
-                        defect_counts[class_id] += 1
-                    except (ValueError, IndexError):
-                        continue
-
-        # Сохраняем в БД
-        total = 0
-        for class_id, count in defect_counts.items():
-            await FileDefect.create(
-                file_id=file_id,
-                class_id=class_id,
-                count=count
-            )
-            total += count
-
-        # Обновляем общее количество
-        await ProjectFile.update_defect_count(file_id, total)
\ No newline at end of file
+        log.info(f"Txt uploaded successfully: {s3_txt_path}")
+        return LabelData(s3_txt_path=s3_txt_path, label=txt), saved.job_id if saved else None
@@ -0,0 +1,58 @@
+from itertools import combinations
+from typing import List
+
+from PIL import Image
+
+# Перцептивный хеш (dHash) - 64 бита: знак градиента яркости между соседними пикселями уменьшенного до 9x8 снимка.
+# Пересохранение, пережатие и небольшое изменение масштаба или экспозиции меняют лишь несколько бит,
+# поэтому близость снимков - расстояние Хэмминга между хешами.
+
+HASH_BITS = 64
+# Хеш в БД делится на полосы по 16 бит с отдельным индексом на каждую (multi-index hashing):
+# у хешей на расстоянии d хотя бы одна полоса отличается не больше чем на d // BANDS бит
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+# Дальше полосы приходится перебирать с радиусом 2 (137 вариантов на полосу) - для поиска повторов это уже лишнее
+MAX_DISTANCE = 2 * BANDS - 1
+
+
+def dhash(img: Image.Image) -> int:
+    """
+    dHash изображения как знаковое 64-битное число (BIGINT в БД).
+    Снимок сначала сжимается до 9x8 в оттенках серого, поэтому хватает draft-декодирования JPEG
+    """
+    small = img.convert("L").resize((9, 8), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for x in range(8):
+            value = (value << 1) | (pixels[offset + x + 1] > pixels[offset + x])
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def band_shift(band: int) -> int:
+    """Сдвиг полосы band в хеше: полоса 0 - старшие 16 бит"""
+    return (BANDS - 1 - band) * BAND_BITS
+
+
+def band_masks(max_distance: int) -> List[int]:
+    """
+    Маски XOR для перебора значений полосы: все 16-битные маски не больше чем из max_distance // BANDS единиц.
+    Кандидаты - хеши, у которых хотя бы одна полоса равна полосе искомого XOR одна из масок
+    """
+    radius = max_distance // BANDS
+    masks = [0]
+    for bits in range(1, radius + 1):
+        masks.extend(sum(1 << bit for bit in combo) for combo in combinations(range(BAND_BITS), bits))
+    return masks
+
+
+def band_values(value: int, max_distance: int) -> List[List[int]]:
+    """Значения каждой полосы, при которых хеш может быть на расстоянии не больше max_distance от value"""
+    masks = band_masks(max_distance)
+    bands = []
+    for band in range(BANDS):
+        part = (value >> band_shift(band)) & ((1 << BAND_BITS) - 1)
+        bands.append([part ^ mask for mask in masks])
+    return bands
@@ -0,0 +1,145 @@
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterator
+
+from fastapi import HTTPException
+
+from dao.project import Project
+from dao.project_file import ProjectFile
+from dao.project_job import ProjectJob
+from rest.models.panda_data import DefectType
+from rest.models.project_job import ProjectJobData, ProjectJobType
+from service.job_service import run_job
+from service.report_builder import build_project_report
+from service.s3 import get_s3
+from utils.config import CONFIG
+from utils.logger import get_logger
+from utils.process_pool import run_in_process
+
+log = get_logger("ProjectReportService")
+
+CSV_HEADER = ["file_id", "filename", "status", "defect_count"] + [defect_type.defect for defect_type in DefectType]
+
+
+@dataclass
+class ProjectReportRow:
+    file_id: int
+    filename: str
+    status: str
+    counts: dict[int, int] = field(default_factory=dict)
+
+    @property
+    def defect_count(self) -> int:
+        return sum(self.counts.values())
+
+    def to_csv(self) -> list:
+        return [self.file_id, self.filename, self.status, self.defect_count] + [self.counts.get(i, 0) for i in range(len(DefectType))]
+
+
+@dataclass
+class ProjectDefectStats:
+    """Агрегаты по проекту, считаются по ходу чтения файлов"""
+    files: int = 0
+    files_with_defects: int = 0
+    defects: int = 0
+    by_status: dict[str, int] = field(default_factory=dict)
+    by_class: dict[int, int] = field(default_factory=dict)  # class_id -> количество дефектов
+    files_by_class: dict[int, int] = field(default_factory=dict)  # class_id -> количество файлов с дефектом
+
+    def add(self, row: ProjectReportRow) -> None:
+        self.files += 1
+        self.by_status[row.status] = self.by_status.get(row.status, 0) + 1
+        if row.counts:
+            self.files_with_defects += 1
+        for class_id, count in row.counts.items():
+            self.defects += count
+            self.by_class[class_id] = self.by_class.get(class_id, 0) + count
+            self.files_by_class[class_id] = self.files_by_class.get(class_id, 0) + 1
+
+
+class ProjectReportService:
+    """
+    Отчет по всему проекту. Файлы читаются серверным курсором, статистика копится инкрементально,
+    поэтому память не зависит от размера проекта.
+    """
+
+    @staticmethod
+    async def iter_rows(project_id: int) -> AsyncIterator[ProjectReportRow]:
+        current: ProjectReportRow | None = None
+        async for partition in ProjectFile.stream_project_defects(project_id, CONFIG.batch.cursor_batch_size):
+            for file_id, filename, status, class_id, count in partition:
+                if current is None or current.file_id != file_id:
+                    if current is not None:
+                        yield current
+                    current = ProjectReportRow(file_id=file_id, filename=filename, status=status.value)
+                if class_id is not None:
+                    current.counts[class_id] = current.counts.get(class_id, 0) + (count or 0)
+        if current is not None:
+            yield current
+
+    async def get_project(self, project_id: int) -> Project:
+        project = await Project.get_project_by_id(project_id)
+        if not project:
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
+        return project
+
+    async def stream_csv(self, project_id: int) -> AsyncIterator[str]:
+        """CSV построчно: по строке на файл, колонки - количество дефектов каждого класса"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write("\ufeff")  # BOM, чтобы Excel открыл кириллицу
+        writer.writerow(CSV_HEADER)
+        rows = 0
+        async for row in self.iter_rows(project_id):
+            writer.writerow(row.to_csv())
+            rows += 1
+            if rows % CONFIG.batch.cursor_batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    async def start_pdf(self, project_id: int) -> ProjectJobData:
+        """Запускает построение PDF-отчета по проекту в фоне, результат - result_url задачи"""
+        project = await self.get_project(project_id)
+        job = await ProjectJob.create_job(project_id, ProjectJobType.report)
+        run_job(job.id, lambda: self._build_pdf(job.id, project.id, project.name, project.count_of_files))
+        return job.to_api()
+
+    async def _build_pdf(self, job_id: int, project_id: int, project_name: str, total: int) -> None:
+        await ProjectJob.start(job_id, total, auto_finish=False)
+        stats = ProjectDefectStats()
+
+        # Строки пишем во временный CSV, PDF собирается из него в пуле процессов построчно
+        fd, rows_path = tempfile.mkstemp(suffix=".csv")
+        pdf_path = rows_path[:-4] + ".pdf"
+        try:
+            with os.fdopen(fd, "w", newline="") as rows_file:
+                writer = csv.writer(rows_file)
+                processed = 0
+                async for row in self.iter_rows(project_id):
+                    writer.writerow(row.to_csv())
+                    stats.add(row)
+                    processed += 1
+                    if processed % CONFIG.batch.cursor_batch_size == 0:
+                        await ProjectJob.add_progress(job_id, dispatched=CONFIG.batch.cursor_batch_size,
+                                                      done=CONFIG.batch.cursor_batch_size, auto_finish=False)
+
+            await run_in_process(build_project_report, rows_path, pdf_path, project_id, project_name, asdict(stats))
+
+            s3_path = f"{project_id}/reports/project_{project_id}_job_{job_id}.pdf"
+            s3 = get_s3()
+            s3_url = await asyncio.to_thread(s3.put_file, pdf_path, s3_path, "application/pdf")
+            rest = processed % CONFIG.batch.cursor_batch_size
+            await ProjectJob.add_progress(job_id, dispatched=rest, done=rest, auto_finish=False)
+            await ProjectJob.finish(job_id, result_url=s3_url)
+            log.info(f"Project {project_id} report stored: {s3_url}")
+        finally:
+            for path in (rows_path, pdf_path):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -1,17 +1,30 @@
-from typing import Optional
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+
+import httpx
 from fastapi import HTTPException
 
 from dao.base import with_async_db_session
 from dao.project import Project
-from rest.models.project import ProjectData, ProjectListData, CreateProjectData, ProjectStatusType
-from rest.models.project_file import ProjectFileListData, ProjectFileData
+from dao.project_file import ProjectFile
+from dao.project_job import ProjectJob
+from rest.models.project import CreateProjectData, ProjectData, ProjectListData, ProjectStatusType
+from rest.models.project_job import ProjectJobData, ProjectJobType
+from service.event_service import EVENT_BUS
 from service.file_service import FileService
+from service.job_service import run_job
+from service.s3 import DELETE_BATCH_SIZE, get_s3
+from service.yolo_label import REFERENCE_CLASSES
+from utils.config import CONFIG
+from utils.cursor import decode_cursor, encode_cursor
 from utils.logger import get_logger
 
-from datetime import datetime
-
 log = get_logger("ProjectService")
 
+# Попытки удалить объекты, записанные в префикс проекта во время удаления
+LATE_DELETE_ATTEMPTS = 3
+
 
 class ProjectService:
 
@@ -26,20 +39,34 @@ class ProjectService:
 
     @with_async_db_session
     async def search_projects(self, name: Optional[str] = None, status_files: Optional[str] = None, start_date: Optional[datetime] = None,
-                              end_date: Optional[datetime] = None, page: int = 1, size: int = 20) -> ProjectListData:
+                              end_date: Optional[datetime] = None, page: int = 1, size: int = 20,
+                              cursor: Optional[str] = None, name_prefix: bool = False) -> ProjectListData:
         log.info(f"Getting projects, filters: name={name}, date_range={start_date}-{end_date}")
 
+        after = None
+        if cursor:
+            try:
+                created_at, project_id = decode_cursor(cursor, 2)
+                after = (datetime.fromisoformat(created_at), int(project_id))
+            except (TypeError, ValueError) as e:
+                raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
         projects, total = await Project.search_projects(name=name, start_date=start_date,
                                                         end_date=end_date, page=page, size=size,
-                                                        status_files=status_files,)
+                                                        status_files=status_files, name_prefix=name_prefix,
+                                                        after=after)
 
         items = [project.to_api() for project in projects]
+        next_cursor = None
+        if len(projects) == size:
+            next_cursor = encode_cursor(projects[-1].created_at.isoformat(), projects[-1].id)
 
         return ProjectListData(
             items=items,
             total=total,
             page=page,
-            size=size
+            size=size,
+            next_cursor=next_cursor
         )
 
     @with_async_db_session
@@ -54,17 +81,20 @@ class ProjectService:
         return project.to_api()
 
     @with_async_db_session
-    async def delete_project(self, project_id: int) -> None:
+    async def delete_project(self, project_id: int) -> ProjectJobData:
+        """
+        Скрывает проект и создает задачу его удаления, сами объекты S3 и строки удаляются в фоне.
+        Повторный вызов для уже удаляемого проекта запускает удаление заново - так доводится прервавшееся
+        """
         log.info(f"Deleting project with id: {project_id}")
-        
-        # Check if project exists
-        project = await Project.get_project_by_id(project_id)
-        
-        if not project:
-            raise ValueError(f"Project with id {project_id} not found")
-        
-        # Delete project
-        await Project.delete_project_by_id(project_id)
+
+        if not await Project.mark_deleted(project_id):
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        job = await ProjectJob.create_job(project_id, ProjectJobType.deletion)
+        run_job(job.id, lambda: self._delete_project(job.id, project_id))
+        return job.to_api()
 
     @with_async_db_session
     async def update_project_name(self, project_id: int, new_name: str) -> ProjectData:
@@ -84,6 +114,38 @@ class ProjectService:
         
         return updated_project.to_api()
 
+    @with_async_db_session
+    async def update_confidence_threshold(self, project_id: int, threshold: Optional[float]) -> ProjectData:
+        """
+        Меняет порог уверенности проекта. Распознанные файлы пересчитываются в БД по сохраненным объектам
+        разметки, повторного распознавания не нужно
+        """
+        log.info(f"Updating project {project_id} confidence threshold to {threshold}")
+        project = await Project.update_confidence_threshold(project_id, threshold, sorted(REFERENCE_CLASSES))
+        if not project:
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        api_project = project.to_api()
+        EVENT_BUS.publish(project_id, "project", api_project)
+        return api_project
+
+    @with_async_db_session
+    async def update_near_duplicate_distance(self, project_id: int, max_distance: Optional[int]) -> ProjectData:
+        """
+        Меняет порог похожести снимков проекта. Действует на новые загрузки: файл, похожий на уже распознанный,
+        сразу получает его результат. Уже загруженные файлы не пересчитываются
+        """
+        log.info(f"Updating project {project_id} near duplicate distance to {max_distance}")
+        project = await Project.update_near_duplicate_distance(project_id, max_distance)
+        if not project:
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        api_project = project.to_api()
+        EVENT_BUS.publish(project_id, "project", api_project)
+        return api_project
+
     @with_async_db_session
     async def update_project_status(self, project_id: int):
         log.info(f"Updating project {project_id} status")
@@ -103,60 +165,193 @@ class ProjectService:
         return updated_project.to_api()
 
     @with_async_db_session
-    async def process_project_files(self, project_id: int, page: int = 1, size: int = 20) -> ProjectFileListData:
+    async def process_project_files(self, project_id: int) -> ProjectJobData:
         """
-        Отправляет все файлы проекта на обработку и возвращает ProjectFileListData
+        Создает задачу пакетной обработки проекта и сразу возвращает ее.
+        Сама отправка файлов воркерам идет в фоне, прогресс - в ProjectJob.
         """
         log.info(f"Processing all files for project {project_id}")
 
-        # 1. Проверяем существование проекта
         project = await Project.get_project_by_id(project_id)
         if not project:
             log.error(f"Project {project_id} not found")
             raise HTTPException(status_code=404, detail="Project not found")
 
-        # 2. Получаем все файлы проекта в формате ProjectFileListData
-        files_data: ProjectFileListData = await self.file_service.get_project_files(project_id=project_id, page=page,
-                                                                                    size=size, to_delete=False)
+        job = await ProjectJob.create_job(project_id, ProjectJobType.recognition)
+        run_job(job.id, lambda: self._dispatch_project_files(job.id, project_id))
+        return job.to_api()
+
+    @with_async_db_session
+    async def reprocess_stale_files(self, project_id: int, max_rate: Optional[float] = None) -> ProjectJobData:
+        """
+        Досчет после смены модели: в фоне отправляет на распознавание только файлы без результата текущей модели
+        воркера (старая модель, нет результата, ошибка отправки), не быстрее max_rate файлов в секунду.
+        Прервавшийся досчет продолжается повторным вызовом: уже пересчитанные файлы в выборку не попадут.
+        """
+        log.info(f"Reprocessing stale files for project {project_id}")
+
+        project = await Project.get_project_by_id(project_id)
+        if not project:
+            log.error(f"Project {project_id} not found")
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        try:
+            async with httpx.AsyncClient() as client:
+                model_version = await FileService.get_model_version(client)
+        except Exception as e:
+            log.error(f"Error getting model version: {str(e)}")
+            raise HTTPException(status_code=503, detail=f"Recognition service unavailable: {str(e)}") from e
+
+        rate = max_rate or CONFIG.batch.reprocess_rate
+        job = await ProjectJob.create_job(project_id, ProjectJobType.reprocess)
+        run_job(job.id, lambda: self._dispatch_project_files(job.id, project_id, model_version=model_version, rate=rate))
+        return job.to_api()
+
+    @with_async_db_session
+    async def get_job(self, project_id: int, job_id: int) -> ProjectJobData:
+        job = await ProjectJob.get_job_by_id(job_id)
+        # У завершенного удаления project_id уже сброшен (ON DELETE SET NULL), а итог задачи нужен
+        deleted = job is not None and job.project_id is None and job.type == ProjectJobType.deletion
+        if not job or (job.project_id != project_id and not deleted):
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job.to_api()
+
+    @staticmethod
+    async def _delete_project(job_id: int, project_id: int) -> None:
+        """
+        Удаляет все объекты S3 под префиксом проекта запросами DeleteObjects по DELETE_BATCH_SIZE ключей,
+        не больше batch.delete_concurrency одновременно, затем строки проекта одним DELETE (остальное - каскады FK).
+        Изображения blobs, на которые больше никто не ссылается, удаляет collect_blobs.
+        Если часть объектов удалить не удалось, строки остаются, а задача падает: повторный DELETE продолжит.
+        Объекты, появившиеся за время удаления, удаляются после строк с повторами; не удалось - задача падает.
+        """
+        s3 = get_s3()
+        prefix = f"{project_id}/"
+        keys = await asyncio.to_thread(lambda: [key for page in s3.list_keys(prefix) for key in page])
+        await ProjectJob.start(job_id, len(keys), auto_finish=False)
+        await ProjectService._publish_job(project_id, job_id)
+        log.info(f"Job {job_id}: deleting {len(keys)} objects of project {project_id}")
+
+        semaphore = asyncio.Semaphore(CONFIG.batch.delete_concurrency)
+        failed_keys: List[str] = []
+
+        async def delete_batch(batch: List[str]):
+            async with semaphore:
+                try:
+                    failed = await asyncio.to_thread(s3.delete_many, batch)
+                except Exception as e:
+                    log.error(f"Job {job_id}: error deleting objects: {str(e)}")
+                    failed = batch
+            failed_keys.extend(failed)
+            await ProjectJob.add_progress(job_id, done=len(batch) - len(failed), failed=len(failed), auto_finish=False)
+            await ProjectService._publish_job(project_id, job_id)
+
+        await asyncio.gather(*(delete_batch(keys[start:start + DELETE_BATCH_SIZE])
+                               for start in range(0, len(keys), DELETE_BATCH_SIZE)))
+        if failed_keys:
+            await ProjectJob.fail(job_id, f"Failed to delete {len(failed_keys)} objects, repeat deletion to retry")
+            return
+
+        await Project.delete_project_by_id(project_id)
+        # Разметка или отчет, которые писались во время удаления: файлы уже проверены, а строк больше нет
+        # Строк проекта уже нет и повторный DELETE его не найдет, поэтому неудаленные ключи повторяются здесь же
+        late_keys = await asyncio.to_thread(lambda: [key for page in s3.list_keys(prefix) for key in page])
+        for _ in range(LATE_DELETE_ATTEMPTS):
+            if not late_keys:
+                break
+            failed_keys = []
+            for start in range(0, len(late_keys), DELETE_BATCH_SIZE):
+                batch = late_keys[start:start + DELETE_BATCH_SIZE]
+                try:
+                    failed_keys.extend(await asyncio.to_thread(s3.delete_many, batch))
+                except Exception as e:
+                    log.error(f"Job {job_id}: error deleting late objects: {str(e)}")
+                    failed_keys.extend(batch)
+            late_keys = failed_keys
+        if late_keys:
+            log.error(f"Job {job_id}: objects left under prefix {prefix}: {late_keys[:10]}")
+            await ProjectJob.fail(job_id, f"Project deleted, but {len(late_keys)} objects under {prefix} were not deleted")
+            return
+        # Изображения, на которые ссылались только файлы проекта
+        await FileService.collect_blobs()
+        await ProjectJob.finish(job_id)
+        log.info(f"Job {job_id}: project {project_id} deleted")
+
+    @staticmethod
+    async def _dispatch_project_files(job_id: int, project_id: int, model_version: Optional[str] = None,
+                                      rate: Optional[float] = None) -> None:
+        """
+        Перебирает файлы задачи пачками и отправляет их воркерам,
+        держа в полете не больше batch.dispatch_concurrency запросов и не больше rate файлов в секунду.
+        model_version задан - в задачу берутся только файлы без результата этой модели (досчет).
+        """
+        if model_version is None:
+            total = await ProjectFile.assign_job(project_id, job_id)
+        else:
+            total = await ProjectFile.assign_stale_job(project_id, job_id, model_version)
+        await ProjectJob.start(job_id, total)
+        await ProjectService._publish_job(project_id, job_id)
+        log.info(f"Job {job_id}: dispatching {total} files of project {project_id}")
 
-        if not files_data.items:
-            log.info(f"No files found for project {project_id}")
-            return ProjectFileListData(items=[], total=0, page=page, size=size)
+        concurrency = CONFIG.batch.dispatch_concurrency
+        queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        dispatched = 0
+        failed_ids: List[int] = []
 
-        # 3. Обновляем статус проекта
-        await Project.update_project_status(project_id=project_id)
+        async def consumer(client: httpx.AsyncClient):
+            nonlocal dispatched
+            while True:
+                file_id, file_project_id, s3_url = await queue.get()
+                try:
+                    await FileService.send_to_recognition(client, file_id, file_project_id, s3_url)
+                    dispatched += 1
+                except Exception as e:
+                    log.error(f"Job {job_id}: error dispatching file {file_id}: {str(e)}")
+                    failed_ids.append(file_id)
+                finally:
+                    queue.task_done()
 
-        # 4. Отправляем каждый файл на обработку
-        processed_files = []
-        for file in files_data.items:
+        async def flush():
+            nonlocal dispatched, failed_ids
+            batch_dispatched, batch_failed = dispatched, failed_ids
+            dispatched, failed_ids = 0, []
+            if batch_failed:
+                await ProjectFile.fail_job_files(batch_failed, keep_result=model_version is not None)
+            if batch_dispatched or batch_failed:
+                await ProjectJob.add_progress(job_id, dispatched=batch_dispatched, failed=len(batch_failed))
+                await ProjectService._publish_job(project_id, job_id)
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits) as client:
+            consumers = [asyncio.create_task(consumer(client)) for _ in range(concurrency)]
             try:
-                # Проверяем, что файл еще не в обработке
-                # if file.status != "processing":
-                processed_file = await self.file_service.process_file(file.id)
-                processed_files.append(processed_file)
-                # else:
-                #     log.info(f"File {file.id} is already being processed")
-                #     processed_files.append(file)
-            except Exception as e:
-                log.error(f"Error processing file {file.id}: {str(e)}")
-                # Создаем объект с ошибкой для включения в результат
-                error_file = ProjectFileData(
-                    id=file.id,
-                    project_id=file.project_id,
-                    filename=file.filename,
-                    s3_path=file.s3_path,
-                    s3_url=file.s3_url,
-                    s3_icon_path=file.s3_icon_path,
-                    s3_icon_url=file.s3_icon_url,
-                    s3_txt_path=file.s3_txt_path,
-                    s3_txt_url=file.s3_txt_url,
-                    status="process_error"
-                )
-                processed_files.append(error_file)
-
-        # 5. Обновляем статус проекта после отправки
-        await self.update_project_status(project_id)
-
-        # Получаем результат
-        result = await FileService.get_project_files(project_id=project_id, page=page, size=size, to_delete=False)
-        return result
+                loop = asyncio.get_running_loop()
+                started, sent = loop.time(), 0
+                async for partition in ProjectFile.stream_job_files(job_id, CONFIG.batch.cursor_batch_size):
+                    for row in partition:
+                        if rate:
+                            # Равномерный темп: файл номер sent уходит не раньше started + sent / rate
+                            delay = started + sent / rate - loop.time()
+                            if delay > 0:
+                                await asyncio.sleep(delay)
+                        await queue.put(tuple(row))
+                        sent += 1
+                    await flush()
+                await queue.join()
+                await flush()
+            finally:
+                for task in consumers:
+                    task.cancel()
+
+        log.info(f"Job {job_id}: dispatch of project {project_id} finished")
+
+    @staticmethod
+    async def _publish_job(project_id: int, job_id: int) -> None:
+        if not EVENT_BUS.has_subscribers(project_id):
+            return
+        job = await ProjectJob.get_job_by_id(job_id)
+        if job:
+            EVENT_BUS.publish(project_id, "job", job.to_api())
+        project = await Project.get_project_by_id(project_id)
+        if project:
+            EVENT_BUS.publish(project_id, "project", project.to_api())
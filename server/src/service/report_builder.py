@@ -0,0 +1,240 @@
+import csv
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from rest.models.panda_data import DefectType
+from service.yolo_label import YoloLabel, parse_label
+
+# Проверка
+font_path = Path(__file__).parent / "fonts" / "DejaVuSans.ttf"
+if not font_path.exists():
+    raise FileNotFoundError(f"Шрифт не найден по пути: {font_path}")
+
+_styles = None
+
+
+def build_file_report(filename: str, project_id: int, label: str, min_confidence: Optional[float] = None) -> bytes:
+    """
+    Строит отчет .pdf с анализом дефектов файла. Объекты с уверенностью ниже min_confidence
+    (порог проекта) не учитываются - как в счетчиках файла.
+    Синхронная функция - вызывается в пуле процессов.
+    """
+    styles = _init_pdf_styles()
+
+    yolo_label = parse_label(label)
+    defect_data = yolo_label.class_counts(min_confidence)
+    defect_count = sum(defect_data.values())
+    summary_table = _build_summary_table(defect_data, defect_count, styles['CyrillicStyle'])
+    full_table = _generate_full_defects_table(yolo_label, yolo_label.confident_mask(min_confidence), styles['CyrillicStyle'])
+
+    return _create_pdf_document(
+        filename=filename,
+        project_id=project_id,
+        styles=styles,
+        summary_table=summary_table,
+        full_table=full_table
+    )
+
+
+def _init_pdf_styles():
+    """Инициализирует стили для PDF документа (один раз на процесс)"""
+    global _styles
+    if _styles is None:
+        pdfmetrics.registerFont(TTFont("DejaVu", str(font_path)))
+
+        styles = getSampleStyleSheet()
+        styles.add(ParagraphStyle(
+            name="CyrillicStyle",
+            fontName="DejaVu",
+            fontSize=12,
+            leading=14,
+            encoding="UTF-8"
+        ))
+        _styles = styles
+    return _styles
+
+
+def _build_summary_table(defect_data, defect_count, style):
+    """Строит сводную таблицу дефектов"""
+    table_data = [[
+        Paragraph("Тип дефекта", style),
+        Paragraph("Количество", style),
+        Paragraph("Процент", style)
+    ]]
+
+    for class_id, count in defect_data.items():
+        defect_type = DefectType.get_by_id(class_id)
+        if defect_type:
+            percentage = (count / defect_count) * 100 if defect_count > 0 else 0
+            table_data.append([
+                Paragraph(defect_type.defect, style),
+                Paragraph(str(count), style),
+                Paragraph(f"{percentage:.1f}%", style)
+            ])
+
+    table_data.append([
+        Paragraph("Всего", style),
+        Paragraph(str(defect_count), style),
+        Paragraph("100%", style)
+    ])
+
+    table = Table(table_data)
+    _apply_table_style(table, header_color=colors.grey, is_summary_table=True)
+    return table
+
+
+def _generate_full_defects_table(yolo_label: YoloLabel, mask: np.ndarray, style):
+    """Генерирует полную таблицу дефектов с координатами (объекты по маске)"""
+    table_data = [[
+        Paragraph("Тип дефекта", style),
+        Paragraph("Координаты", style)
+    ]]
+
+    for i, class_id in enumerate(yolo_label.class_ids.tolist()):
+        if not mask[i]:
+            continue
+        defect_type = DefectType.get_by_id(class_id)
+        if defect_type:
+            coords = " ".join(f"{value:.6g}" for value in yolo_label.polygon(i).ravel().tolist())
+            table_data.append([
+                Paragraph(defect_type.defect, style),
+                Paragraph(coords, style)
+            ])
+
+    table = Table(table_data)
+    _apply_table_style(table, header_color=colors.grey, is_summary_table=False)
+    return table
+
+
+def _apply_table_style(table, header_color, is_summary_table=True):
+    """Применяет единый стиль к таблице"""
+    style = [
+        ('BACKGROUND', (0, 0), (-1, 0), header_color),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVu'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ]
+
+    # Добавляем стили только для сводной таблицы
+    if is_summary_table:
+        style.extend([
+            ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
+            ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+        ])
+    else:
+        # Для полной таблицы - просто бежевый фон всех строк кроме заголовка
+        style.append(('BACKGROUND', (0, 1), (-1, -1), colors.beige))
+
+    table.setStyle(TableStyle(style))
+
+
+def _create_pdf_document(filename, project_id, styles, summary_table, full_table):
+    """Создает PDF документ и возвращает его в виде байтов"""
+    buffer = BytesIO()
+
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    elements = [
+        Paragraph(f"Отчет по дефектам для файла: {filename}", styles['CyrillicStyle']),
+        Paragraph(f"Проект ID: {project_id}", styles['CyrillicStyle']),
+        Spacer(1, 12),
+        summary_table,
+        Spacer(1, 12),
+        Paragraph("Полная статистика", styles['CyrillicStyle']),
+        full_table
+    ]
+
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def build_project_report(rows_path: str, pdf_path: str, project_id: int, project_name: str, stats: dict) -> None:
+    """
+    Строит отчет .pdf по проекту: сводная статистика и постраничный список файлов.
+    Список читается из CSV построчно и рисуется прямо на canvas, без сборки всех строк в памяти.
+    Синхронная функция - вызывается в пуле процессов.
+    """
+    styles = _init_pdf_styles()
+    style = styles['CyrillicStyle']
+    page_width, page_height = letter
+    margin = 40
+
+    pdf = canvas.Canvas(pdf_path, pagesize=letter)
+    pdf.setTitle(f"Отчет по проекту {project_name}")
+
+    def footer():
+        pdf.setFont("DejaVu", 8)
+        pdf.drawRightString(page_width - margin, margin / 2, f"Проект {project_id} — стр. {pdf.getPageNumber()}")
+
+    # Сводка
+    elements = [
+        Paragraph(f"Отчет по дефектам проекта: {project_name}", style),
+        Paragraph(f"Проект ID: {project_id}", style),
+        Paragraph(f"Файлов: {stats['files']}, с дефектами: {stats['files_with_defects']}, дефектов: {stats['defects']}", style),
+        Paragraph("Статусы: " + ", ".join(f"{status} - {count}" for status, count in sorted(stats['by_status'].items())), style),
+    ]
+    summary_data = [[Paragraph("Тип дефекта", style), Paragraph("Количество", style),
+                     Paragraph("Процент", style), Paragraph("Файлов", style)]]
+    for class_id, count in sorted(stats['by_class'].items()):
+        percentage = (count / stats['defects']) * 100 if stats['defects'] > 0 else 0
+        summary_data.append([Paragraph(DefectType.get_by_id(class_id).defect, style), Paragraph(str(count), style),
+                             Paragraph(f"{percentage:.1f}%", style), Paragraph(str(stats['files_by_class'][class_id]), style)])
+    summary_data.append([Paragraph("Всего", style), Paragraph(str(stats['defects']), style),
+                         Paragraph("100%", style), Paragraph(str(stats['files_with_defects']), style)])
+    summary_table = Table(summary_data)
+    _apply_table_style(summary_table, header_color=colors.grey, is_summary_table=True)
+    elements.append(Spacer(1, 12))
+    elements.append(summary_table)
+
+    y = page_height - margin
+    for element in elements:
+        _, height = element.wrapOn(pdf, page_width - 2 * margin, y - margin)
+        y -= height + 4
+        element.drawOn(pdf, margin, y)
+
+    # Список файлов
+    line_height = 12
+    columns = [margin, margin + 50, margin + 260, margin + 330, margin + 380]
+
+    def header(y):
+        pdf.setFont("DejaVu", 9)
+        for x, title in zip(columns, ["ID", "Файл", "Статус", "Дефектов", "По типам"], strict=True):
+            pdf.drawString(x, y, title)
+        pdf.line(margin, y - 3, page_width - margin, y - 3)
+        return y - line_height - 2
+
+    y = header(y - 24)
+    with open(rows_path, newline="") as rows_file:
+        for row in csv.reader(rows_file):
+            if y < margin + line_height:
+                footer()
+                pdf.showPage()
+                y = header(page_height - margin)
+            file_id, filename, status, defect_count, *counts = row
+            by_type = ", ".join(f"{DefectType.get_by_id(class_id).defect} {count}"
+                                for class_id, count in enumerate(counts) if count != "0")
+            pdf.setFont("DejaVu", 8)
+            pdf.drawString(columns[0], y, file_id)
+            pdf.drawString(columns[1], y, filename[:40])
+            pdf.drawString(columns[2], y, status)
+            pdf.drawString(columns[3], y, defect_count)
+            pdf.drawString(columns[4], y, by_type[:60])
+            y -= line_height
+
+    footer()
+    pdf.save()
@@ -0,0 +1,136 @@
+import asyncio
+import contextvars
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import HTTPException
+
+from dao.file_label import label_hash
+from dao.project_file import ProjectFile
+from service import label_service
+from service.job_service import spawn
+from service.report_builder import build_file_report
+from service.s3 import get_s3
+from utils.config import CONFIG
+from utils.logger import get_logger
+from utils.process_pool import run_in_process
+
+log = get_logger("ReportService")
+
+# Генерации в процессе: (file_id, report_key) -> задача, чтобы одна версия отчета строилась один раз
+_in_flight: dict[tuple[int, str], asyncio.Task] = {}
+# Очередь заранее строящихся отчетов: файлы, ждущие сборки, и задача, которая их разбирает
+_pending: set[int] = set()
+_pregenerate_task: Optional[asyncio.Task] = None
+
+
+def report_key(label: str, min_confidence: Optional[float]) -> str:
+    """Версия отчета: хеш разметки и порога проекта - от него зависят счетчики отчета"""
+    return label_hash(f"{min_confidence!r}\n{label}")
+
+
+@dataclass
+class FileReport:
+    url: str
+    content: Optional[bytes] = None  # есть, только если отчет построен в этом запросе
+
+
+class ReportService:
+    """
+    Отчеты .pdf по файлам. Отчет строится в пуле процессов один раз на версию разметки
+    (ключ - хеш разметки и порога проекта), кладется в S3 и дальше отдается оттуда.
+    """
+
+    def __init__(self):
+        self.s3 = get_s3()
+
+    async def get_file_report(self, project_id: int, file_id: int) -> FileReport:
+        log.info(f"Getting report for file {file_id} from project {project_id}")
+
+        info = await ProjectFile.get_report_info(file_id)
+        if not info or info.ProjectFile.project_id != project_id:
+            log.error(f"File with ID {file_id} not found")
+            raise HTTPException(status_code=404, detail="File not found")
+
+        file = info.ProjectFile
+        label = await label_service.get_label(file.id, file.s3_txt_path)
+        digest = report_key(label, info.confidence_threshold)
+        if file.s3_report_url and file.report_label_hash == digest:
+            return FileReport(url=file.s3_report_url)
+
+        report = await self._generate(file.id, digest)
+        if report is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        return report
+
+    @staticmethod
+    def schedule(file_id: int) -> None:
+        """
+        Заранее строит отчет для свежей разметки, не задерживая запрос. Файлы копятся в очереди
+        report.pregenerate_delay_seconds и строятся по одному: пачка /yolo занимает не больше одного процесса пула,
+        остальные остаются запросам отчетов, а повторная разметка файла за паузу дает одну сборку
+        """
+        global _pregenerate_task
+        if not CONFIG.report.pregenerate:
+            return
+        _pending.add(file_id)
+        if _pregenerate_task is None:
+            _pregenerate_task = spawn(ReportService()._pregenerate_pending, name="report pregeneration")
+
+    async def _pregenerate_pending(self) -> None:
+        global _pregenerate_task
+        try:
+            while _pending:
+                await asyncio.sleep(CONFIG.report.pregenerate_delay_seconds)
+                file_ids = sorted(_pending)
+                _pending.clear()
+                for file_id in file_ids:
+                    try:
+                        await self._pregenerate(file_id)
+                    except Exception as e:
+                        log.error(f"Report pregeneration for file {file_id} failed: {str(e)}")
+        finally:
+            _pregenerate_task = None
+
+    async def _pregenerate(self, file_id: int) -> None:
+        info = await ProjectFile.get_report_info(file_id)
+        if not info:
+            return
+        file = info.ProjectFile
+        label = await label_service.get_label(file.id, file.s3_txt_path)
+        digest = report_key(label, info.confidence_threshold)
+        if file.report_label_hash != digest:
+            await self._generate(file.id, digest)
+
+    async def _generate(self, file_id: int, digest: str) -> Optional[FileReport]:
+        key = (file_id, digest)
+        task = _in_flight.get(key)
+        if task is None:
+            # Пустой контекст: задача переживает запрос и не должна использовать его сессию БД
+            task = asyncio.create_task(self._build_and_store(file_id, digest), context=contextvars.Context())
+            _in_flight[key] = task
+            task.add_done_callback(lambda _: _in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _build_and_store(self, file_id: int, digest: str) -> Optional[FileReport]:
+        """Строит отчет и кладет его в S3. None - файл удалили, пока сборка ждала очереди"""
+        info = await ProjectFile.get_report_info(file_id)
+        if info is None:
+            log.info(f"File {file_id} was deleted, report skipped")
+            return None
+        file = info.ProjectFile
+        label = await label_service.get_label(file.id, file.s3_txt_path)
+        # Пока ждали, могли прийти новая разметка или порог - строим по ним
+        digest = report_key(label, info.confidence_threshold)
+
+        pdf_bytes = await run_in_process(build_file_report, file.filename, file.project_id, label, info.confidence_threshold)
+
+        s3_report_path = f"{file.object_stem}_report_{digest[:16]}.pdf"
+        s3_report_url = await asyncio.to_thread(self.s3.write_bytes, s3_report_path, pdf_bytes, "application/pdf")
+        old_report_path = file.s3_report_path
+        await ProjectFile.update_report_path(file_id, s3_report_path, s3_report_url, report_label_hash=digest)
+        if old_report_path and old_report_path != s3_report_path:
+            await asyncio.to_thread(self.s3.delete, old_report_path)
+
+        log.info(f"Report for file {file_id} stored: {s3_report_url}")
+        return FileReport(url=s3_report_url, content=pdf_bytes)
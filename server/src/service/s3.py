@@ -1,11 +1,22 @@
+import dataclasses
+import functools
+import hashlib
 import os
 import re
 from pathlib import Path
+from typing import Iterator, Optional
 
 import boto3
 from botocore.config import Config
 
-from utils.config import S3Config
+from utils.config import CONFIG, S3Config
+
+# Максимум ключей в одном запросе DeleteObjects
+DELETE_BATCH_SIZE = 1000
+# Размер части multipart upload (минимум S3 - 5 МБ для всех частей, кроме последней)
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+# Коды ошибки ClientError для отсутствующего объекта: NoSuchKey у GetObject, 404 у HeadObject
+NOT_FOUND_CODES = {"NoSuchKey", "404"}
 
 
 class S3:
@@ -16,7 +27,7 @@ class S3:
             endpoint_url=s3_config.url,
             aws_access_key_id=s3_config.login,
             aws_secret_access_key=s3_config.password,
-            config=Config(signature_version="s3v4"),
+            config=Config(signature_version="s3v4", max_pool_connections=s3_config.max_connections),
         )
 
     def get_local_file(self, s3_file, local_file=None) -> str:
@@ -87,6 +98,36 @@ class S3:
     def delete(self, filename: str):
         self.s3_client.delete_object(Bucket=self.s3_config.bucket, Key=filename)
 
+    def list_keys(self, prefix: str) -> Iterator[list[str]]:
+        """Все ключи под префиксом, включая вложенные, страницами list_objects_v2 (до 1000 ключей)"""
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.s3_config.bucket, Prefix=prefix):
+            keys = [obj["Key"] for obj in page.get("Contents", [])]
+            if keys:
+                yield keys
+
+    def delete_many(self, filenames: list[str]) -> list[str]:
+        """
+        Удаляет до DELETE_BATCH_SIZE объектов одним запросом DeleteObjects.
+        Возвращает ключи, которые удалить не удалось; отсутствующие объекты ошибкой не считаются
+        """
+        response = self.s3_client.delete_objects(
+            Bucket=self.s3_config.bucket,
+            Delete={"Objects": [{"Key": filename} for filename in filenames], "Quiet": True},
+        )
+        return [error["Key"] for error in response.get("Errors", [])]
+
+    def copy(self, source: str, filename: str, source_bucket: Optional[str] = None) -> str:
+        """Копирует объект на стороне S3, без скачивания. source_bucket - бакет источника, по умолчанию этот же"""
+        source_bucket = source_bucket or self.s3_config.bucket
+        try:
+            self.s3_client.copy_object(Bucket=self.s3_config.bucket, Key=filename,
+                                       CopySource={"Bucket": source_bucket, "Key": source})
+            return self.url(filename)
+        except self.s3_client.exceptions.ClientError as e:
+            raise RuntimeError(f"Failed to copy {source_bucket}/{source} to {filename} "
+                               f"in bucket {self.s3_config.bucket}: {e}") from e
+
     def exists(self, filename: str) -> bool:
         try:
             self.s3_client.head_object(Bucket=self.s3_config.bucket, Key=filename)
@@ -96,12 +137,27 @@ class S3:
                 return False
             raise
 
+    def get_bytes(self, filename: str) -> bytes:
+        try:
+            return self.s3_client.get_object(Bucket=self.s3_config.bucket, Key=filename)["Body"].read()
+        except self.s3_client.exceptions.ClientError as err:
+            # Остальные ошибки (доступ, сеть, сбой хранилища) - не отсутствие объекта
+            if err.response["Error"]["Code"] not in NOT_FOUND_CODES:
+                raise
+            raise FileNotFoundError(f"File {filename} not found in bucket {self.s3_config.bucket}") from err
+
+    def open_upload(self, filename: str, content_type: str = "application/octet-stream") -> "MultipartUpload":
+        """Объект S3, который пишется потоком частями multipart upload - без временного файла"""
+        return MultipartUpload(self, filename, content_type)
+
     def get_file_content_as_str(self, filename: str) -> str:
         try:
             s3_response = self.s3_client.get_object(Bucket=self.s3_config.bucket, Key=filename)
             content = s3_response["Body"].read().decode("utf-8")
             return content
         except self.s3_client.exceptions.ClientError as err:
+            if err.response["Error"]["Code"] not in NOT_FOUND_CODES:
+                raise
             raise FileNotFoundError(f"File {filename} not found in bucket {self.s3_config.bucket}") from err
 
     def write_file(self, filename: str, content: str):
@@ -110,9 +166,85 @@ class S3:
         except self.s3_client.exceptions.ClientError as e:
             raise RuntimeError(f"Failed to write file {filename} to bucket {self.s3_config.bucket}: {e}") from e
 
+    def url(self, filename: str) -> str:
+        """Публичная ссылка на объект, объект для этого не нужен"""
+        return f"{self.s3_config.url}/{self.s3_config.bucket}/{filename}"
+
+    def write_bytes(self, filename: str, content: bytes, content_type: str = "application/octet-stream") -> str:
+        try:
+            self.s3_client.put_object(Bucket=self.s3_config.bucket, Key=filename, Body=content, ContentType=content_type)
+            return self.url(filename)
+        except self.s3_client.exceptions.ClientError as e:
+            raise RuntimeError(f"Failed to write file {filename} to bucket {self.s3_config.bucket}: {e}") from e
+
+    def put_file(self, local_file: str, s3_file: str, content_type: str = "application/octet-stream") -> str:
+        try:
+            self.s3_client.upload_file(local_file, self.s3_config.bucket, s3_file, ExtraArgs={"ContentType": content_type})
+            return self.url(s3_file)
+        except Exception as e:
+            raise RuntimeError(f"Failed to upload {s3_file} to bucket {self.s3_config.bucket}: {e}") from e
+
     def upload_file(self, local_file, s3_file) -> str:
         try:
             self.s3_client.upload_file(local_file, self.s3_config.bucket, s3_file)
-            return f"{self.s3_config.url}/{self.s3_config.bucket}/{s3_file}"
+            return self.url(s3_file)
         except Exception as e:
             return f"Ошибка при загрузке {s3_file}: {str(e)}"
+
+
+class MultipartUpload:
+    """
+    Файловый объект только для записи (write) поверх multipart upload: данные уходят в S3 частями
+    по MULTIPART_PART_SIZE, в памяти - не больше одной части. Объект появляется после complete(),
+    при ошибке загрузку нужно отменить abort(), иначе части останутся в бакете.
+    Попутно считаются размер и SHA-256 содержимого. Подходит как приемник для tarfile и pyarrow.PythonFile.
+    """
+
+    def __init__(self, s3: S3, filename: str, content_type: str):
+        self.s3 = s3
+        self.filename = filename
+        self.upload_id = s3.s3_client.create_multipart_upload(
+            Bucket=s3.s3_config.bucket, Key=filename, ContentType=content_type)["UploadId"]
+        self.parts: list[dict] = []
+        self.buffer = bytearray()
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.size += len(data)
+        self.digest.update(data)
+        while len(self.buffer) >= MULTIPART_PART_SIZE:
+            self._upload_part(bytes(self.buffer[:MULTIPART_PART_SIZE]))
+            del self.buffer[:MULTIPART_PART_SIZE]
+        return len(data)
+
+    def _upload_part(self, body: bytes) -> None:
+        number = len(self.parts) + 1
+        response = self.s3.s3_client.upload_part(Bucket=self.s3.s3_config.bucket, Key=self.filename,
+                                                 UploadId=self.upload_id, PartNumber=number, Body=body)
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+
+    def complete(self) -> str:
+        if self.buffer or not self.parts:
+            self._upload_part(bytes(self.buffer))
+            self.buffer.clear()
+        self.s3.s3_client.complete_multipart_upload(Bucket=self.s3.s3_config.bucket, Key=self.filename,
+                                                    UploadId=self.upload_id, MultipartUpload={"Parts": self.parts})
+        self.closed = True
+        return self.s3.url(self.filename)
+
+    def abort(self) -> None:
+        self.s3.s3_client.abort_multipart_upload(Bucket=self.s3.s3_config.bucket, Key=self.filename,
+                                                 UploadId=self.upload_id)
+        self.closed = True
+
+
+@functools.cache
+def get_s3(bucket: Optional[str] = None) -> S3:
+    """
+    Общий клиент S3: boto3-клиент потокобезопасен, а его создание стоит десятки миллисекунд.
+    bucket - другой бакет того же хранилища, по умолчанию основной
+    """
+    return S3(CONFIG.s3 if bucket is None else dataclasses.replace(CONFIG.s3, bucket=bucket))
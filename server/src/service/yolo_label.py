@@ -0,0 +1,182 @@
+import functools
+import warnings
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+# Эталонные классы: в разметке есть, но дефектами не считаются
+REFERENCE_CLASSES = frozenset({6, 7, 8})
+
+_EMPTY_COORDS = np.empty((0, 2), dtype=np.float32)
+
+# Допустимые номера классов: хранятся в int16
+_CLASS_ID_MIN, _CLASS_ID_MAX = int(np.iinfo(np.int16).min), int(np.iinfo(np.int16).max)
+
+# Направления для оценки максимального размера (диаметра Ферета): ошибка не больше 1 - cos(pi / 2 / 16), < 0.5%
+_FERET_ANGLES = np.linspace(0, np.pi, 16, endpoint=False)
+_FERET_DIRECTIONS = np.stack([np.cos(_FERET_ANGLES), np.sin(_FERET_ANGLES)])
+
+
+@dataclass(frozen=True)
+class LabelGeometry:
+    """Метрики объектов разметки, по одному значению на объект. Единицы - пиксели изображения"""
+    area: np.ndarray  # Площадь полигона
+    perimeter: np.ndarray
+    max_extent: np.ndarray  # Максимальный размер (диаметр Ферета)
+    bbox: np.ndarray  # (n, 4): x, y, ширина, высота
+    area_ratio: np.ndarray  # Доля площади изображения
+
+
+class YoloLabel:
+    """
+    YOLO-разметка (сегментация) в колоночном виде.
+    Объект i: класс class_ids[i], полигон coords[offsets[i]:offsets[i + 1]] - точки (x, y) в float32,
+    уверенность confidences[i]. Уверенность - последнее число строки при нечетном количестве чисел
+    после класса (как в save_conf ultralytics), без нее - NaN.
+
+    Классы разбираются сразу - их хватает для подсчетов и вердикта.
+    Координаты переводятся в числа только при первом обращении, дальше берутся готовые.
+    """
+
+    def __init__(self, class_ids: np.ndarray, tails: list[str]):
+        self.class_ids = class_ids
+        self._tails = tails  # Текст координат по объектам, до разбора
+
+    def __len__(self) -> int:
+        return len(self.class_ids)
+
+    @functools.cached_property
+    def _polygons(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        polygons = []
+        confidences = np.full(len(self._tails), np.nan, dtype=np.float32)
+        with warnings.catch_warnings():
+            # Старые версии numpy на мусоре в строке не падают, а предупреждают и обрезают результат
+            warnings.simplefilter("error", DeprecationWarning)
+            for i, tail in enumerate(self._tails):
+                try:
+                    values = np.fromstring(tail, dtype=np.float32, sep=" ")
+                except (ValueError, DeprecationWarning):
+                    values = _EMPTY_COORDS
+                if len(values) % 2:
+                    confidences[i] = values[-1]
+                polygons.append(values[: len(values) // 2 * 2].reshape(-1, 2))
+        self._tails = None
+
+        offsets = np.zeros(len(polygons) + 1, dtype=np.int32)
+        np.cumsum([len(polygon) for polygon in polygons], out=offsets[1:])
+        coords = np.concatenate(polygons) if polygons else _EMPTY_COORDS
+        for array in (offsets, coords, confidences):
+            array.flags.writeable = False
+        return offsets, coords, confidences
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._polygons[0]
+
+    @property
+    def coords(self) -> np.ndarray:
+        return self._polygons[1]
+
+    @property
+    def confidences(self) -> np.ndarray:
+        return self._polygons[2]
+
+    def polygon(self, i: int) -> np.ndarray:
+        offsets, coords, _ = self._polygons
+        return coords[offsets[i]:offsets[i + 1]]
+
+    def geometry(self, width: float = 1.0, height: float = 1.0) -> LabelGeometry:
+        """
+        Площадь, периметр, максимальный размер и bbox всех полигонов разом, без цикла по объектам.
+        Координаты YOLO нормированы, width и height переводят их в пиксели.
+        Полигоны меньше чем из 3 точек получают нулевую площадь.
+        """
+        offsets, coords, _ = self._polygons
+        n = len(self)
+        lengths = np.diff(offsets)
+        points = coords.astype(np.float64) * (width, height)
+        owner = np.repeat(np.arange(n), lengths)  # Номер объекта для каждой точки
+
+        # Следующая точка полигона, последняя замыкается на первую
+        following = np.arange(len(points)) + 1
+        nonempty = lengths > 0
+        following[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+        x, y = points[:, 0], points[:, 1]
+        x_next, y_next = x[following], y[following]
+
+        area = np.abs(np.bincount(owner, weights=x * y_next - x_next * y, minlength=n)) / 2
+        area[lengths < 3] = 0
+        perimeter = np.bincount(owner, weights=np.hypot(x_next - x, y_next - y), minlength=n)
+
+        bbox = np.zeros((n, 4))
+        max_extent = np.zeros(n)
+        if nonempty.any():
+            starts = offsets[:-1][nonempty]
+            low = np.minimum.reduceat(points, starts)
+            high = np.maximum.reduceat(points, starts)
+            bbox[nonempty] = np.hstack([low, high - low])
+            projections = points @ _FERET_DIRECTIONS
+            spans = np.maximum.reduceat(projections, starts) - np.minimum.reduceat(projections, starts)
+            max_extent[nonempty] = spans.max(axis=1)
+
+        return LabelGeometry(area=area, perimeter=perimeter, max_extent=max_extent, bbox=bbox,
+                             area_ratio=area / (width * height))
+
+    def confident_mask(self, min_confidence: Optional[float] = None) -> np.ndarray:
+        """Маска объектов с уверенностью не ниже порога. Объекты без уверенности проходят любой порог"""
+        if min_confidence is None:
+            return np.ones(len(self), dtype=bool)
+        return ~(self.confidences < min_confidence)
+
+    def class_counts(self, min_confidence: Optional[float] = None) -> dict[int, int]:
+        """Количество объектов каждого класса (с уверенностью не ниже min_confidence)"""
+        class_ids = self.class_ids if min_confidence is None else self.class_ids[self.confident_mask(min_confidence)]
+        classes, counts = np.unique(class_ids, return_counts=True)
+        return dict(zip(classes.tolist(), counts.tolist(), strict=True))
+
+    def defect_mask(self, min_confidence: Optional[float] = None) -> np.ndarray:
+        """Маска объектов, которые считаются дефектами: не эталонных классов и с уверенностью не ниже min_confidence"""
+        mask = ~np.isin(self.class_ids, list(REFERENCE_CLASSES))
+        if min_confidence is not None:
+            mask &= self.confident_mask(min_confidence)
+        return mask
+
+    def has_defects(self, min_confidence: Optional[float] = None) -> bool:
+        """Есть ли хоть один дефект (см. defect_mask)"""
+        return bool(np.any(self.defect_mask(min_confidence)))
+
+    def to_text(self, mask: Optional[np.ndarray] = None) -> str:
+        """Разметка в стандартном формате YOLO - класс и полигон, без уверенности. mask - какие объекты оставить"""
+        lines = []
+        for i, class_id in enumerate(self.class_ids.tolist()):
+            if mask is None or mask[i]:
+                lines.append(" ".join([str(class_id)] + [f"{value:.6g}" for value in self.polygon(i).ravel().tolist()]))
+        return "".join(line + "\n" for line in lines)
+
+
+@functools.lru_cache(maxsize=64)
+def parse_label(text: str) -> YoloLabel:
+    """
+    Разбирает текст YOLO-разметки. Пустые строки и строки с нечисловым классом или классом вне int16 пропускаются.
+    Результат кешируется по тексту: одна версия разметки разбирается один раз на процесс,
+    поэтому возвращаемый объект менять нельзя.
+    """
+    class_ids = []
+    tails = []
+    for line in text.splitlines():
+        parts = line.split(maxsplit=1)
+        if not parts:
+            continue
+        try:
+            class_id = int(parts[0])
+        except ValueError:
+            continue
+        if not _CLASS_ID_MIN <= class_id <= _CLASS_ID_MAX:
+            continue
+        class_ids.append(class_id)
+        tails.append(parts[1] if len(parts) > 1 else "")
+
+    class_ids = np.array(class_ids, dtype=np.int16)
+    class_ids.flags.writeable = False
+    return YoloLabel(class_ids, tails)
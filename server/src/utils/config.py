@@ -1,5 +1,6 @@
+import dataclasses
 import os
-from dataclasses import dataclass, fields, is_dataclass
+from dataclasses import MISSING, dataclass, fields, is_dataclass
 
 import yaml  # pyright: ignore[reportMissingModuleSource]
 
@@ -23,6 +24,8 @@ class S3Config:
     login: str
     password: str
     bucket: str
+    training_bucket: str = "train-data-dop"  # Обучающие выборки (DatasetExportService)
+    max_connections: int = 50  # Пул соединений клиента: пакетные задачи копируют и удаляют параллельно
 
 @dataclass
 class PandaConfig:
@@ -71,6 +74,43 @@ class ConfigDB:
 
 
 
+@dataclass
+class ProcessPoolConfig:
+    max_workers: int = 2
+
+
+@dataclass
+class ReportConfig:
+    pregenerate: bool = True
+    pregenerate_delay_seconds: int = 5  # Пауза перед заранее строящимися отчетами: за нее копятся повторные /yolo
+
+
+@dataclass
+class BatchConfig:
+    dispatch_concurrency: int = 16
+    cursor_batch_size: int = 500
+    reprocess_rate: float = 10.0  # Файлов в секунду при досчете после смены модели
+    delete_concurrency: int = 8  # Одновременных запросов DeleteObjects при удалении проекта
+    export_concurrency: int = 32  # Одновременных копирований (скачиваний для шардов) при выгрузке обучающей выборки
+    import_concurrency: int = 32  # Одновременных выгрузок разметки в S3 при импорте архива разметки
+
+
+@dataclass
+class AnalyticsConfig:
+    interval_minutes: int = 0  # Период выгрузки всех проектов в S3 (AnalyticsExportService), 0 - только по запросу
+    prefix: str = "analytics"
+    row_group_size: int = 65536  # Строк в группе Parquet: столько строк таблицы держится в памяти при записи
+
+
+@dataclass
+class DbStatsConfig:
+    headers: bool = False  # Заголовки X-DB-* в ответах: число запросов к БД, их время и самые долгие (для отладки)
+    slowest: int = 3  # Сколько самых долгих запросов запоминается за HTTP-запрос
+    # Превышение бюджета запросов эндпоинта - ошибка 500, иначе предупреждение в лог. Только для проверочных прогонов:
+    # изменения, зафиксированные DAO до конца запроса, ошибка не отменяет (rest.db_stats.check_query_budget)
+    enforce_budgets: bool = False
+
+
 @dataclass
 class Config:
     profile: str
@@ -81,6 +121,11 @@ class Config:
     panda: PandaConfig
     db: ConfigDB
     recognize_service: str
+    process_pool: ProcessPoolConfig = dataclasses.field(default_factory=ProcessPoolConfig)
+    batch: BatchConfig = dataclasses.field(default_factory=BatchConfig)
+    report: ReportConfig = dataclasses.field(default_factory=ReportConfig)
+    analytics: AnalyticsConfig = dataclasses.field(default_factory=AnalyticsConfig)
+    db_stats: DbStatsConfig = dataclasses.field(default_factory=DbStatsConfig)
 
 
 class ConfigLoader:
@@ -143,6 +188,8 @@ class ConfigLoader:
                 # Получаем значение для обычного поля
                 fname = f"{outer_name}{field.name}"
                 val = get_value_func(fname)
+                if val is None and field.default is not MISSING:
+                    val = field.default
                 if val is None:
                     msg = f"Field {fname} is not specified"
                     raise Exception(msg)
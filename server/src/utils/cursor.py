@@ -0,0 +1,24 @@
+import base64
+import json
+
+
+def encode_cursor(*values) -> str:
+    """Упаковывает ключ последней строки страницы в непрозрачную строку для клиента"""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """
+    Распаковывает курсор, выданный encode_cursor.
+
+    :raises ValueError: если курсор поврежден или не той длины
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
@@ -0,0 +1,12 @@
+from prometheus_client import Counter, Histogram
+
+# Все запросы к БД, в том числе фоновых задач (dao.base)
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Время выполнения запроса к БД")
+
+# Запросы к БД в разрезе HTTP-запросов (rest.db_stats.DbStatsMiddleware), route - шаблон пути эндпоинта
+HTTP_DB_QUERIES = Histogram("http_request_db_queries", "Запросов к БД за HTTP-запрос", ["method", "route"],
+                            buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+HTTP_DB_SECONDS = Histogram("http_request_db_duration_seconds", "Суммарное время запросов к БД за HTTP-запрос",
+                            ["method", "route"])
+HTTP_DB_BUDGET_EXCEEDED = Counter("http_request_db_budget_exceeded", "HTTP-запросы сверх бюджета запросов к БД эндпоинта",
+                                  ["method", "route"])
@@ -0,0 +1,32 @@
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from utils.config import CONFIG
+
+T = TypeVar("T")
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Общий пул процессов для CPU-тяжелых задач (декодирование картинок, сборка PDF)"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=CONFIG.process_pool.max_workers)
+    return _executor
+
+
+async def run_in_process(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Выполняет функцию в пуле процессов, не блокируя event loop.
+    Функция и аргументы должны быть picklable (функции уровня модуля)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_process_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,147 @@
+"""
+Проверочный прогон API: приложение rest.router_init.app через TestClient на настоящей БД из config.yml
+(запуск из каталога server, как у bench). Миграции применяются при старте, S3 заменен хранилищем в памяти.
+Воркер распознавания не нужен: версия его модели подставляется, отправка файлов в фоне просто не удается.
+Тесты создают свои проекты и удаляют их. Гонять на отдельной базе, не на рабочей.
+"""
+import io
+import random
+from typing import Dict, Iterator, List, Optional
+
+import psycopg2
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import service.s3 as s3_module
+from main import Main
+from rest.router_init import app
+from service.file_service import FileService
+from utils.config import CONFIG
+
+# Начало имени проектов тестов: по нему они удаляются после прогона
+PROJECT_NAME = "test-api"
+
+MODEL_VERSION = "test-model"
+
+LABEL = "1 0.1 0.1 0.4 0.1 0.4 0.4 0.1 0.4 0.9\n7 0.5 0.5 0.6 0.5 0.6 0.6 0.8\n"
+
+
+class MemoryS3(s3_module.S3):
+    """S3 в памяти: объекты основного бакета в словаре, без обращения к хранилищу"""
+
+    def __init__(self, s3_config):
+        self.s3_config = s3_config
+        self.objects: Dict[str, bytes] = {}
+
+    def delete(self, filename: str):
+        self.objects.pop(filename, None)
+
+    def list_keys(self, prefix: str) -> Iterator[List[str]]:
+        keys = sorted(key for key in self.objects if key.startswith(prefix))
+        if keys:
+            yield keys
+
+    def delete_many(self, filenames: List[str]) -> List[str]:
+        for filename in filenames:
+            self.objects.pop(filename, None)
+        return []
+
+    def copy(self, source: str, filename: str, source_bucket: Optional[str] = None) -> str:
+        self.objects[filename] = self.get_bytes(source)
+        return self.url(filename)
+
+    def exists(self, filename: str) -> bool:
+        return filename in self.objects
+
+    def get_bytes(self, filename: str) -> bytes:
+        if filename not in self.objects:
+            raise FileNotFoundError(f"File {filename} not found in bucket {self.s3_config.bucket}")
+        return self.objects[filename]
+
+    def get_file_content_as_str(self, filename: str) -> str:
+        return self.get_bytes(filename).decode("utf-8")
+
+    def write_file(self, filename: str, content: str):
+        self.objects[filename] = content.encode("utf-8")
+
+    def write_bytes(self, filename: str, content: bytes, content_type: str = "application/octet-stream") -> str:
+        self.objects[filename] = content
+        return self.url(filename)
+
+    def put_file(self, local_file: str, s3_file: str, content_type: str = "application/octet-stream") -> str:
+        with open(local_file, "rb") as file:
+            return self.write_bytes(s3_file, file.read(), content_type)
+
+    def upload_file(self, local_file, s3_file) -> str:
+        return self.put_file(local_file, s3_file)
+
+
+def jpeg() -> bytes:
+    """Снимок со случайным содержимым: у каждого свой хеш, загрузка не находит готовый blob"""
+    image = Image.new("RGB", (64, 48), tuple(random.randrange(256) for _ in range(3)))
+    image.putpixel((random.randrange(64), random.randrange(48)), (0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+async def fake_model_version(client) -> str:
+    return MODEL_VERSION
+
+
+@pytest.fixture(scope="session")
+def db():
+    """Соединение с БД тестов для подготовки данных и уборки"""
+    Main.wait_for_postgres()
+    Main.run_migrations()
+    conn = psycopg2.connect(host=CONFIG.db.host, port=CONFIG.db.port, user=CONFIG.db.username,
+                            password=CONFIG.db.password, database=CONFIG.db.database)
+    conn.autocommit = True
+    try:
+        yield conn
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM projects WHERE name LIKE %s", (f"{PROJECT_NAME}%",))
+            # Изображения тестов есть только в MemoryS3: их записи удаляются без объектов
+            cursor.execute("DELETE FROM blobs WHERE ref_count <= 0")
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def client(db) -> Iterator[TestClient]:
+    """
+    Клиент API. Превышение бюджета запросов эндпоинта - исключение QueryBudgetExceeded в тесте,
+    число запросов - в заголовке X-DB-Queries
+    """
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(CONFIG.db_stats, "headers", True)
+        patch.setattr(CONFIG.db_stats, "enforce_budgets", True)
+        patch.setattr(CONFIG.report, "pregenerate", False)
+        patch.setattr(CONFIG.analytics, "interval_minutes", 0)
+        patch.setattr(s3_module, "S3", MemoryS3)
+        patch.setattr(FileService, "get_model_version", staticmethod(fake_model_version))
+        s3_module.get_s3.cache_clear()
+        try:
+            with TestClient(app) as client:
+                yield client
+        finally:
+            s3_module.get_s3.cache_clear()
+
+
+@pytest.fixture
+def project_id(client: TestClient) -> int:
+    response = client.post("/api/projects", json={"name": PROJECT_NAME})
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+@pytest.fixture
+def file_id(client: TestClient, project_id: int) -> int:
+    """Распознанный файл проекта: загружен и размечен, как это делает воркер"""
+    response = client.post(f"/projects/{project_id}/files", files={"file": ("photo.jpg", jpeg(), "image/jpeg")})
+    assert response.status_code == 200, response.text
+    file_id = response.json()["id"]
+    response = client.post("/yolo", params={"project_id": project_id, "file_id": file_id, "label": LABEL})
+    assert response.status_code == 200, response.text
+    return file_id
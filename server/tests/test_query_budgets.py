@@ -0,0 +1,90 @@
+"""
+Бюджеты запросов к БД (rest.db_stats.query_budget): каждый эндпоинт с бюджетом вызывается на проекте
+с распознанным файлом, число запросов до начала ответа не должно его превышать
+"""
+import io
+import zipfile
+
+import pytest
+from conftest import LABEL, PROJECT_NAME, jpeg
+from fastapi.testclient import TestClient
+
+from rest import file_endpoint, project_endpoint, yolo_endpoint
+from service.event_service import EVENT_BUS
+
+
+def label_archive() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("labels/photo.txt", LABEL)
+    return buffer.getvalue()
+
+
+# Запрос к каждому эндпоинту с бюджетом: {project_id}, {file_id} и {job_id} подставляются
+REQUESTS = {
+    ("POST", "/api/projects"): dict(json={"name": PROJECT_NAME}),
+    ("GET", "/api/projects"): dict(params={"name": PROJECT_NAME}),
+    ("GET", "/api/projects/{project_id}"): {},
+    ("DELETE", "/api/projects/{project_id}"): {},
+    ("PUT", "/api/projects/{project_id}"): dict(json={"name": PROJECT_NAME}),
+    ("PUT", "/api/projects/{project_id}/confidence-threshold"): dict(json={"threshold": 0.5}),
+    ("PUT", "/api/projects/{project_id}/near-duplicate-distance"): dict(json={"max_distance": 2}),
+    ("GET", "/api/projects/{project_id}/near-duplicates"): {},
+    ("GET", "/api/projects/{project_id}/status"): {},
+    ("POST", "/api/projects/{project_id}"): {},
+    ("POST", "/api/projects/{project_id}/reprocess"): {},
+    ("POST", "/api/projects/{project_id}/training-export"): dict(json={}),
+    ("POST", "/api/projects/{project_id}/labels/import"): dict(files={"archive": ("labels.zip", label_archive(), "application/zip")}),
+    ("GET", "/api/projects/{project_id}/analytics/{table}"): {},
+    ("POST", "/api/projects/{project_id}/analytics-export"): {},
+    ("GET", "/api/projects/{project_id}/jobs/{job_id}"): {},
+    ("GET", "/api/projects/{project_id}/report/csv"): {},
+    ("POST", "/api/projects/{project_id}/report"): {},
+    ("GET", "/api/projects/{project_id}/events"): {},
+    ("POST", "/projects/{project_id}/files"): dict(files={"file": ("other.jpg", jpeg(), "image/jpeg")}),
+    ("GET", "/projects/{project_id}/files"): dict(params={"defect_class": [1]}),
+    ("GET", "/projects/{project_id}/files/{file_id}"): {},
+    ("GET", "/projects/{project_id}/files/{file_id}/detections"): {},
+    ("DELETE", "/projects/{project_id}/files/{file_id}"): {},
+    ("POST", "/projects/{project_id}/files/{file_id}/training"): {},
+    ("GET", "/projects/{project_id}/files/{file_id}/report"): dict(follow_redirects=False),
+    ("POST", "/yolo"): dict(params={"project_id": "{project_id}", "file_id": "{file_id}", "label": LABEL}),
+}
+
+
+def budgets() -> dict:
+    """(метод, путь) -> бюджет по маршрутам приложения"""
+    return {(method, route.path): route.endpoint.query_budget
+            for router in (project_endpoint.router, file_endpoint.router, yolo_endpoint.router)
+            for route in router.routes if hasattr(route.endpoint, "query_budget")
+            for method in route.methods}
+
+
+def test_every_budget_is_checked():
+    assert set(REQUESTS) == set(budgets())
+
+
+@pytest.mark.parametrize("method, path", list(REQUESTS), ids=[f"{method} {path}" for method, path in REQUESTS])
+def test_query_budget(method: str, path: str, client: TestClient, db, project_id: int, file_id: int,
+                      monkeypatch: pytest.MonkeyPatch):
+    async def no_events(project_id: int):
+        return
+        yield
+
+    # Поток событий бесконечный, а тело ответа в бюджет не входит
+    monkeypatch.setattr(EVENT_BUS, "subscribe", no_events)
+    with db.cursor() as cursor:
+        cursor.execute("INSERT INTO project_jobs(project_id, type, status, total) VALUES (%s, 'report', 'done', 0) "
+                       "RETURNING id", (project_id,))
+        job_id = cursor.fetchone()[0]
+    ids = dict(project_id=project_id, file_id=file_id, job_id=job_id, table="files")
+    kwargs = dict(REQUESTS[method, path])
+    if "params" in kwargs:
+        kwargs["params"] = {key: value.format(**ids) if isinstance(value, str) else value
+                            for key, value in kwargs["params"].items()}
+
+    response = client.request(method, path.format(**ids), **kwargs)
+
+    assert response.status_code < 400, response.text
+    assert int(response.headers["x-db-queries"]) <= budgets()[method, path]
+